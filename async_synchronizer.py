@@ -0,0 +1,229 @@
+import os
+import asyncio
+import logging
+from typing import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+
+from folder import Folder
+from manifest import Manifest, FileState
+from digest import Comparator
+from synchronizer import Synchronizer
+from errorlog import ErrorLog
+
+
+# number of file operations waiting for the executor per concurrent call
+PENDING_PER_CALL = 4
+
+
+class AsyncSynchronizer(Synchronizer):
+    """Synchronizer overlapping listings, stats and copies of many folders at once (for network filesystems).
+    Folders are processed by a fixed number of workers and pending file operations are bounded, so memory use
+    doesn't grow with the size of the tree"""
+    concurrency: int
+
+    def __init__(self, source: Folder, replica: Folder, manifest: Manifest | None = None,
+                 comparator: Comparator | None = None, concurrency: int = 32, error_limit: int = 1000,
+                 error_file: str | None = None) -> None:
+        """
+        :param source: folder with initial files
+        :param replica: intended copy of source folder
+        :param manifest: index of file states from previous runs (files are compared by comparator if None)
+        :param comparator: strategy of checking files for identity (byte by byte comparison if None)
+        :param concurrency: maximal number of blocking filesystem calls running at once
+        :param error_limit: maximal number of failed paths of each kind kept in memory during a cycle
+        :param error_file: path to a file where failed paths over the limit are written (only counted if None)
+        """
+        super().__init__(source, replica, manifest, comparator=comparator, error_limit=error_limit,
+                         error_file=error_file)
+        if concurrency < 1:
+            raise ValueError("Concurrency should be positive")
+        self.concurrency = concurrency
+        self._executor: ThreadPoolExecutor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _blocking(self, action: Callable, *args):
+        """
+        Runs blocking call in the executor limiting number of concurrent calls
+
+        :param action: blocking function
+        :param args: arguments of the function
+        :returns: result of the function
+        """
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, action, *args)
+
+    async def _operation(self, errors: ErrorLog, message: str, error_path: str, action: Callable, *args) -> None:
+        """
+        Runs file operation catching its errors
+
+        :param errors: log of failed paths where error_path is put if operation fails
+        :param message: message logged if operation fails
+        :param error_path: path reported if operation fails
+        :param action: blocking operation
+        :param args: arguments of operation
+        """
+        try:
+            await self._blocking(action, *args)
+        except:
+            logging.exception(message)
+            errors.append(error_path)
+
+    async def _pending_operation(self, errors: ErrorLog, message: str, error_path: str, action: Callable,
+                                 *args) -> None:
+        """
+        Runs file operation releasing its slot of pending operations at the end
+        """
+        try:
+            await self._operation(errors, message, error_path, action, *args)
+        finally:
+            self._slots.release()
+
+    async def _schedule(self, errors: ErrorLog, message: str, error_path: str, action: Callable, *args) -> None:
+        """
+        Starts file operation as a task waiting until the number of pending operations is below the limit
+
+        :param errors: log of failed paths where error_path is put if operation fails
+        :param message: message logged if operation fails
+        :param error_path: path reported if operation fails
+        :param action: blocking operation
+        :param args: arguments of operation
+        """
+        await self._slots.acquire()
+        task = asyncio.create_task(self._pending_operation(errors, message, error_path, action, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _folder_worker(self, folders: asyncio.Queue, remove_errors: ErrorLog, update_errors: ErrorLog) -> None:
+        """
+        Synchronizes folders from the queue reporting a folder as failed if it could not be synchronized
+
+        :param folders: queue of paths to folders in source and replica
+        :param remove_errors: log of failed to remove files
+        :param update_errors: log of failed to copy files
+        """
+        while True:
+            s_base, r_base = await folders.get()
+            try:
+                await self._sync_folder_async(s_base, r_base, remove_errors, update_errors, folders)
+            except:
+                logging.exception("Could not update a file!")
+                update_errors.append(s_base)
+            finally:
+                folders.task_done()
+
+    async def _walk(self, remove_errors: ErrorLog, update_errors: ErrorLog) -> None:
+        """
+        Synchronizes the entire tree by folder workers and waits for all file operations
+
+        :param remove_errors: log of failed to remove files
+        :param update_errors: log of failed to copy files
+        """
+        folders = asyncio.Queue()
+        folders.put_nowait((self.source.path, self.replica.path))
+        workers = [asyncio.create_task(self._folder_worker(folders, remove_errors, update_errors))
+                   for _ in range(self.concurrency)]
+        try:
+            await folders.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        await self._drain()
+
+    async def _drain(self) -> None:
+        """
+        Waits for all started file operations
+        """
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    async def _sync_folder_async(self, s_base: str, r_base: str, remove_errors: ErrorLog,
+                                 update_errors: ErrorLog, folders: asyncio.Queue) -> None:
+        """
+        Synchronizes files of a folder in source with its copy in replica starting their operations concurrently.
+        Subfolders are put to the queue
+
+        :param s_base: path to a current folder in source
+        :param r_base: path to a current folder in replica
+        :param remove_errors: log of failed to remove files
+        :param update_errors: log of failed to copy files
+        :param folders: queue of paths to folders in source and replica
+        """
+        s_files, r_files = await asyncio.gather(self._blocking(self._scan, self.source.scan, s_base),
+                                                self._blocking(self._scan, self.replica.scan, r_base))
+        self.stats.add('dirs_scanned')
+        await self._blocking(self._detect_renames, s_files, r_files, s_base, r_base)
+
+        obsolete = r_files.keys() - s_files.keys()
+        if len(obsolete) > 0:
+            logging.info(f"Found {len(obsolete)} obsolete file(s)")
+        for file in obsolete:
+            r_entry = r_files[file]
+            if self._deferred is not None:
+                self._deferred.append(r_entry)
+            else:
+                await self._schedule(remove_errors, "Could not remove file", r_entry.path,
+                                     self._remove_file, r_entry.path, r_entry)
+
+        for file, s_entry in s_files.items():
+            s_full_file = os.path.join(s_base, file)
+            r_full_file = os.path.join(r_base, file)
+            if self.manifest is not None and (s_entry.is_dir or file not in r_files):
+                # inodes of folders and new files are recorded to find them if they are moved
+                self.manifest.put(s_full_file, FileState.from_stat(s_entry))
+            if file not in r_files:
+                await self._schedule(update_errors, "Could not copy a file!", s_full_file,
+                                     self._copy_new, s_full_file, r_full_file, s_entry)
+            elif s_entry.is_dir:
+                folders.put_nowait((s_full_file, r_full_file))
+            else:
+                await self._schedule(update_errors, "Could not update a file!", s_full_file,
+                                     self._refresh_file, s_full_file, r_full_file, s_entry, r_files[file])
+
+    async def sync_folders(self) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes source folder with replica
+
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        if not await asyncio.to_thread(self._check_folders):
+            return await self.sync_folders()
+        self._begin_cycle()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="async-sync") as executor:
+            self._executor = executor
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._slots = asyncio.Semaphore(self.concurrency * PENDING_PER_CALL)
+            # obsolete files are removed at the end of the cycle since they may be moved to another folder
+            self._deferred = list() if self.manifest is not None else None
+            remove_errors, update_errors = self._error_log('remove'), self._error_log('update')
+            try:
+                await self._walk(remove_errors, update_errors)
+                deferred, self._deferred = self._deferred or list(), None
+                for r_entry in deferred:
+                    if os.path.lexists(r_entry.path):
+                        await self._schedule(remove_errors, "Could not remove file", r_entry.path,
+                                             self._remove_file, r_entry.path, r_entry)
+                await self._drain()
+                await self._blocking(self._finish_cycle, remove_errors, update_errors)
+            finally:
+                for task in list(self._tasks):
+                    task.cancel()
+                self._tasks.clear()
+                self._deferred = None
+                self._executor = None
+        return remove_errors, update_errors
+
+    async def sync_paths(self, paths: Iterable[str]) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes only given files and folders (e.g. reported by a watcher) instead of entire source folder
+
+        :param paths: paths of changed files relative to source folder
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        if not await asyncio.to_thread(self._check_folders):
+            return await self.sync_folders()
+        # a few changed paths do not need concurrent processing
+        return await asyncio.to_thread(super().sync_paths, list(paths))
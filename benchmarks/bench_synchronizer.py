@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import logging
+import tempfile
+import resource
+
+# the benchmark is also run as a script from the repository root or the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from folder import Folder
+from manifest import Manifest
+from digest import DigestComparator, DigestStore
+from synchronizer import Synchronizer
+
+
+def parse_sizes(spec: str):
+    """
+    Parses file size distribution
+
+    :param spec: 'fixed:SIZE', 'uniform:MIN:MAX' or 'lognormal:MU:SIGMA' (sizes in bytes)
+    :returns: function generating a size from random generator
+    """
+    kind, *params = spec.split(':')
+    if kind == 'fixed':
+        size = int(params[0])
+        return lambda rnd: size
+    if kind == 'uniform':
+        low, high = map(int, params)
+        return lambda rnd: rnd.randint(low, high)
+    if kind == 'lognormal':
+        mu, sigma = map(float, params)
+        return lambda rnd: int(rnd.lognormvariate(mu, sigma))
+    raise ValueError(f"Unknown size distribution {spec!r}")
+
+
+def generate_tree(root: str, depth: int, fanout: int, files: int, sizes, seed: int = 0) -> tuple[int, int]:
+    """
+    Creates reproducible synthetic tree of folders and files
+
+    :param root: path to an existing empty folder
+    :param depth: number of nested folder levels
+    :param fanout: number of subfolders in each folder
+    :param files: number of files in each folder
+    :param sizes: function generating file size from random generator
+    :param seed: seed of random generator
+    :returns: number of created files and their total size in bytes
+    """
+    rnd = random.Random(seed)
+    count = total = 0
+    level = [root]
+    for current_depth in range(depth + 1):
+        next_level = list()
+        for folder in level:
+            for i in range(files):
+                size = sizes(rnd)
+                with open(os.path.join(folder, f"file{i}.bin"), 'wb') as file:
+                    file.write(rnd.randbytes(size))
+                count += 1
+                total += size
+            if current_depth < depth:
+                for i in range(fanout):
+                    os.mkdir(os.path.join(folder, f"dir{i}"))
+                    next_level.append(os.path.join(folder, f"dir{i}"))
+        level = next_level
+    return count, total
+
+
+def mutate_tree(root: str, percent: float, seed: int = 0) -> int:
+    """
+    Modifies a byte in given percentage of files (at least in one file)
+
+    :param root: path to a folder
+    :param percent: percentage of changed files
+    :param seed: seed of random generator
+    :returns: number of changed files
+    """
+    rnd = random.Random(seed)
+    paths = sorted(os.path.join(folder, file) for folder, _, files in os.walk(root) for file in files)
+    changed = rnd.sample(paths, min(len(paths), max(1, round(len(paths) * percent / 100))))
+    for path in changed:
+        with open(path, 'r+b') as file:
+            size = os.fstat(file.fileno()).st_size
+            file.seek(rnd.randrange(size) if size else 0)
+            file.write(rnd.randbytes(1))
+    return len(changed)
+
+
+def _io_counters() -> dict[str, int]:
+    """
+    :returns: read/write syscalls and bytes of current process (empty if /proc is not available)
+    """
+    try:
+        with open('/proc/self/io') as file:
+            return {key: int(value) for key, value in (line.split(': ') for line in file)}
+    except OSError:
+        return dict()
+
+
+def measure(synchronizer: Synchronizer, files: int, size: int) -> dict:
+    """
+    Runs one synchronization cycle and measures it
+
+    :param synchronizer: synchronizer of benchmarked folders
+    :param files: number of files in source tree
+    :param size: total size of source tree in bytes
+    :returns: results of measurement
+    """
+    io_before = _io_counters()
+    start = time.perf_counter()
+    remove_errors, update_errors = synchronizer.sync_folders()
+    elapsed = time.perf_counter() - start
+    io_after = _io_counters()
+    result = {
+        'seconds': round(elapsed, 6),
+        'files_per_second': round(files / elapsed, 2),
+        'mb_per_second': round(size / elapsed / 2 ** 20, 2),
+        'errors': len(remove_errors) + len(update_errors),
+        # peak of the whole process so far
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if io_before:
+        # metadata calls (stat, scandir) aren't counted by the kernel
+        result['read_write_calls'] = sum(io_after[key] - io_before[key] for key in ('syscr', 'syscw'))
+        result['bytes_read'] = io_after['rchar'] - io_before['rchar']
+        result['bytes_written'] = io_after['wchar'] - io_before['wchar']
+    return result
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Benchmarks cold synchronization, resynchronization without changes and with small changes
+
+    :param args: parameters of benchmark
+    :returns: results of benchmark by scenario
+    """
+    work_dir = tempfile.mkdtemp(prefix='bench_sync_', dir=args.tmp_dir)
+    try:
+        source_path = os.path.join(work_dir, 'source')
+        replica_path = os.path.join(work_dir, 'replica')
+        os.mkdir(source_path)
+        os.mkdir(replica_path)
+        files, size = generate_tree(source_path, args.depth, args.fanout, args.files, parse_sizes(args.sizes),
+                                    args.seed)
+
+        manifest = Manifest(os.path.join(work_dir, 'manifest')) if args.manifest else None
+        comparator = DigestComparator(DigestStore()) if args.compare == 'digest' else None
+        synchronizer = Synchronizer(Folder(source_path), Folder(replica_path, args.delta_threshold), manifest,
+                                    args.workers, comparator)
+        results = {'parameters': vars(args), 'tree': {'files': files, 'bytes': size}}
+        results['cold'] = measure(synchronizer, files, size)
+        results['no_change'] = measure(synchronizer, files, size)
+        changed = mutate_tree(source_path, args.changed, args.seed)
+        results['small_delta'] = measure(synchronizer, files, size) | {'changed_files': changed}
+        if manifest is not None:
+            manifest.close()
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def configure_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmarking synchronization of synthetic folder trees')
+    parser.add_argument('--depth', type=int, help='number of nested folder levels', default=2)
+    parser.add_argument('--fanout', type=int, help='number of subfolders in each folder', default=4)
+    parser.add_argument('--files', type=int, help='number of files in each folder', default=20)
+    parser.add_argument('--sizes', type=str, help="file size distribution: 'fixed:SIZE', 'uniform:MIN:MAX' or "
+                                                  "'lognormal:MU:SIGMA'", default='lognormal:8:2')
+    parser.add_argument('--changed', type=float, help='percentage of changed files for small delta resync',
+                        default=1.0)
+    parser.add_argument('--seed', type=int, help='seed of random generator', default=0)
+    parser.add_argument('--workers', type=int, help='number of synchronizer threads', default=1)
+    parser.add_argument('--manifest', action='store_true', help='use file state manifest')
+    parser.add_argument('--compare', choices=('bytes', 'digest'), help='comparison of files', default='bytes')
+    parser.add_argument('--delta-threshold', type=int, help='minimal size of files updated by blocks',
+                        default=None)
+    parser.add_argument('--tmp-dir', type=str, help='folder where trees are generated', default=None)
+    parser.add_argument('-o', '--output', type=str, help='path to a JSON file with results (stdout if not set)',
+                        default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = configure_args()
+    logging.disable(logging.INFO)
+    results = run(args)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
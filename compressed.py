@@ -0,0 +1,348 @@
+import os
+import json
+import gzip
+import stat
+import shutil
+import logging
+from collections import deque
+from typing import Callable, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from folder import Folder, Entry
+from filters import Filter
+from digest import DEFAULT_ALGORITHM, _new_hash
+from throttle import Throttle
+from profiling import timed
+
+
+CODECS = ('gzip', 'zstd')
+# smaller files are stored as is
+MIN_SIZE = 1 << 16
+# blocks are compressed independently by workers and written as consecutive gzip members or zstd frames
+BLOCK_SIZE = 1 << 20
+# extensions of files which are already compressed
+SKIP_EXTENSIONS = ('.gz', '.tgz', '.zst', '.xz', '.bz2', '.lz4', '.zip', '.7z', '.rar', '.jar', '.apk',
+                   '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac', '.ogg', '.flac', '.mp4',
+                   '.mkv', '.avi', '.mov', '.webm', '.pdf', '.docx', '.xlsx', '.pptx', '.odt')
+# suffix of sidecars describing original content of stored files
+SIDECAR_SUFFIX = '.sync-meta'
+
+
+class Sidecar(NamedTuple):
+    """Description of original content of a compressed file"""
+    codec: str
+    size: int
+    mtime_ns: int
+    algorithm: str
+    digest: str
+
+
+def sidecar_path(file_path: str) -> str:
+    """
+    :param file_path: path to a stored file
+    :returns: path of its sidecar next to it
+    """
+    head, tail = os.path.split(os.path.normpath(file_path))
+    return os.path.join(head, f".{tail}{SIDECAR_SUFFIX}")
+
+
+def is_sidecar(name: str) -> bool:
+    """
+    :param name: name of a file
+    :returns: True if the file is a sidecar
+    """
+    return name.startswith('.') and name.endswith(SIDECAR_SUFFIX) and len(name) > len(SIDECAR_SUFFIX) + 1
+
+
+def read_sidecar(path: str) -> Sidecar | None:
+    """
+    :param path: path to a sidecar
+    :returns: description of a compressed file or None if the sidecar is missing or damaged
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return Sidecar(**json.load(file))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _compressor(codec: str, level: int | None) -> Callable[[bytes], bytes]:
+    """
+    :param codec: 'gzip' or 'zstd'
+    :param level: compression level (default level of the codec if None)
+    :returns: function compressing a block into a self-contained gzip member or zstd frame
+    """
+    if codec == 'gzip':
+        level = level if level is not None else 6
+        return lambda block: gzip.compress(block, level, mtime=0)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstandard package is required for 'zstd' compression")
+        level = level if level is not None else 3
+        # compressor objects are not thread-safe, so every block gets its own one
+        return lambda block: zstandard.ZstdCompressor(level=level).compress(block)
+    raise ValueError(f"Unknown codec {codec!r}")
+
+
+class CompressedFolder(Folder):
+    """Replica folder keeping files compressed under their own names (for slow or remote storage). Original size,
+    modification time and digest of every compressed file are kept in a sidecar next to it, so scans report
+    original stat data, sidecars are never listed and files are compared by stored digests without decompression.
+    Stored files are valid gzip or zstd streams which are restored by standard tools"""
+    codec: str
+    level: int | None
+    min_size: int
+    skip_extensions: frozenset[str]
+    algorithm: str
+    workers: int
+
+    def __init__(self, path: str, codec: str = 'gzip', level: int | None = None, min_size: int = MIN_SIZE,
+                 skip_extensions: tuple[str, ...] = SKIP_EXTENSIONS, workers: int | None = None,
+                 throttle: Throttle | None = None, algorithm: str = DEFAULT_ALGORITHM,
+                 filters: Filter | None = None) -> None:
+        """
+        Creates CompressedFolder object and checks for existence
+
+        :param path: a path to existing folder
+        :param codec: 'gzip' or 'zstd' (needs zstandard package)
+        :param level: compression level (default level of the codec if None)
+        :param min_size: minimal size in bytes of compressed files (smaller files are stored as is)
+        :param skip_extensions: extensions of already compressed files which are stored as is
+        :param workers: number of threads compressing blocks of files (number of CPUs if None)
+        :param throttle: limiter of copies and removals inside the folder (not limited if None)
+        :param algorithm: name of hash algorithm of stored digests
+        :param filters: rules of excluded paths which are never listed, copied or removed (nothing is excluded
+            if None)
+        """
+        # files are never updated by blocks since stored content differs from the original one
+        super().__init__(path, throttle=throttle, filters=filters)
+        self._compress = _compressor(codec, level)
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+        self.skip_extensions = frozenset(extension.lower() for extension in skip_extensions)
+        self.algorithm = algorithm
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='compress')
+
+    def _compressible(self, src: str, follow_symlinks: bool) -> bool:
+        """
+        :param src: path to a source file
+        :param follow_symlinks: False if a symlink is copied as a link
+        :returns: True if the file is regular, big enough and not compressed already
+        """
+        if os.path.splitext(src)[1].lower() in self.skip_extensions:
+            return False
+        st = os.stat(src, follow_symlinks=follow_symlinks)
+        return stat.S_ISREG(st.st_mode) and st.st_size >= self.min_size
+
+    def _remove_orphan(self, path: str, sidecar: Entry, name: str) -> None:
+        """
+        Removes a sidecar of a missing file since sidecars are never listed and it wouldn't be removed otherwise
+
+        :param path: path to a listed folder
+        :param sidecar: scanned entry of the sidecar
+        :param name: name of the described file
+        """
+        if self.filters is not None and self.filters.matches(self._relative(os.path.join(path, name)), False):
+            return
+        try:
+            os.remove(sidecar.path)
+            logging.info(f"Orphan sidecar {sidecar.path!r} removed")
+        except OSError:
+            logging.exception(f"Could not remove orphan sidecar {sidecar.path!r}")
+
+    def _entries(self, path: str) -> list[Entry]:
+        """
+        Lists folder hiding sidecars and reporting original stat data of compressed files. Sidecars of missing
+        files are removed
+
+        :param path: path to a folder
+        :returns: entries of the folder
+        """
+        with os.scandir(path) as it:
+            entries = {dir_entry.name: Entry.from_dir_entry(dir_entry) for dir_entry in it}
+        for name in [name for name in entries if is_sidecar(name)]:
+            sidecar = entries.pop(name)
+            entry = entries.get(name[1:-len(SIDECAR_SUFFIX)])
+            if entry is None or not entry.is_file():
+                self._remove_orphan(path, sidecar, name[1:-len(SIDECAR_SUFFIX)])
+                continue
+            original = read_sidecar(sidecar.path)
+            # sidecars left by interrupted copies or changes outside of synchronization are ignored
+            if original is not None and original.mtime_ns == entry.st_mtime_ns:
+                entry.st_size = original.size
+        if self.filters is not None:
+            return self._filter(path, entries.values())
+        return list(entries.values())
+
+    @timed('list', 1)
+    def scan(self, path: str) -> dict[str, Entry]:
+        return {entry.name: entry for entry in self._entries(path)}
+
+    @timed('list', 1)
+    def scan_sorted(self, path: str) -> list[Entry]:
+        entries = self._entries(path)
+        entries.sort(key=lambda entry: entry.name)
+        return entries
+
+    def stored_digest(self, file_path: str) -> tuple[int, str, str] | None:
+        original = read_sidecar(sidecar_path(file_path))
+        if original is None:
+            return None
+        try:
+            if os.lstat(file_path).st_mtime_ns != original.mtime_ns:
+                return None
+        except FileNotFoundError:
+            return None
+        return original.size, original.algorithm, original.digest
+
+    def _store(self, src: str, dst: str) -> int:
+        """
+        Compresses a file streaming its blocks through worker threads and writes its sidecar
+
+        :param src: path to a source file
+        :param dst: path to the compressed file
+        :returns: number of written bytes
+        """
+        digest = _new_hash(self.algorithm)
+        pending = deque()
+        size = written = 0
+        with open(src, 'rb') as source, open(dst, 'wb') as target:
+            while block := source.read(BLOCK_SIZE):
+                if self.throttle is not None:
+                    self.throttle.transfer(len(block))
+                digest.update(block)
+                size += len(block)
+                pending.append(self._pool.submit(self._compress, block))
+                # a bounded number of blocks is kept in memory
+                if len(pending) > 2 * self.workers:
+                    written += target.write(pending.popleft().result())
+            while pending:
+                written += target.write(pending.popleft().result())
+        shutil.copystat(src, dst)
+        original = Sidecar(self.codec, size, os.stat(dst).st_mtime_ns, self.algorithm, digest.hexdigest())
+        with open(sidecar_path(dst), 'w', encoding='utf-8') as file:
+            json.dump(original._asdict(), file)
+        return written
+
+    @timed('compress', 1)
+    def _store_file(self, src: str, dst: str) -> int:
+        """
+        Compresses a file next to its destination and puts the copy and then its sidecar in place
+
+        :param src: full path from source folder to a file
+        :param dst: full destination path to a folder with its filename
+        :returns: number of written bytes
+        """
+        logging.debug(f"Compressing {src!r} to {dst!r}")
+        tmp = self.temp_path(dst)
+        try:
+            written = self._store(src, tmp)
+            # the new sidecar next to the old copy doesn't match its modification time and is ignored,
+            # the sidecar goes first so that it's never left without its file
+            os.replace(sidecar_path(tmp), sidecar_path(dst))
+            os.replace(tmp, dst)
+        except:
+            for path in (tmp, sidecar_path(tmp)):
+                if os.path.lexists(path):
+                    os.remove(path)
+            raise
+        logging.info(f"File {src!r} was compressed ({written} bytes written)")
+        return written
+
+    def _drop_sidecar(self, file_path: str) -> None:
+        """
+        :param file_path: path to a file which is not compressed anymore
+        """
+        try:
+            os.remove(sidecar_path(file_path))
+        except FileNotFoundError:
+            pass
+
+    def copy_small_files(self, files: list[tuple[str, str, Entry]],
+                         buffer: bytearray) -> tuple[int, list[tuple[str, str, Entry]]]:
+        # files which should be compressed are copied one by one
+        plain, rest = list(), list()
+        for file in files:
+            (rest if self._compressible(file[0], follow_symlinks=False) else plain).append(file)
+        for _, dst, _ in plain:
+            self._drop_sidecar(dst)
+        written, failed = super().copy_small_files(plain, buffer) if plain else (0, [])
+        return written, failed + rest
+
+    def copy_into(self, src: str, dst: str, entry: Entry | None = None,
+                  link: Callable[[str, str, str], bool] | None = None) -> int:
+        """
+        Copies file or entire folder to a folder compressing big files. Files are never linked to duplicates
+        since stored content differs from the original one
+
+        :param src: full path from source folder to a file
+        :param dst: full destination path to a folder with its filename
+        :param entry: scanned entry of the source file (it's stat'ed if None)
+        :param link: ignored
+        :returns: number of written bytes
+        """
+        if not self._contains(dst):
+            raise PermissionError(f"Can't copy a file outside of {self.path!r}")
+
+        if not (entry.is_dir if entry is not None else os.path.isdir(src)):
+            if not self._compressible(src, follow_symlinks=False):
+                self._drop_sidecar(dst)
+                return super().copy_into(src, dst, entry)
+            if self.throttle is not None:
+                self.throttle.operation()
+            return self._store_file(src, dst)
+
+        logging.debug(f"Copying entire folder {src!r} to {dst!r}")
+        if self.throttle is not None:
+            self.throttle.operation()
+        written = 0
+
+        def copy_file(file_src: str, file_dst: str) -> None:
+            nonlocal written
+            if self.throttle is not None:
+                self.throttle.operation()
+            if self._compressible(file_src, follow_symlinks=True):
+                written += self._store(file_src, file_dst)
+            else:
+                shutil.copy2(file_src, file_dst)
+                written += os.lstat(file_dst).st_size
+        tmp = self.temp_path(dst)
+        try:
+            shutil.copytree(src, tmp, copy_function=copy_file, ignore=self._ignore(src, dst))
+            os.replace(tmp, dst)
+        except:
+            if os.path.lexists(tmp):
+                shutil.rmtree(tmp)
+            raise
+        logging.info(f"Folder {src!r} was copied")
+        return written
+
+    def _unlink(self, file_path: str) -> None:
+        os.remove(file_path)
+        self._drop_sidecar(file_path)
+
+    def remove(self, file_path: str, entry: Entry | None = None) -> None:
+        is_dir = entry.is_dir if entry is not None else os.path.isdir(file_path)
+        super().remove(file_path, entry)
+        if not is_dir:
+            self._drop_sidecar(file_path)
+
+    def move(self, old_path: str, new_path: str) -> None:
+        super().move(old_path, new_path)
+        if os.path.lexists(sidecar_path(old_path)):
+            os.replace(sidecar_path(old_path), sidecar_path(new_path))
+        else:
+            self._drop_sidecar(new_path)
+
+    def close(self) -> None:
+        """
+        Stops compressing workers
+        """
+        self._pool.shutdown()
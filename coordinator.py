@@ -0,0 +1,380 @@
+import os
+import time
+import heapq
+import shutil
+import logging
+from typing import NamedTuple, Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+from folder import Folder, Entry, merge_entries
+from synchronizer import Synchronizer
+from digest import Comparator, DigestComparator, DigestStore
+from watcher import coalesce
+from stats import SyncStats
+from errorlog import ErrorLog
+from throttle import Throttle, Profile
+from filters import Filter
+
+
+class ShardOptions(NamedTuple):
+    """Settings of synchronizers run by shard processes"""
+    workers: int = 1
+    delta_threshold: int | None = None
+    block_size: int = 1 << 17
+    compare: str = 'bytes'
+    error_limit: int = 1000
+    error_file: str | None = None
+    small_file_size: int | None = None
+    bytes_per_second: float | None = None
+    ops_per_second: float | None = None
+    profiles: tuple[Profile, ...] = ()
+    filter_rules: tuple[str, ...] = ()
+
+
+# digests found by a shard process, they are kept in memory as long as the pool of processes lives (digests of
+# units moved to another process by rebalancing are found again)
+_digest_store: DigestStore | None = None
+
+
+def _shard_store() -> DigestStore:
+    """
+    :returns: digest store of the current process shared by all its shards
+    """
+    global _digest_store
+    if _digest_store is None:
+        _digest_store = DigestStore()
+    return _digest_store
+
+
+def _append_spilled(spill_path: str, error_file: str) -> None:
+    """
+    Moves failed paths spilled by a synchronizer of a shard to the error file shared by all processes
+
+    :param spill_path: path to the spill file of the synchronizer
+    :param error_file: path to the shared error file
+    """
+    # whole lines are appended so that records of concurrent processes are not mixed
+    with open(spill_path, 'r', encoding='utf-8') as spill, open(error_file, 'a', encoding='utf-8', buffering=1) as file:
+        file.writelines(spill)
+
+
+def sync_shard(source_path: str, replica_path: str, paths: list[str],
+               options: ShardOptions) -> tuple[ErrorLog, ErrorLog, SyncStats, dict[str, float]]:
+    """
+    Synchronizes a shard of source folder in a process of the pool
+
+    :param source_path: path to source folder
+    :param replica_path: path to replica folder
+    :param paths: paths of files and folders of the shard relative to source folder
+    :param options: settings of the synchronizer
+    :returns: failed to remove files, failed to copy files, stats of the shard and time spent on every path
+    """
+    throttle = None
+    if options.bytes_per_second is not None or options.ops_per_second is not None or options.profiles:
+        throttle = Throttle(options.bytes_per_second, options.ops_per_second, options.profiles)
+    if options.compare == 'digest':
+        comparator = DigestComparator(_shard_store(), throttle)
+    else:
+        comparator = Comparator(throttle)
+    # synchronizer truncates its error file every cycle, so paths it spills are moved to the shared file after
+    # every path (a process runs a single shard at a time)
+    spill_path = f"{options.error_file}.{os.getpid()}" if options.error_file is not None else None
+    filters = Filter(options.filter_rules)
+    synchronizer = Synchronizer(Folder(source_path, filters=filters),
+                                Folder(replica_path, options.delta_threshold, options.block_size, throttle, filters),
+                                workers=options.workers, comparator=comparator, error_limit=options.error_limit,
+                                error_file=spill_path, small_file_size=options.small_file_size)
+    remove_errors = ErrorLog('remove', options.error_limit, options.error_file)
+    update_errors = ErrorLog('update', options.error_limit, options.error_file)
+    stats = SyncStats()
+    costs = dict()
+    for path in paths:
+        start = time.perf_counter()
+        path_remove_errors, path_update_errors = synchronizer.sync_paths([path])
+        costs[path] = time.perf_counter() - start
+        remove_errors.extend(path_remove_errors)
+        update_errors.extend(path_update_errors)
+        stats.merge(synchronizer.stats)
+        if spill_path is not None:
+            _append_spilled(spill_path, options.error_file)
+    if spill_path is not None:
+        os.remove(spill_path)
+    remove_errors.close()
+    update_errors.close()
+    stats.finish(len(remove_errors) + len(update_errors))
+    return remove_errors, update_errors, stats, costs
+
+
+class Coordinator:
+    """Synchronizes source folder with replica by shards run in a pool of processes. Top level entries
+    (and entries of folders which were too big to be a single unit) are distributed among processes
+    balancing time they took during the previous cycle. Entries removed from those folders are deleted
+    by the coordinator itself"""
+    source: Folder
+    replica: Folder
+    processes: int
+    options: ShardOptions
+    stats: SyncStats
+
+    def __init__(self, source: Folder, replica: Folder, processes: int, options: ShardOptions = ShardOptions(),
+                 split_factor: float = 1.5) -> None:
+        """
+        :param source: folder with initial files
+        :param replica: intended copy of source folder
+        :param processes: number of processes synchronizing shards
+        :param options: settings of synchronizers of shards (throughput limits are shared by all processes)
+        :param split_factor: a folder taking this many times longer than an even share of a process is split
+            into its entries during the next cycle (folders are merged back when they take less than
+            the share divided by the factor)
+        """
+        logging.debug(f"Initializing coordinator with {source.path = }; {replica.path = }; {processes = }")
+        if processes < 1:
+            raise ValueError("Number of processes should be positive")
+        self.source = source
+        self.replica = replica
+        self.processes = processes
+        # every process gets an even share of throughput limits
+        self.options = options._replace(
+            bytes_per_second=options.bytes_per_second / processes if options.bytes_per_second else None,
+            ops_per_second=options.ops_per_second / processes if options.ops_per_second else None,
+            profiles=tuple(profile._replace(
+                bytes_per_second=profile.bytes_per_second / processes if profile.bytes_per_second else None,
+                ops_per_second=profile.ops_per_second / processes if profile.ops_per_second else None)
+                for profile in options.profiles))
+        self.split_factor = split_factor
+        self.stats = SyncStats()
+        # time in seconds spent on units during the last cycle by their paths relative to source folder
+        self.costs: dict[str, float] = dict()
+        # folders whose entries are separate units
+        self.split: set[str] = set()
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _check_folders(self) -> None:
+        if not self.source.is_alive():
+            msg = "Source folder was removed during runtime"
+            logging.critical(msg)
+            raise RuntimeError(msg)
+        if not self.replica.is_alive():
+            logging.error("Replica folder was removed during runtime. Trying to resync..")
+            self.replica.revive()
+
+    def _remove(self, r_path: str, r_entry: Entry, remove_errors: ErrorLog) -> bool:
+        """
+        Removes obsolete file or folder from replica
+
+        :param r_path: path of a file in replica folder
+        :param r_entry: scanned entry of the file
+        :param remove_errors: log of failed to remove files
+        :returns: True if the file was removed
+        """
+        try:
+            self.replica.remove(r_path, r_entry)
+        except:
+            logging.exception("Could not remove file")
+            remove_errors.append(r_path)
+            return False
+        self.stats.add('removals')
+        self.stats.change(os.path.relpath(os.path.dirname(os.path.normpath(r_path)), self.replica.path))
+        return True
+
+    def _units(self, remove_errors: ErrorLog, update_errors: ErrorLog, created: list[tuple[str, str]]) -> list[str]:
+        """
+        Lists top level folder and split folders removing obsolete entries. Split folders missing in replica
+        are created
+
+        :param remove_errors: log of failed to remove files
+        :param update_errors: log of failed to copy files
+        :param created: source and replica paths of created folders
+        :returns: paths of units relative to source folder
+        """
+        units = list()
+        folders = [os.curdir]
+        while folders:
+            folder = folders.pop()
+            s_dir = os.path.normpath(os.path.join(self.source.path, folder))
+            r_dir = os.path.normpath(os.path.join(self.replica.path, folder))
+            try:
+                s_entries = self.source.scan_sorted(s_dir)
+                r_entries = self.replica.scan_sorted(r_dir)
+            except:
+                if folder == os.curdir:
+                    raise
+                logging.exception("Could not list a folder, it's synchronized as a single unit")
+                units.append(folder)
+                continue
+            self.stats.add('dirs_scanned')
+            for s_entry, r_entry in merge_entries(s_entries, r_entries):
+                name = s_entry.name if s_entry is not None else r_entry.name
+                unit = os.path.normpath(os.path.join(folder, name))
+                if s_entry is None:
+                    self._remove(r_entry.path, r_entry, remove_errors)
+                elif not s_entry.is_dir or unit not in self.split:
+                    units.append(unit)
+                else:
+                    r_path = os.path.join(r_dir, name)
+                    if r_entry is not None and not r_entry.is_dir:
+                        if not self._remove(r_path, r_entry, remove_errors):
+                            continue
+                        r_entry = None
+                    if r_entry is None:
+                        try:
+                            os.mkdir(r_path)
+                        except:
+                            logging.exception("Could not create a folder!")
+                            update_errors.append(s_entry.path)
+                            continue
+                        created.append((s_entry.path, r_path))
+                    folders.append(unit)
+        return units
+
+    def _estimate(self, unit: str) -> float:
+        """
+        :param unit: path of a unit relative to source folder
+        :returns: expected time of the unit in seconds
+        """
+        if unit in self.costs:
+            return self.costs[unit]
+        prefix = unit + os.sep
+        # a merged folder takes as long as its entries did
+        inner = [cost for path, cost in self.costs.items() if path.startswith(prefix)]
+        if inner:
+            return sum(inner)
+        return sum(self.costs.values()) / len(self.costs) if self.costs else 1.0
+
+    def _shards(self, units: list[str]) -> list[list[str]]:
+        """
+        Distributes units among processes starting from the longest ones, each unit is given to the least loaded process
+
+        :param units: paths of units relative to source folder
+        :returns: non-empty shards
+        """
+        estimates = {unit: self._estimate(unit) for unit in units}
+        loads = [(0.0, index, list()) for index in range(self.processes)]
+        for unit in sorted(units, key=lambda unit: estimates[unit], reverse=True):
+            load, index, shard = heapq.heappop(loads)
+            shard.append(unit)
+            heapq.heappush(loads, (load + estimates[unit], index, shard))
+        return [shard for _, _, shard in sorted(loads, key=lambda load: load[1]) if shard]
+
+    def _rebalance(self, costs: dict[str, float]) -> None:
+        """
+        Splits folders which take too long and merges split folders which became fast
+
+        :param costs: time spent on every unit during the cycle
+        """
+        self.costs = costs
+        total = sum(costs.values())
+        if self.processes == 1 or total == 0:
+            return
+        share = total / self.processes
+        for folder in list(self.split):
+            prefix = folder + os.sep
+            if sum(cost for unit, cost in costs.items() if unit.startswith(prefix)) < share / self.split_factor:
+                logging.debug(f"Folder {folder!r} is merged into a single unit")
+                self.split.discard(folder)
+        for unit, cost in costs.items():
+            if cost > share * self.split_factor and os.path.isdir(os.path.join(self.source.path, unit)):
+                logging.debug(f"Folder {unit!r} is split into units ({cost:.3f} s)")
+                self.split.add(unit)
+
+    def _run(self, units: list[str], remove_errors: ErrorLog, update_errors: ErrorLog) -> dict[str, float]:
+        """
+        Synchronizes units by the pool of processes
+
+        :param units: paths of units relative to source folder
+        :param remove_errors: log of failed to remove files
+        :param update_errors: log of failed to copy files
+        :returns: time spent on every unit
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        shards = self._shards(units)
+        logging.info(f"Synchronizing {len(units)} unit(s) by {len(shards)} process(es)")
+        futures = [(shard, self._pool.submit(sync_shard, self.source.path, self.replica.path, shard, self.options))
+                   for shard in shards]
+        costs = dict()
+        for shard, future in futures:
+            try:
+                shard_remove_errors, shard_update_errors, stats, shard_costs = future.result()
+            except:
+                logging.exception("Shard process failed")
+                update_errors.extend(os.path.join(self.source.path, unit) for unit in shard)
+                continue
+            remove_errors.extend(shard_remove_errors)
+            update_errors.extend(shard_update_errors)
+            self.stats.merge(stats)
+            costs.update(shard_costs)
+        return costs
+
+    def _finish_cycle(self, remove_errors: ErrorLog, update_errors: ErrorLog) -> None:
+        remove_errors.close()
+        update_errors.close()
+        self.stats.finish(len(remove_errors) + len(update_errors))
+
+    def _error_logs(self) -> tuple[ErrorLog, ErrorLog]:
+        # shard logs spill paths over their limits, so the coordinator keeps limits of all of them
+        limit = self.options.error_limit * self.processes
+        return ErrorLog('remove', limit), ErrorLog('update', limit)
+
+    def sync_folders(self) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes source folder with replica by the pool of processes
+
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        self._check_folders()
+        self.stats = SyncStats()
+        if self.options.error_file is not None:
+            open(self.options.error_file, 'w').close()
+        remove_errors, update_errors = self._error_logs()
+        created = list()
+        units = self._units(remove_errors, update_errors, created)
+        costs = self._run(units, remove_errors, update_errors)
+        # modification times of created folders are restored after their content is written
+        for source_path, replica_path in reversed(created):
+            try:
+                shutil.copystat(source_path, replica_path)
+            except OSError:
+                logging.exception("Could not copy folder metadata")
+        self._rebalance(costs)
+        self._finish_cycle(remove_errors, update_errors)
+        return remove_errors, update_errors
+
+    def sync_paths(self, paths: Iterable[str]) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes only given files and folders by the pool of processes
+
+        :param paths: paths of changed files relative to source folder
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        self._check_folders()
+        targets = set()
+        for path in paths:
+            path = os.path.normpath(path)
+            # excluded paths are neither copied nor removed
+            if (self.source.excluded(os.path.join(self.source.path, path)) or
+                    self.replica.excluded(os.path.join(self.replica.path, path))):
+                continue
+            # changes of a file inside not yet synchronized folder are applied with the whole folder
+            while os.path.dirname(path) and not os.path.isdir(os.path.join(self.replica.path, os.path.dirname(path))):
+                path = os.path.dirname(path)
+            targets.add(path)
+        units = coalesce(targets)
+        if os.curdir in units:
+            return self.sync_folders()
+        self.stats = SyncStats()
+        if self.options.error_file is not None:
+            open(self.options.error_file, 'w').close()
+        remove_errors, update_errors = self._error_logs()
+        # time of partial cycles is not used for balancing
+        self._run(sorted(units), remove_errors, update_errors)
+        self._finish_cycle(remove_errors, update_errors)
+        return remove_errors, update_errors
+
+    def close(self) -> None:
+        """
+        Stops the pool of processes
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
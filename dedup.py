@@ -0,0 +1,160 @@
+import os
+import stat
+import sqlite3
+import logging
+import threading
+
+import fastcopy
+
+
+DEDUP_MODES = ('hardlink', 'reflink')
+# smaller files are always copied
+MIN_SIZE = 1 << 20
+
+
+class DedupIndex:
+    """Persistent index of replica file contents by their digests (SQLite). New copies of content which is
+    already present in replica are created as hardlinks or reflinks of existing files instead of being copied.
+    Records are checked against size and modification time of files before they are used"""
+    path: str
+    mode: str
+    min_size: int
+
+    def __init__(self, path: str, mode: str = 'hardlink', min_size: int = MIN_SIZE) -> None:
+        """
+        Opens existing index or creates a new one
+
+        :param path: path to an index file
+        :param mode: 'hardlink' (linked files share metadata) or 'reflink' (copy-on-write clones,
+            supported by btrfs and XFS)
+        :param min_size: minimal size in bytes of deduplicated files
+        """
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown deduplication mode {mode!r}")
+        logging.debug(f"Opening dedup index {path!r}")
+        self.path = path
+        self.mode = mode
+        self.min_size = min_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS contents ("
+                         "path TEXT PRIMARY KEY, digest TEXT, size INTEGER, mtime_ns INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS contents_digest ON contents (digest)")
+        self._db.commit()
+
+    @staticmethod
+    def _valid(file_path: str, size: int, mtime_ns: int) -> os.stat_result | None:
+        """
+        :returns: stat data of a recorded file or None if it was removed or changed since it was recorded
+        """
+        try:
+            st = os.lstat(file_path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode) or st.st_size != size or st.st_mtime_ns != mtime_ns:
+            return None
+        return st
+
+    def find(self, digest: str) -> tuple[str, os.stat_result] | None:
+        """
+        :param digest: digest of a file content
+        :returns: path and stat data of a replica file with the content or None if it's not found
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, mtime_ns FROM contents WHERE digest = ?", (digest,)).fetchall()
+        # records of missing files are not dropped since they may be copies in progress
+        for file_path, size, mtime_ns in rows:
+            st = self._valid(file_path, size, mtime_ns)
+            if st is not None:
+                return file_path, st
+        return None
+
+    def add(self, file_path: str, digest: str, size: int, mtime_ns: int) -> None:
+        """
+        Records content of a replica file
+
+        :param file_path: path to a file in replica
+        :param digest: digest of its content
+        :param size: size of the file
+        :param mtime_ns: modification time of the file
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO contents VALUES (?, ?, ?, ?)", (file_path, digest, size, mtime_ns))
+
+    def link(self, existing_path: str, new_path: str) -> None:
+        """
+        Creates a file sharing content with existing one
+
+        :param existing_path: path to a replica file with the content
+        :param new_path: path to a new file
+        :raises OSError: if files are on different devices or reflinks are not supported
+        """
+        if self.mode == 'hardlink':
+            os.link(existing_path, new_path)
+        else:
+            fastcopy.reflink(existing_path, new_path)
+
+    @staticmethod
+    def _subtree(path: str) -> tuple[str, str]:
+        """
+        :param path: path to a file or a folder
+        :returns: bounds of paths inside the folder (prefix <= path < upper), so that lookups use the primary key
+        """
+        path = path.rstrip(os.sep)
+        return path + os.sep, path + chr(ord(os.sep) + 1)
+
+    def move(self, old_path: str, new_path: str) -> None:
+        """
+        Moves records of a renamed file or an entire renamed folder with its content
+
+        :param old_path: previous path to a file or a folder
+        :param new_path: current path to a file or a folder
+        """
+        old_path, new_path = old_path.rstrip(os.sep), new_path.rstrip(os.sep)
+        with self._lock:
+            self._db.execute("DELETE FROM contents WHERE path = ?", (new_path,))
+            self._db.execute("DELETE FROM contents WHERE path >= ? AND path < ?", self._subtree(new_path))
+            self._db.execute("UPDATE contents SET path = ? WHERE path = ?", (new_path, old_path))
+            self._db.execute("UPDATE contents SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?",
+                             (new_path, len(old_path) + 1, *self._subtree(old_path)))
+
+    def discard(self, file_path: str) -> None:
+        """
+        Forgets a removed file or an entire folder with its content
+
+        :param file_path: path to a file or a folder
+        """
+        file_path = file_path.rstrip(os.sep)
+        with self._lock:
+            self._db.execute("DELETE FROM contents WHERE path = ?", (file_path,))
+            self._db.execute("DELETE FROM contents WHERE path >= ? AND path < ?", self._subtree(file_path))
+
+    def collect_garbage(self) -> int:
+        """
+        Drops records of files which were removed or changed outside of synchronization (or whose copies failed)
+
+        :returns: number of dropped records
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, mtime_ns FROM contents").fetchall()
+        stale = [(file_path,) for file_path, size, mtime_ns in rows if self._valid(file_path, size, mtime_ns) is None]
+        if stale:
+            with self._lock:
+                self._db.executemany("DELETE FROM contents WHERE path = ?", stale)
+            logging.debug(f"{len(stale)} stale record(s) dropped from dedup index")
+        return len(stale)
+
+    def commit(self) -> None:
+        """
+        Flushes records to the disk
+        """
+        with self._lock:
+            self._db.commit()
+
+    def close(self) -> None:
+        """
+        Flushes records and closes the index
+        """
+        with self._lock:
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,40 @@
+import os
+
+from throttle import Throttle
+
+
+def delta_copy(src: str, dst: str, block_size: int = 1 << 17, throttle: Throttle | None = None) -> int:
+    """
+    Updates existing file in place rewriting only blocks which differ from source file
+
+    :param src: path to a source file
+    :param dst: path to an outdated copy of the source file
+    :param block_size: size of compared blocks in bytes
+    :param throttle: limiter of read and written bytes (not limited if None)
+    :returns: number of rewritten bytes
+    """
+    written = 0
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_RDWR)
+        try:
+            src_size = os.fstat(src_fd).st_size
+            offset = 0
+            while offset < src_size:
+                src_block = os.pread(src_fd, block_size, offset)
+                if not src_block:
+                    break
+                if throttle is not None:
+                    throttle.transfer(2 * len(src_block))
+                if os.pread(dst_fd, len(src_block), offset) != src_block:
+                    if throttle is not None:
+                        throttle.transfer(len(src_block))
+                    os.pwrite(dst_fd, src_block, offset)
+                    written += len(src_block)
+                offset += len(src_block)
+            os.ftruncate(dst_fd, offset)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    return written
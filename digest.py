@@ -0,0 +1,414 @@
+import os
+import zlib
+import random
+import fnmatch
+import hashlib
+import logging
+import threading
+from typing import Iterable, NamedTuple
+from collections import OrderedDict
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from folder import Folder, Entry
+from throttle import Throttle
+
+
+DEFAULT_ALGORITHM = 'xxh3_128' if xxhash is not None else 'blake2b'
+CHUNK_SIZE = 1 << 20
+# smaller files are always compared entirely by sampled comparator
+SAMPLE_THRESHOLD = 1 << 26
+
+
+def _new_hash(algorithm: str):
+    if algorithm == 'blake2b':
+        return hashlib.blake2b(digest_size=20)
+    if algorithm == 'xxh3_128':
+        if xxhash is None:
+            raise ValueError("xxhash package is required for 'xxh3_128' digests")
+        return xxhash.xxh3_128()
+    return hashlib.new(algorithm)
+
+
+def file_digest(file_path: str, algorithm: str = 'blake2b', chunk_size: int = CHUNK_SIZE,
+                throttle: Throttle | None = None) -> str:
+    """
+    Calculates content hash of a file reading it by chunks into a reused buffer. Files are not mapped
+    to memory since a mapped file truncated during hashing kills the process with SIGBUS
+
+    :param file_path: path to a file
+    :param algorithm: name of hash algorithm ('blake2b', 'xxh3_128' or any of hashlib)
+    :param chunk_size: size of a chunk hashed at once in bytes
+    :param throttle: limiter of read bytes (not limited if None)
+    :returns: hex digest of file content
+    """
+    digest = _new_hash(algorithm)
+    if throttle is not None:
+        throttle.operation()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as file:
+        while length := file.readinto(buffer):
+            if throttle is not None:
+                throttle.transfer(length)
+            digest.update(view[:length])
+    return digest.hexdigest()
+
+
+class DigestStore:
+    """Bounded LRU cache of file digests keyed by file identity (device, inode, size, modification time)"""
+    path: str | None
+    capacity: int
+    algorithm: str
+
+    def __init__(self, path: str | None = None, capacity: int = 1 << 20, algorithm: str = DEFAULT_ALGORITHM) -> None:
+        """
+        :param path: path to a file where digests are kept between runs (kept in memory only if None)
+        :param capacity: maximal number of kept digests
+        :param algorithm: name of hash algorithm
+        """
+        self.path = path
+        self.capacity = capacity
+        self.algorithm = algorithm
+        self.bytes_hashed = 0
+        self._digests: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    @staticmethod
+    def key(st: os.stat_result | Entry) -> tuple:
+        """
+        :param st: stat data of a file (result of os.stat call or scanned entry)
+        :returns: identity of file content
+        """
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, st: os.stat_result | Entry) -> str | None:
+        """
+        :param st: stat data of a file
+        :returns: known digest of a file or None
+        """
+        key = self.key(st)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+        return digest
+
+    def put(self, st: os.stat_result | Entry, digest: str) -> None:
+        """
+        Keeps digest of a file dropping the least recently used ones if the store is full
+
+        :param st: stat data of a file
+        :param digest: digest of a file
+        """
+        key = self.key(st)
+        with self._lock:
+            self._digests[key] = digest
+            self._digests.move_to_end(key)
+            while len(self._digests) > self.capacity:
+                self._digests.popitem(last=False)
+
+    def digest(self, file_path: str, st: os.stat_result | Entry | None = None,
+               throttle: Throttle | None = None) -> str:
+        """
+        Gets digest of a file calculating it only if the file is not known
+
+        :param file_path: path to a file
+        :param st: stat data of a file (it's stat'ed if None)
+        :param throttle: limiter of read bytes (not limited if None)
+        :returns: digest of a file
+        """
+        st = st if st is not None else os.stat(file_path)
+        digest = self.get(st)
+        if digest is None:
+            digest = file_digest(file_path, self.algorithm, throttle=throttle)
+            self.put(st, digest)
+            with self._lock:
+                self.bytes_hashed += st.st_size
+        return digest
+
+    def _load(self) -> None:
+        with open(self.path, 'r', encoding='utf-8') as file:
+            if file.readline().strip() != self.algorithm:
+                logging.warning(f"Digest store {self.path!r} uses another algorithm, it's discarded")
+                return
+            for line in file:
+                *key, digest = line.split()
+                self._digests[tuple(map(int, key))] = digest
+        logging.debug(f"Loaded {len(self._digests)} digest(s) from {self.path!r}")
+
+    def save(self) -> None:
+        """
+        Writes digests to the file
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            items = list(self._digests.items())
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(self.algorithm + '\n')
+            file.writelines(f"{dev} {ino} {size} {mtime_ns} {digest}\n" for (dev, ino, size, mtime_ns), digest in items)
+        os.replace(tmp_path, self.path)
+
+
+class Comparator:
+    """Strategy of checking files for identity (byte by byte comparison)"""
+    throttle: Throttle | None
+
+    def __init__(self, throttle: Throttle | None = None) -> None:
+        """
+        :param throttle: limiter of read bytes (not limited if None)
+        """
+        self.throttle = throttle
+        self._bytes_read = 0
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_read(self) -> int:
+        """
+        :returns: number of bytes read for comparison so far (upper bound for byte by byte comparison)
+        """
+        return self._bytes_read
+
+    def same(self, file_path1: str, file_path2: str,
+             entry1: Entry | None = None, entry2: Entry | None = None) -> bool:
+        """
+        :param file_path1: path to the first file
+        :param file_path2: path to the second file
+        :param entry1: scanned entry of the first file (it's stat'ed if None)
+        :param entry2: scanned entry of the second file (it's stat'ed if None)
+        :returns: True if files are the same and False otherwise
+        """
+        entry1 = entry1 if entry1 is not None else Entry.from_path(file_path1)
+        entry2 = entry2 if entry2 is not None else Entry.from_path(file_path2)
+        if entry1.st_size == entry2.st_size and entry1.is_file() and entry2.is_file():
+            with self._lock:
+                self._bytes_read += 2 * entry1.st_size
+        return Folder.compare_files(file_path1, file_path2, entry1=entry1, entry2=entry2, throttle=self.throttle)
+
+    def digest(self, file_path: str, st: os.stat_result | Entry | None = None,
+               algorithm: str = DEFAULT_ALGORITHM) -> str:
+        """
+        :param file_path: path to a file
+        :param st: stat data of the file (it's stat'ed if None)
+        :param algorithm: name of hash algorithm
+        :returns: digest of file content
+        """
+        st = st if st is not None else os.stat(file_path)
+        with self._lock:
+            self._bytes_read += st.st_size
+        return file_digest(file_path, algorithm, throttle=self.throttle)
+
+    def copied(self, src: str, dst: str, entry: Entry | None = None) -> None:
+        """
+        Notifies that a file was copied
+
+        :param src: path to a source file
+        :param dst: path to its new copy
+        :param entry: scanned entry of the source file (it's stat'ed if None)
+        """
+
+    def flush(self) -> None:
+        """
+        Saves collected data at the end of synchronization
+        """
+
+
+class DigestComparator(Comparator):
+    """Compares files by digests so that unchanged files are never read again"""
+    store: DigestStore
+
+    def __init__(self, store: DigestStore, throttle: Throttle | None = None) -> None:
+        """
+        :param store: cache of digests
+        :param throttle: limiter of read bytes (not limited if None)
+        """
+        super().__init__(throttle)
+        self.store = store
+
+    @property
+    def bytes_read(self) -> int:
+        return self.store.bytes_hashed
+
+    def same(self, file_path1: str, file_path2: str,
+             entry1: Entry | None = None, entry2: Entry | None = None) -> bool:
+        st1 = entry1 if entry1 is not None else os.stat(file_path1)
+        st2 = entry2 if entry2 is not None else os.stat(file_path2)
+        if st1.st_size != st2.st_size:
+            return False
+        return (self.store.digest(file_path1, st1, self.throttle) ==
+                self.store.digest(file_path2, st2, self.throttle))
+
+    def digest(self, file_path: str, st: os.stat_result | Entry | None = None,
+               algorithm: str = DEFAULT_ALGORITHM) -> str:
+        if algorithm != self.store.algorithm:
+            return super().digest(file_path, st, algorithm)
+        return self.store.digest(file_path, st, self.throttle)
+
+    def copied(self, src: str, dst: str, entry: Entry | None = None) -> None:
+        # the copy has the same digest so it's never read
+        digest = self.store.get(entry if entry is not None else os.stat(src))
+        if digest is not None:
+            self.store.put(os.stat(dst), digest)
+
+    def flush(self) -> None:
+        self.store.save()
+
+
+class SamplePolicy(NamedTuple):
+    """Sampled comparison of files whose paths match a pattern"""
+    pattern: str
+    samples: int
+    full_every: int | None
+
+    @classmethod
+    def parse(cls, spec: str) -> "SamplePolicy":
+        """
+        :param spec: 'PATTERN=SAMPLES[/EVERY]' (e.g. '*.vmdk=16/7', files are never compared entirely
+            if EVERY is missing or '-')
+        """
+        try:
+            pattern, _, policy = spec.rpartition('=')
+            if not pattern:
+                raise ValueError(spec)
+            samples, _, every = policy.partition('/')
+            full_every = int(every) if every not in ('', '-') else None
+            if int(samples) < 0 or (full_every is not None and full_every < 1):
+                raise ValueError(spec)
+            return cls(pattern, int(samples), full_every)
+        except ValueError:
+            raise ValueError(f"Wrong sample policy {spec!r}, expected 'PATTERN=SAMPLES[/EVERY]'")
+
+
+class SampledComparator(Comparator):
+    """Compares huge files in tiers: sizes first, then sampled blocks (head, tail and random offsets) and
+    the entire contents only every Nth comparison of a file or when modification times differ. Smaller files
+    are compared byte by byte"""
+    threshold: int
+    block_size: int
+    default: SamplePolicy
+    policies: list[SamplePolicy]
+
+    def __init__(self, threshold: int = SAMPLE_THRESHOLD, samples: int = 8, full_every: int | None = 10,
+                 policies: Iterable[SamplePolicy] = (), block_size: int = 1 << 16,
+                 throttle: Throttle | None = None) -> None:
+        """
+        :param threshold: minimal size in bytes of sampled files
+        :param samples: number of blocks read at random offsets besides the head and the tail
+        :param full_every: number of cycles after which a file is compared entirely (never if None)
+        :param policies: numbers of samples and periods of full comparisons of files matching patterns
+            (the first matching policy is used)
+        :param block_size: size of a sampled block in bytes
+        :param throttle: limiter of read bytes (not limited if None)
+        """
+        super().__init__(throttle)
+        self.threshold = threshold
+        self.block_size = block_size
+        self.default = SamplePolicy('*', samples, full_every)
+        self.policies = list(policies)
+        self.full_comparisons = 0
+        self._cycles: dict[str, int] = dict()
+
+    def _policy(self, file_path: str) -> SamplePolicy:
+        """
+        :param file_path: path to a source file
+        :returns: policy of the file
+        """
+        return next((policy for policy in self.policies if fnmatch.fnmatch(file_path, policy.pattern)), self.default)
+
+    def _offsets(self, size: int, samples: int) -> list[int]:
+        """
+        :param size: size of compared files
+        :param samples: number of random offsets
+        :returns: offsets of sampled blocks
+        """
+        last = max(0, size - self.block_size)
+        return [0, last] + [random.randint(0, last) for _ in range(samples)]
+
+    def _samples_equal(self, file_path1: str, file_path2: str, size: int, samples: int) -> bool:
+        """
+        Reads sampled blocks of both files stopping at the first difference
+
+        :param file_path1: path to the first file
+        :param file_path2: path to the second file
+        :param size: size of both files
+        :param samples: number of random offsets
+        :returns: True if all sampled blocks are the same
+        """
+        fd1 = os.open(file_path1, os.O_RDONLY)
+        try:
+            fd2 = os.open(file_path2, os.O_RDONLY)
+            try:
+                for offset in self._offsets(size, samples):
+                    length = min(self.block_size, size - offset)
+                    if self.throttle is not None:
+                        self.throttle.transfer(2 * length)
+                    with self._lock:
+                        self._bytes_read += 2 * length
+                    if os.pread(fd1, length, offset) != os.pread(fd2, length, offset):
+                        return False
+                return True
+            finally:
+                os.close(fd2)
+        finally:
+            os.close(fd1)
+
+    def _full_due(self, file_path: str, policy: SamplePolicy) -> bool:
+        """
+        Counts a comparison of a file
+
+        :param file_path: path to a source file
+        :param policy: policy of the file
+        :returns: True if the file should be compared entirely in this cycle
+        """
+        if policy.full_every is None:
+            return False
+        with self._lock:
+            # first periods of files are spread so that they are not compared entirely in the same cycle
+            count = self._cycles.get(file_path, zlib.crc32(file_path.encode(errors='surrogateescape')) %
+                                     policy.full_every) + 1
+            due = count >= policy.full_every
+            self._cycles[file_path] = 0 if due else count
+        return due
+
+    def same(self, file_path1: str, file_path2: str,
+             entry1: Entry | None = None, entry2: Entry | None = None) -> bool:
+        entry1 = entry1 if entry1 is not None else Entry.from_path(file_path1)
+        entry2 = entry2 if entry2 is not None else Entry.from_path(file_path2)
+        if not (entry1.is_file() and entry2.is_file()) or entry1.st_size < self.threshold:
+            return super().same(file_path1, file_path2, entry1, entry2)
+        if entry1.st_size != entry2.st_size:
+            return False
+        if self.throttle is not None:
+            self.throttle.operation()
+        policy = self._policy(file_path1)
+        if not self._samples_equal(file_path1, file_path2, entry1.st_size, policy.samples):
+            return False
+        # samples can't vouch for a file modified since it was copied
+        if self._full_due(file_path1, policy) or entry1.st_mtime_ns != entry2.st_mtime_ns:
+            logging.debug(f"Comparing {file_path1!r} entirely")
+            with self._lock:
+                self.full_comparisons += 1
+            return super().same(file_path1, file_path2, entry1, entry2)
+        return True
+
+    def copied(self, src: str, dst: str, entry: Entry | None = None) -> None:
+        # a fresh copy is as good as a full comparison
+        with self._lock:
+            if src in self._cycles:
+                self._cycles[src] = 0
+
+    def flush(self) -> None:
+        # counters of removed files are dropped
+        with self._lock:
+            paths = list(self._cycles)
+        gone = [file_path for file_path in paths if not os.path.lexists(file_path)]
+        with self._lock:
+            for file_path in gone:
+                self._cycles.pop(file_path, None)
@@ -0,0 +1,76 @@
+import logging
+from typing import Iterable, Iterator
+
+
+class ErrorLog:
+    """Paths of failed files of a cycle. Only the first 'limit' paths are kept in memory,
+    the rest are counted and written to a spill file if it's given"""
+    kind: str
+    limit: int
+    spill_path: str | None
+
+    def __init__(self, kind: str, limit: int = 1000, spill_path: str | None = None) -> None:
+        """
+        :param kind: kind of failed operation written along with spilled paths ('remove' or 'update')
+        :param limit: maximal number of paths kept in memory
+        :param spill_path: path to a file where paths over the limit are appended (they are only counted if None)
+        """
+        self.kind = kind
+        self.limit = limit
+        self.spill_path = spill_path
+        self._paths: list[str] = list()
+        self._spilled = 0
+        self._spill = None
+
+    def append(self, path: str) -> None:
+        """
+        :param path: path of a failed file
+        """
+        if len(self._paths) < self.limit:
+            self._paths.append(path)
+            return
+        self._spilled += 1
+        if self.spill_path is None:
+            return
+        if self._spill is None:
+            self._spill = open(self.spill_path, 'a', encoding='utf-8', buffering=1)
+        self._spill.write(f"{self.kind}\t{path}\n")
+
+    def extend(self, paths: Iterable[str]) -> None:
+        """
+        :param paths: paths of failed files (paths spilled by another error log are only counted)
+        """
+        for path in paths:
+            self.append(path)
+        if isinstance(paths, ErrorLog):
+            self._spilled += paths._spilled
+            paths.close()
+
+    def close(self) -> None:
+        """
+        Closes spill file
+        """
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            logging.info(f"{self._spilled} failed path(s) written to {self.spill_path!r}")
+
+    def __len__(self) -> int:
+        return len(self._paths) + self._spilled
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._paths
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ErrorLog):
+            return self._paths == other._paths and self._spilled == other._spilled
+        return self._spilled == 0 and self._paths == list(other)
+
+    def __repr__(self) -> str:
+        if self._spilled == 0:
+            return repr(self._paths)
+        where = f" (see {self.spill_path!r})" if self.spill_path is not None else ""
+        return f"{self._paths!r} and {self._spilled} more{where}"
@@ -0,0 +1,451 @@
+import os
+import queue
+import shutil
+import logging
+import threading
+from typing import Iterable
+
+from folder import Folder, Entry, merge_entries
+from digest import Comparator, SampledComparator
+from watcher import coalesce
+from stats import SyncStats
+from errorlog import ErrorLog
+
+
+# size of chunks read from source once and written to every replica
+CHUNK_SIZE = 1 << 20
+# default number of chunks queued for a replica before reading of source waits for it
+BUFFER_CHUNKS = 16
+
+
+class ReplicaWriter:
+    """Applies changes to a single replica in its own thread. Tasks and chunks of copied files are passed through
+    a bounded queue, so a slow replica delays the others only when its buffer is full"""
+    folder: Folder
+    remove_errors: ErrorLog
+    update_errors: ErrorLog
+
+    def __init__(self, folder: Folder, stats: SyncStats, comparator: Comparator, error_limit: int = 1000,
+                 error_file: str | None = None, buffer_chunks: int = BUFFER_CHUNKS) -> None:
+        """
+        Starts a writer thread
+
+        :param folder: replica folder
+        :param stats: stats of the cycle shared by all replicas
+        :param comparator: strategy of checking files for identity notified about copies
+        :param error_limit: maximal number of failed paths of each kind kept in memory during a cycle
+        :param error_file: path to a file where failed paths over the limit are written (only counted if None)
+        :param buffer_chunks: maximal number of queued tasks and chunks
+        """
+        self.folder = folder
+        self.stats = stats
+        self.comparator = comparator
+        self.remove_errors = ErrorLog('remove', error_limit, error_file)
+        self.update_errors = ErrorLog('update', error_limit, error_file)
+        # new folders whose metadata is copied at the end of the cycle
+        self._created: list[tuple[str, str]] = list()
+        # open temporary file, its path, source and replica paths of the current copy
+        self._current: tuple | None = None
+        self._written = 0
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(buffer_chunks)
+        self._thread = threading.Thread(target=self._work, name=f"replica-{os.path.basename(folder.path)}",
+                                        daemon=True)
+        self._thread.start()
+
+    def put(self, *task) -> None:
+        """
+        Queues a task waiting while the buffer of the replica is full
+
+        :param task: name of an operation followed by its arguments
+        """
+        self._queue.put(task)
+
+    def fail(self, kind: str, path: str) -> None:
+        """
+        :param kind: kind of failed operation ('remove' or 'update')
+        :param path: path of a failed file
+        """
+        with self._lock:
+            (self.remove_errors if kind == 'remove' else self.update_errors).append(path)
+
+    def finish(self) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Waits until all queued tasks are done and stops the thread
+
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self.remove_errors.close()
+        self.update_errors.close()
+        return self.remove_errors, self.update_errors
+
+    def _work(self) -> None:
+        while (task := self._queue.get()) is not None:
+            op, *args = task
+            try:
+                getattr(self, f"_{op}")(*args)
+            except:
+                if op == 'remove':
+                    logging.exception("Could not remove file")
+                    self.fail('remove', args[0])
+                    continue
+                logging.exception("Could not copy a file!")
+                source_path = self._discard()
+                if op in ('mkdir', 'copy', 'open'):
+                    source_path = args[0]
+                if source_path is not None:
+                    self.fail('update', source_path)
+        # modification times of new folders are restored after their content is written
+        for source_path, replica_path in reversed(self._created):
+            try:
+                shutil.copystat(source_path, replica_path)
+            except OSError:
+                logging.exception("Could not copy folder metadata")
+
+    def _changed(self, replica_path: str) -> None:
+        self.stats.change(os.path.relpath(os.path.dirname(os.path.normpath(replica_path)), self.folder.path))
+
+    def _remove(self, replica_path: str, r_entry: Entry) -> None:
+        with self.stats.phase('remove'):
+            self.folder.remove(replica_path, r_entry)
+        self.stats.add('removals')
+        self._changed(replica_path)
+
+    def _mkdir(self, source_path: str, replica_path: str) -> None:
+        os.mkdir(replica_path)
+        self._created.append((source_path, replica_path))
+        self._changed(replica_path)
+
+    def _copy(self, source_path: str, replica_path: str, s_entry: Entry) -> None:
+        with self.stats.phase('copy'):
+            copied = self.folder.copy_into(source_path, replica_path, s_entry)
+        self._copied(source_path, replica_path, s_entry, copied)
+
+    def _open(self, source_path: str, replica_path: str, s_entry: Entry) -> None:
+        if not self.folder._contains(replica_path):
+            raise PermissionError(f"Can't copy a file outside of {self.folder.path!r}")
+        if self.folder.throttle is not None:
+            self.folder.throttle.operation()
+        logging.debug(f"Copying {source_path!r} to {replica_path!r}")
+        tmp = self.folder.temp_path(replica_path)
+        self._current = (open(tmp, 'wb'), tmp, source_path, replica_path, s_entry)
+        self._written = 0
+
+    def _chunk(self, data: bytes) -> None:
+        if self._current is None:
+            # the copy already failed
+            return
+        if self.folder.throttle is not None:
+            self.folder.throttle.transfer(len(data))
+        with self.stats.phase('copy'):
+            self._current[0].write(data)
+        self._written += len(data)
+
+    def _close(self) -> None:
+        if self._current is None:
+            return
+        file, tmp, source_path, replica_path, s_entry = self._current
+        file.close()
+        shutil.copystat(source_path, tmp)
+        os.replace(tmp, replica_path)
+        self._current = None
+        self._copied(source_path, replica_path, s_entry, self._written)
+
+    def _abort(self) -> None:
+        # reading of source failed, it's logged by the reader
+        source_path = self._discard()
+        if source_path is not None:
+            self.fail('update', source_path)
+
+    def _discard(self) -> str | None:
+        """
+        Removes temporary file of the current copy
+
+        :returns: source path of the current copy or None if there is no copy
+        """
+        if self._current is None:
+            return None
+        file, tmp, source_path, _, _ = self._current
+        self._current = None
+        file.close()
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        return source_path
+
+    def _copied(self, source_path: str, replica_path: str, s_entry: Entry, copied: int) -> None:
+        self.stats.add('files_copied')
+        self.stats.add('bytes_copied', copied)
+        self._changed(replica_path)
+        if not s_entry.is_dir:
+            self.comparator.copied(source_path, replica_path, s_entry)
+        logging.info(f"File {source_path!r} was copied to {self.folder.path!r}")
+
+
+class FanOutSynchronizer:
+    """Synchronizes source folder with several replicas. Source is scanned and every copied file is read
+    once, its chunks are passed to every replica which needs it. Replicas are compared with source and
+    written independently, each of them has its own error lists"""
+    source: Folder
+    replicas: list[Folder]
+    comparator: Comparator
+    stats: SyncStats
+
+    def __init__(self, source: Folder, replicas: Iterable[Folder], comparator: Comparator | None = None,
+                 error_limit: int = 1000, error_file: str | None = None, buffer_chunks: int = BUFFER_CHUNKS) -> None:
+        """
+        :param source: folder with initial files
+        :param replicas: intended copies of source folder
+        :param comparator: strategy of checking files for identity (byte by byte comparison if None)
+        :param error_limit: maximal number of failed paths of each kind kept in memory for each replica
+        :param error_file: path to a file where failed paths over the limit are written (only counted if None)
+        :param buffer_chunks: maximal number of tasks and chunks of CHUNK_SIZE bytes queued for a replica
+        """
+        self.source = source
+        self.replicas = list(replicas)
+        logging.debug(f"Initializing fan-out synchronizer with {source.path = }; "
+                      f"replicas = {[replica.path for replica in self.replicas]}")
+        if not self.replicas:
+            raise ValueError("At least one replica is required")
+        if buffer_chunks < 1:
+            raise ValueError("Buffer should keep at least one chunk")
+        self.comparator = comparator if comparator is not None else Comparator()
+        self.error_limit = error_limit
+        self.error_file = error_file
+        self.buffer_chunks = buffer_chunks
+        # stats of the current or the last finished cycle
+        self.stats = SyncStats()
+        # failed to remove and failed to copy files of the last cycle by replica paths
+        self.errors: dict[str, tuple[ErrorLog, ErrorLog]] = dict()
+        if self.error_file is not None:
+            open(self.error_file, 'w').close()
+        self._writers: list[ReplicaWriter] = list()
+        self._bytes_read = 0
+
+    def _begin_cycle(self) -> None:
+        """
+        Checks folders and starts a writer for every replica
+        """
+        if not self.source.is_alive():
+            msg = "Source folder was removed during runtime"
+            logging.critical(msg)
+            raise RuntimeError(msg)
+        for replica in self.replicas:
+            if not replica.is_alive():
+                logging.error(f"Replica folder {replica.path!r} was removed during runtime. Trying to resync..")
+                replica.revive()
+        self.stats = SyncStats()
+        if self.error_file is not None:
+            open(self.error_file, 'w').close()
+        self._bytes_read = self.comparator.bytes_read
+        self._writers = [ReplicaWriter(replica, self.stats, self.comparator, self.error_limit, self.error_file,
+                                       self.buffer_chunks) for replica in self.replicas]
+
+    def _finish_cycle(self) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Waits for all replicas and finishes stats of the cycle
+
+        :returns: failed to remove files and failed to copy files of all replicas
+        """
+        limit = self.error_limit * len(self.replicas)
+        remove_errors, update_errors = ErrorLog('remove', limit), ErrorLog('update', limit)
+        self.errors = dict()
+        for writer in self._writers:
+            replica_remove_errors, replica_update_errors = writer.finish()
+            self.errors[writer.folder.path] = (replica_remove_errors, replica_update_errors)
+            if len(replica_remove_errors) + len(replica_update_errors) > 0:
+                logging.info(f"Replica {writer.folder.path!r}: {len(replica_remove_errors)} file(s) not removed, "
+                             f"{len(replica_update_errors)} file(s) not updated")
+            remove_errors.extend(replica_remove_errors)
+            update_errors.extend(replica_update_errors)
+        self._writers = list()
+        self.comparator.flush()
+        self.stats.add('bytes_compared', self.comparator.bytes_read - self._bytes_read)
+        self.stats.finish(len(remove_errors) + len(update_errors))
+        return remove_errors, update_errors
+
+    def _scan(self, folder: Folder, path: str) -> list[Entry]:
+        with self.stats.phase('scan'):
+            return folder.scan_sorted(path)
+
+    def _compared_by_digest(self, s_entry: Entry, r_entry: Entry) -> bool:
+        """
+        :param s_entry: scanned entry of source file
+        :param r_entry: scanned entry of replica file
+        :returns: True if the replica file is compared with the digest of source file shared by all replicas
+            (sampled files are compared by samples since their digests read them entirely)
+        """
+        if len(self.replicas) == 1 or not (s_entry.is_file() and r_entry.is_file()):
+            return False
+        if s_entry.st_size != r_entry.st_size:
+            return False
+        return not (isinstance(self.comparator, SampledComparator) and s_entry.st_size >= self.comparator.threshold)
+
+    def _identical(self, source_path: str, replica_path: str, s_entry: Entry, r_entry: Entry,
+                   digests: dict[str, str]) -> bool:
+        """
+        :param source_path: path of a file in source folder
+        :param replica_path: path of the file in replica folder
+        :param s_entry: scanned entry of source file
+        :param r_entry: scanned entry of replica file
+        :param digests: digests of source files by their paths which are found once for all replicas
+        :returns: True if the files are the same
+        """
+        self.stats.add('files_compared')
+        try:
+            with self.stats.phase('compare'):
+                if not self._compared_by_digest(s_entry, r_entry):
+                    return self.comparator.same(source_path, replica_path, s_entry, r_entry)
+                if source_path not in digests:
+                    digests[source_path] = self.comparator.digest(source_path, s_entry)
+                return self.comparator.digest(replica_path, r_entry) == digests[source_path]
+        except:
+            logging.exception("Could not compare files, the file will be copied")
+            return False
+
+    def _diff(self, writer: ReplicaWriter, s_path: str, r_path: str, s_entry: Entry | None, r_entry: Entry | None,
+              copies: dict, subfolders: dict, digests: dict[str, str]) -> None:
+        """
+        Queues removal of obsolete replica file and collects copies and subfolders needed by the replica
+
+        :param writer: writer of the replica
+        :param s_path: path of a file in source folder
+        :param r_path: path of the file in replica folder
+        :param s_entry: scanned entry of source file (None if it does not exist)
+        :param r_entry: scanned entry of replica file (None if it does not exist)
+        :param copies: source entries and lists of writers with replica paths by source paths of copied files
+        :param subfolders: lists of writers with replica paths and their existence by source paths of subfolders
+        :param digests: digests of compared source files by their paths (see _identical)
+        """
+        if s_entry is None or (r_entry is not None and r_entry.is_dir != s_entry.is_dir):
+            writer.put('remove', r_path, r_entry)
+            r_entry = None
+        if s_entry is None:
+            return
+        if s_entry.is_dir:
+            if r_entry is None:
+                writer.put('mkdir', s_path, r_path)
+            subfolders.setdefault(s_path, list()).append((writer, r_path, r_entry is not None))
+        elif r_entry is None or not self._identical(s_path, r_path, s_entry, r_entry, digests):
+            copies.setdefault(s_path, (s_entry, list()))[1].append((writer, r_path))
+
+    def _tee(self, source_path: str, s_entry: Entry, targets: list[tuple[ReplicaWriter, str]]) -> None:
+        """
+        Reads source file once passing its chunks to all replicas which need it
+
+        :param source_path: path of a file in source folder
+        :param s_entry: scanned entry of source file
+        :param targets: writers of replicas with paths of the file in them
+        """
+        if not s_entry.is_file() or os.path.islink(source_path):
+            # symlinks and special files are copied by each replica
+            for writer, replica_path in targets:
+                writer.put('copy', source_path, replica_path, s_entry)
+            return
+        for writer, replica_path in targets:
+            writer.put('open', source_path, replica_path, s_entry)
+        try:
+            with open(source_path, 'rb') as file:
+                while chunk := file.read(CHUNK_SIZE):
+                    for writer, _ in targets:
+                        writer.put('chunk', chunk)
+        except:
+            logging.exception("Could not copy a file!")
+            for writer, _ in targets:
+                writer.put('abort')
+            return
+        for writer, _ in targets:
+            writer.put('close')
+
+    def _walk(self, folders: list[tuple[str, list]], copies: dict) -> None:
+        """
+        Synchronizes folders walking subfolders with an explicit stack. Every source folder is listed once
+        and merged with its copy in every replica
+
+        :param folders: stack of source folders with lists of writers, replica paths and their existence
+        :param copies: copies found before the walk (see _diff)
+        """
+        for source_path, (s_entry, targets) in copies.items():
+            self._tee(source_path, s_entry, targets)
+        while folders:
+            s_dir, targets = folders.pop()
+            try:
+                s_entries = self._scan(self.source, s_dir)
+            except:
+                if s_dir == self.source.path:
+                    raise
+                logging.exception("Could not update a file!")
+                for writer, _, _ in targets:
+                    writer.fail('update', s_dir)
+                continue
+            self.stats.add('dirs_scanned')
+
+            copies, subfolders, digests = dict(), dict(), dict()
+            for writer, r_dir, exists in targets:
+                try:
+                    # folders which are going to be created are empty
+                    r_entries = self._scan(writer.folder, r_dir) if exists else []
+                except:
+                    logging.exception("Could not update a file!")
+                    writer.fail('update', s_dir)
+                    continue
+                for s_entry, r_entry in merge_entries(s_entries, r_entries):
+                    name = s_entry.name if s_entry is not None else r_entry.name
+                    self._diff(writer, os.path.join(s_dir, name), os.path.join(r_dir, name), s_entry, r_entry,
+                               copies, subfolders, digests)
+            del s_entries
+            for source_path, (s_entry, copy_targets) in copies.items():
+                self._tee(source_path, s_entry, copy_targets)
+            folders.extend(subfolders.items())
+
+    def sync_folders(self) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes source folder with all replicas
+
+        :returns: failed to remove files and failed to copy files of all replicas
+        """
+        self._begin_cycle()
+        try:
+            self._walk([(self.source.path, [(writer, writer.folder.path, True) for writer in self._writers])],
+                       dict())
+        finally:
+            errors = self._finish_cycle()
+        return errors
+
+    def sync_paths(self, paths: Iterable[str]) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes only given files and folders (e.g. reported by a watcher) with all replicas
+
+        :param paths: paths of changed files relative to source folder
+        :returns: failed to remove files and failed to copy files of all replicas
+        """
+        targets = set()
+        for path in paths:
+            path = os.path.normpath(path)
+            # excluded paths are neither copied nor removed
+            if self.source.excluded(os.path.join(self.source.path, path)) or any(
+                    replica.excluded(os.path.join(replica.path, path)) for replica in self.replicas):
+                continue
+            # changes of a file inside a folder missing in some replica are applied with the whole folder
+            while os.path.dirname(path) and not all(
+                    os.path.isdir(os.path.join(replica.path, os.path.dirname(path))) for replica in self.replicas):
+                path = os.path.dirname(path)
+            targets.add(path)
+
+        self._begin_cycle()
+        try:
+            copies, subfolders, digests = dict(), dict(), dict()
+            for path in coalesce(targets):
+                s_full_file = os.path.join(self.source.path, path)
+                s_entry = Entry.from_path(s_full_file) if os.path.lexists(s_full_file) else None
+                for writer in self._writers:
+                    r_full_file = os.path.join(writer.folder.path, path)
+                    r_entry = Entry.from_path(r_full_file) if os.path.lexists(r_full_file) else None
+                    if s_entry is not None or r_entry is not None:
+                        self._diff(writer, s_full_file, r_full_file, s_entry, r_entry, copies, subfolders,
+                                   digests)
+            self._walk(list(subfolders.items()), copies)
+        finally:
+            errors = self._finish_cycle()
+        return errors
@@ -0,0 +1,196 @@
+import os
+import stat
+import errno
+import shutil
+import logging
+import threading
+from collections import Counter
+
+from throttle import Throttle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# ioctl request cloning a file on copy-on-write filesystems (btrfs, XFS)
+FICLONE = 0x40049409
+STRATEGIES = ('reflink', 'copy_file_range', 'sendfile', 'buffered')
+CHUNK_SIZE = 1 << 23
+
+# errors meaning that strategy is not supported for given files
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+                errno.EBADF, errno.ETXTBSY, errno.EPERM}
+
+# chosen strategy by (source device, destination device)
+_strategies: dict[tuple[int, int], str] = dict()
+_lock = threading.Lock()
+strategy_counts: Counter = Counter()
+
+
+def _reflink(src_fd: int, dst_fd: int, size: int, throttle: Throttle | None = None) -> None:
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "ioctl is not available")
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int, throttle: Throttle | None = None) -> None:
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    offset = 0
+    while offset < size:
+        if throttle is not None:
+            throttle.transfer(min(CHUNK_SIZE, size - offset))
+        copied = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - offset), offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int, throttle: Throttle | None = None) -> None:
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    offset = 0
+    while offset < size:
+        if throttle is not None:
+            throttle.transfer(min(CHUNK_SIZE, size - offset))
+        sent = os.sendfile(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _buffered(src_fd: int, dst_fd: int, size: int, throttle: Throttle | None = None) -> None:
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    with open(src_fd, 'rb', buffering=0, closefd=False) as src, open(dst_fd, 'wb', buffering=0, closefd=False) as dst:
+        while read := src.readinto(buffer):
+            if throttle is not None:
+                throttle.transfer(read)
+            dst.write(view[:read])
+
+
+_COPIERS = {'reflink': _reflink, 'copy_file_range': _copy_file_range, 'sendfile': _sendfile, 'buffered': _buffered}
+
+
+def reflink(src: str, dst: str) -> None:
+    """
+    Clones a file on a copy-on-write filesystem (content is shared until one of the files is changed)
+
+    :param src: path to an existing file
+    :param dst: path to a new file (replaced if exists)
+    :raises OSError: if reflinks are not supported for the files
+    """
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            _reflink(src_fd, dst_fd, 0)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def copy_file(src: str, dst: str, throttle: Throttle | None = None) -> str:
+    """
+    Copies file content (without metadata) trying reflink, copy_file_range and sendfile before
+    a userspace copy. The first working strategy is remembered for the pair of devices
+
+    :param src: path to a source file
+    :param dst: path to a destination file (replaced if exists)
+    :param throttle: limiter of copied bytes (reflinks copy no data and are not limited)
+    :returns: name of used strategy
+    """
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        src_stat = os.fstat(src_fd)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, src_stat.st_mode & 0o777)
+        try:
+            devices = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+            cached = _strategies.get(devices)
+            candidates = STRATEGIES[STRATEGIES.index(cached):] if cached is not None else STRATEGIES
+            for strategy in candidates:
+                try:
+                    _COPIERS[strategy](src_fd, dst_fd, src_stat.st_size, throttle)
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED or strategy == 'buffered':
+                        raise
+                    # partial copy advanced the offset, so the next strategy would write after a hole
+                    os.ftruncate(dst_fd, 0)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+                    continue
+                break
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    with _lock:
+        strategy_counts[strategy] += 1
+        if _strategies.get(devices) != strategy:
+            _strategies[devices] = strategy
+            logging.info(f"Using {strategy} copies from device {devices[0]} to device {devices[1]}")
+    logging.debug(f"{src!r} copied to {dst!r} with {strategy}")
+    return strategy
+
+
+def copy2(src: str, dst: str, follow_symlinks: bool = True, throttle: Throttle | None = None) -> str:
+    """
+    Replacement of shutil.copy2 using the fastest available copy strategy
+
+    :param src: path to a source file
+    :param dst: path to a destination file
+    :param follow_symlinks: if False symlinks are copied as symlinks
+    :param throttle: limiter of copied bytes (not limited if None)
+    :returns: path to a destination file
+    """
+    if not follow_symlinks and os.path.islink(src):
+        return shutil.copy2(src, dst, follow_symlinks=False)
+    copy_file(src, dst, throttle)
+    shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+    return dst
+
+
+def copy_small(src: str, dst: str, mode: int, mtime_ns: int, buffer: bytearray,
+               throttle: Throttle | None = None) -> int:
+    """
+    Copies a small regular file reading it at once into a reused buffer. Mode and modification time
+    are set through the open descriptor instead of copying metadata by paths
+
+    :param src: path to a source file (symlinks are not followed)
+    :param dst: path to a destination file (replaced if exists)
+    :param mode: mode of the source file
+    :param mtime_ns: modification time of the source file in nanoseconds (also used as access time)
+    :param buffer: buffer bigger than the file
+    :param throttle: limiter of copied bytes (not limited if None)
+    :returns: number of copied bytes
+    :raises OSError: if the source is a symlink or it does not fit the buffer
+    """
+    view = memoryview(buffer)
+    src_fd = os.open(src, os.O_RDONLY | os.O_NOFOLLOW)
+    try:
+        size = 0
+        while read := os.readv(src_fd, [view[size:]]):
+            size += read
+            if size == len(buffer):
+                raise OSError(errno.EFBIG, "File does not fit the buffer", src)
+    finally:
+        os.close(src_fd)
+    if throttle is not None:
+        throttle.transfer(size)
+
+    dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        written = 0
+        while written < size:
+            written += os.write(dst_fd, view[written:size])
+        os.fchmod(dst_fd, stat.S_IMODE(mode))
+        os.utime(dst_fd, ns=(mtime_ns, mtime_ns))
+    finally:
+        os.close(dst_fd)
+    with _lock:
+        strategy_counts['small'] += 1
+    return size
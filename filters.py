@@ -0,0 +1,144 @@
+import os
+import re
+import logging
+from typing import Iterable, NamedTuple
+
+
+class Rule(NamedTuple):
+    """Gitignore-style rule translated to a regular expression matching relative paths"""
+    pattern: str
+    regex: str
+    negated: bool
+    dir_only: bool
+
+
+def translate(pattern: str) -> str:
+    """
+    Translates gitignore glob to a regular expression. Patterns with a slash (except a trailing one) are
+    relative to the root, others match names at any depth; '**' matches any number of folders
+
+    :param pattern: glob without negation and trailing slash
+    :returns: regular expression matching entire relative paths with '/' separators
+    """
+    anchored = '/' in pattern
+    segments = pattern.lstrip('/').split('/')
+    parts = list()
+    for index, segment in enumerate(segments):
+        last = index == len(segments) - 1
+        if segment == '**':
+            parts.append('.*' if last else '(?:.*/)?')
+            continue
+        i, regex = 0, ''
+        while i < len(segment):
+            char = segment[i]
+            if char == '*':
+                regex += '[^/]*'
+                while i + 1 < len(segment) and segment[i + 1] == '*':
+                    i += 1
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[' and (end := segment.find(']', i + 2)) != -1:
+                body = segment[i + 1:end]
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                i = end
+            elif char == '\\' and i + 1 < len(segment):
+                i += 1
+                regex += re.escape(segment[i])
+            else:
+                regex += re.escape(char)
+            i += 1
+        parts.append(regex if last else regex + '/')
+    regex = ''.join(parts)
+    return regex if anchored else '(?:.*/)?' + regex
+
+
+def parse_rule(line: str) -> Rule | None:
+    """
+    :param line: line of gitignore format ('!' negates a rule, a trailing slash matches folders only)
+    :returns: parsed rule or None for blank lines and comments
+    """
+    line = line.rstrip('\n')
+    if not line.endswith('\\ '):
+        line = line.rstrip()
+    if not line or line.startswith('#'):
+        return None
+    negated = line.startswith('!')
+    if negated or line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    pattern = line.rstrip('/')
+    if not pattern:
+        return None
+    return Rule(line, translate(pattern), negated, dir_only)
+
+
+def read_rules(path: str) -> list[str]:
+    """
+    :param path: path to a file with rules in gitignore format
+    :returns: lines of the file
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read().splitlines()
+
+
+class Filter:
+    """Include/exclude rules in gitignore format compiled into a single regular expression per entry type.
+    The last matching rule wins, so '!' rules include paths excluded by earlier rules. Rules are evaluated
+    while folders are listed, so an excluded folder is never listed and its content can't be included again"""
+    rules: list[Rule]
+
+    def __init__(self, lines: Iterable[str]) -> None:
+        """
+        :param lines: rules in gitignore format in the order of priority (the last one is the strongest)
+        """
+        self.rules = [rule for line in lines if (rule := parse_rule(line)) is not None]
+        # alternatives are tried in order, so the last rule goes first and a match tells the winning rule
+        ordered = self.rules[::-1]
+        self._dir_rules = ordered
+        self._file_rules = [rule for rule in ordered if not rule.dir_only]
+        self._dir_regex = self._compile(self._dir_rules)
+        self._file_regex = self._compile(self._file_rules)
+        logging.debug(f"Compiled {len(self.rules)} filter rule(s)")
+
+    @staticmethod
+    def _compile(rules: list[Rule]) -> re.Pattern | None:
+        """
+        :param rules: rules from the strongest one
+        :returns: expression with a group per rule (None if there are no rules)
+        """
+        if not rules:
+            return None
+        return re.compile('|'.join(f"({rule.regex})" for rule in rules), re.DOTALL)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        """
+        Checks a path by rules ignoring its parent folders (they are checked on the way down)
+
+        :param path: path relative to the root with '/' separators
+        :param is_dir: True if the path is a folder
+        :returns: True if the path is excluded
+        """
+        regex, rules = (self._dir_regex, self._dir_rules) if is_dir else (self._file_regex, self._file_rules)
+        if regex is None:
+            return False
+        match = regex.fullmatch(path)
+        return match is not None and not rules[match.lastindex - 1].negated
+
+    def excluded(self, path: str, is_dir: bool) -> bool:
+        """
+        :param path: path relative to the root
+        :param is_dir: True if the path is a folder
+        :returns: True if the path or any of its parent folders is excluded
+        """
+        parts = os.path.normpath(path).replace(os.sep, '/').split('/')
+        if parts == [os.curdir]:
+            return False
+        for depth in range(1, len(parts)):
+            if self.matches('/'.join(parts[:depth]), True):
+                return True
+        return self.matches('/'.join(parts), is_dir)
@@ -1,36 +1,246 @@
 import os
+import stat
 import shutil
 import logging
+from typing import Callable, Iterable, Iterator
 from filecmp import cmp
 
+import fastcopy
+from delta import delta_copy
+from throttle import Throttle
+from profiling import timed
+from filters import Filter
+
+
+# suffix of temporary copies which are put in place when they are complete
+TEMP_SUFFIX = '.sync-tmp'
+
+
+class Entry:
+    """Compact record of a directory entry with type and stat data cached from os.scandir"""
+    __slots__ = ('name', 'path', 'is_dir', 'st_mode', 'st_size', 'st_mtime_ns', 'st_ino', 'st_dev')
+
+    def __init__(self, name: str, path: str, is_dir: bool, st: os.stat_result) -> None:
+        """
+        :param name: name of a file
+        :param path: path to a file
+        :param is_dir: True if a file is a folder
+        :param st: result of os.stat call for a file
+        """
+        self.name = name
+        self.path = path
+        self.is_dir = is_dir
+        self.st_mode = st.st_mode
+        self.st_size = st.st_size
+        self.st_mtime_ns = st.st_mtime_ns
+        self.st_ino = st.st_ino
+        self.st_dev = st.st_dev
+
+    @classmethod
+    def from_dir_entry(cls, dir_entry: os.DirEntry) -> "Entry":
+        """
+        :param dir_entry: entry returned by os.scandir
+        """
+        try:
+            return cls(dir_entry.name, dir_entry.path, dir_entry.is_dir(), dir_entry.stat())
+        except FileNotFoundError:
+            # broken symlink
+            return cls(dir_entry.name, dir_entry.path, False, dir_entry.stat(follow_symlinks=False))
+
+    @classmethod
+    def from_path(cls, path: str) -> "Entry":
+        """
+        :param path: path to a file
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            # broken symlink
+            st = os.lstat(path)
+        return cls(os.path.basename(path), path, stat.S_ISDIR(st.st_mode), st)
+
+    def is_file(self) -> bool:
+        """
+        :returns: True if entry is a regular file
+        """
+        return stat.S_ISREG(self.st_mode)
+
+
+def merge_entries(entries1: Iterable[Entry],
+                  entries2: Iterable[Entry]) -> Iterator[tuple[Entry | None, Entry | None]]:
+    """
+    Merges two streams of entries sorted by names
+
+    :param entries1: entries of the first folder sorted by names
+    :param entries2: entries of the second folder sorted by names
+    :returns: pairs of entries with the same name (an entry is None if the name is missing in its folder)
+    """
+    it1, it2 = iter(entries1), iter(entries2)
+    entry1, entry2 = next(it1, None), next(it2, None)
+    while entry1 is not None or entry2 is not None:
+        if entry2 is None or (entry1 is not None and entry1.name < entry2.name):
+            yield entry1, None
+            entry1 = next(it1, None)
+        elif entry1 is None or entry2.name < entry1.name:
+            yield None, entry2
+            entry2 = next(it2, None)
+        else:
+            yield entry1, entry2
+            entry1, entry2 = next(it1, None), next(it2, None)
+
 
 class Folder:
     """Entity representing existing directory"""
     path: str
+    delta_threshold: int | None
+    block_size: int
+    throttle: Throttle | None
+    filters: Filter | None
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, delta_threshold: int | None = None, block_size: int = 1 << 17,
+                 throttle: Throttle | None = None, filters: Filter | None = None) -> None:
         """
         Creates Folder object and checks for existence
 
         :param path: a path to existing folder
+        :param delta_threshold: minimal size in bytes of a modified file which is updated by blocks
+            instead of full copy (files are always copied entirely if None)
+        :param block_size: size of compared blocks for updates by blocks in bytes
+        :param throttle: limiter of copies and removals inside the folder (not limited if None)
+        :param filters: rules of excluded paths which are never listed, copied or removed (nothing is excluded
+            if None)
         """
         if type(path) != str:
             raise TypeError("Path should be a string!")
         elif not os.path.isdir(path):
             raise ValueError("Given path is not a folder or does not exist")
         self.path = path
+        self.delta_threshold = delta_threshold
+        self.block_size = block_size
+        self.throttle = throttle
+        self.filters = filters if filters else None
 
     @staticmethod
-    def compare_files(file_path1: str, file_path2: str, content: bool = True) -> bool:
+    @timed('compare')
+    def compare_files(file_path1: str, file_path2: str, content: bool = True,
+                      entry1: Entry | None = None, entry2: Entry | None = None,
+                      throttle: Throttle | None = None) -> bool:
         """
         Comparing two files for identity. By default, files are treated as different if their sizes or contents differ
 
         :param file_path1: path to the first file
         :param file_path2: path to the second file
         :param content: True if content comparison is needed.
+        :param entry1: scanned entry of the first file (files are stat'ed if any entry is None)
+        :param entry2: scanned entry of the second file
+        :param throttle: limiter of read bytes (not limited if None)
         :return: True if files are the same and False otherwise
         """
-        return cmp(file_path1, file_path2, shallow=not content)
+        if throttle is not None:
+            throttle.operation()
+            if entry1 is None or entry2 is None:
+                entry1, entry2 = Entry.from_path(file_path1), Entry.from_path(file_path2)
+        if entry1 is None or entry2 is None:
+            return cmp(file_path1, file_path2, shallow=not content)
+
+        # the same rules as in filecmp.cmp but with already known stat data
+        if not (entry1.is_file() and entry2.is_file()):
+            return False
+        if not content and entry1.st_size == entry2.st_size and entry1.st_mtime_ns == entry2.st_mtime_ns:
+            return True
+        if entry1.st_size != entry2.st_size:
+            return False
+        return Folder._compare_contents(file_path1, file_path2, throttle=throttle)
+
+    @staticmethod
+    def _compare_contents(file_path1: str, file_path2: str, chunk_size: int = 1 << 16,
+                          throttle: Throttle | None = None) -> bool:
+        """
+        Compares files byte by byte stopping at the first difference
+
+        :param file_path1: path to the first file
+        :param file_path2: path to the second file
+        :param chunk_size: size of a chunk read at once in bytes
+        :param throttle: limiter of read bytes (not limited if None)
+        :return: True if contents are the same and False otherwise
+        """
+        with open(file_path1, 'rb') as file1, open(file_path2, 'rb') as file2:
+            while True:
+                chunk1 = file1.read(chunk_size)
+                if throttle is not None:
+                    throttle.transfer(2 * len(chunk1))
+                if chunk1 != file2.read(chunk_size):
+                    return False
+                if not chunk1:
+                    return True
+
+    def _contains(self, file_path: str) -> bool:
+        """
+        :param file_path: path to a file
+        :returns: True if the file is inside the folder or it's the folder itself
+        """
+        # normalizing path to remove ../ and use os separators
+        file_path = os.path.normpath(file_path)
+        folder_path = os.path.normpath(self.path)
+        return file_path.startswith(folder_path.rstrip(os.sep) + os.sep) or file_path == folder_path
+
+    def _relative(self, path: str) -> str:
+        """
+        :param path: path inside the folder
+        :returns: path relative to the folder with '/' separators
+        """
+        return os.path.relpath(path, self.path).replace(os.sep, '/')
+
+    def excluded(self, file_path: str, is_dir: bool | None = None) -> bool:
+        """
+        :param file_path: path to a file inside the folder
+        :param is_dir: True if the file is a folder (it's stat'ed if None)
+        :returns: True if the file or any of its parent folders is excluded by filters
+        """
+        if self.filters is None:
+            return False
+        is_dir = is_dir if is_dir is not None else os.path.isdir(file_path)
+        return self.filters.excluded(self._relative(file_path), is_dir)
+
+    def _filter(self, path: str, entries: Iterable[Entry]) -> list[Entry]:
+        """
+        :param path: path to a listed folder
+        :param entries: entries of the folder
+        :returns: entries which are not excluded by filters
+        """
+        base = self._relative(path)
+        prefix = '' if base == os.curdir else base + '/'
+        return [entry for entry in entries if not self.filters.matches(prefix + entry.name, entry.is_dir)]
+
+    @timed('list', 1)
+    def scan(self, path: str) -> dict[str, Entry]:
+        """
+        Lists folder inside this folder in a single pass keeping entries' types and stat data.
+        Excluded entries are skipped
+
+        :param path: path to a folder
+        :returns: entries of the folder by their names
+        """
+        with os.scandir(path) as it:
+            entries = [Entry.from_dir_entry(dir_entry) for dir_entry in it]
+        if self.filters is not None:
+            entries = self._filter(path, entries)
+        return {entry.name: entry for entry in entries}
+
+    @timed('list', 1)
+    def scan_sorted(self, path: str) -> list[Entry]:
+        """
+        Lists folder inside this folder in a single pass ordering entries by names. Excluded entries are skipped
+
+        :param path: path to a folder
+        :returns: entries of the folder sorted by names
+        """
+        with os.scandir(path) as it:
+            entries = [Entry.from_dir_entry(dir_entry) for dir_entry in it]
+        if self.filters is not None:
+            entries = self._filter(path, entries)
+        entries.sort(key=lambda entry: entry.name)
+        return entries
 
     def is_alive(self) -> bool:
         """
@@ -46,20 +256,26 @@ class Folder:
         """
         os.mkdir(self.path)
 
-    def remove(self, file_path: str) -> None:
+    @timed('remove', 1)
+    def remove(self, file_path: str, entry: Entry | None = None) -> None:
         """
         Removes file or entire directory from folder
 
         :param file_path: path to a file or a directory in a folder
+        :param entry: scanned entry of the file (it's stat'ed if None)
         """
-        # normalizing path to remove ../ and use os separators
-        file_path = os.path.normpath(file_path).strip(os.sep)
         # remove only content inside folder
-        if not (file_path.startswith(self.path + os.sep) or file_path == os.path.normpath(self.path)):
+        if not self._contains(file_path):
             raise PermissionError(f"Can't delete a file outside of {self.path!r}")
+        file_path = os.path.normpath(file_path)
+        if self.throttle is not None:
+            self.throttle.operation()
 
-        if os.path.isdir(file_path):
+        if entry.is_dir if entry is not None else os.path.isdir(file_path):
             logging.debug(f"Removing folder {file_path}")
+            if self.filters is not None and not self._remove_unprotected(file_path):
+                logging.info(f"Folder {file_path!r} is kept with excluded files inside")
+                return
             shutil.rmtree(file_path)
             logging.info(f"Folder {file_path!r} removed")
         else:
@@ -67,22 +283,210 @@ class Folder:
             os.remove(file_path)
             logging.info(f"{file_path!r} removed")
 
-    def copy_into(self, src: str, dst: str) -> None:
+    def _unlink(self, file_path: str) -> None:
+        """
+        :param file_path: path to a file which is not a folder
+        """
+        os.remove(file_path)
+
+    def _remove_unprotected(self, path: str) -> bool:
+        """
+        Removes content of a folder which is not excluded by filters
+
+        :param path: path to a folder
+        :returns: True if the folder is empty now
+        """
+        for entry in self.scan(path).values():
+            if entry.is_dir and not os.path.islink(entry.path):
+                if self._remove_unprotected(entry.path):
+                    os.rmdir(entry.path)
+            else:
+                self._unlink(entry.path)
+        with os.scandir(path) as it:
+            return next(it, None) is None
+
+    def _ignore(self, src: str, dst: str) -> Callable[[str, list[str]], set[str]] | None:
+        """
+        :param src: source path of a copied folder
+        :param dst: destination path of the folder inside this folder
+        :returns: function telling excluded names of a folder copied by shutil.copytree (None if nothing is excluded)
+        """
+        if self.filters is None:
+            return None
+        base = self._relative(dst)
+
+        def ignore(folder: str, names: list[str]) -> set[str]:
+            prefix = os.path.normpath(os.path.join(base, os.path.relpath(folder, src))).replace(os.sep, '/') + '/'
+            return {name for name in names
+                    if self.filters.matches(prefix + name, os.path.isdir(os.path.join(folder, name)))}
+        return ignore
+
+    def move(self, old_path: str, new_path: str) -> None:
         """
-        Copies file or entire folder to a folder (deep copy with metadata)
+        Renames file or directory inside the folder
+
+        :param old_path: current path to a file or a directory in a folder
+        :param new_path: new path in the folder
+        """
+        if not (self._contains(old_path) and self._contains(new_path)):
+            raise PermissionError(f"Can't move a file outside of {self.path!r}")
+        os.rename(old_path, new_path)
+
+    def stored_digest(self, file_path: str) -> tuple[int, str, str] | None:
+        """
+        :param file_path: path to a file in a folder
+        :returns: original size, hash algorithm and digest of original content of a file which is transformed
+            when it's stored (None if the file is stored as is)
+        """
+        return None
+
+    @staticmethod
+    def temp_path(dst: str) -> str:
+        """
+        :param dst: destination path of a copy
+        :returns: path of a temporary copy next to the destination
+        """
+        head, tail = os.path.split(os.path.normpath(dst))
+        return os.path.join(head, f".{tail}{TEMP_SUFFIX}")
+
+    def delta_applicable(self, src: str, dst: str) -> bool:
+        """
+        Checks whether existing copy of a file can be updated by blocks
 
         :param src: full path from source folder to a file
-        :param dst: full destination path to a folder with its filename"""
-        file_path = os.path.normpath(dst).strip(os.sep)
+        :param dst: full destination path to a folder with its filename
+        :returns: True if both files are regular (not symlinks) and big enough and the copy is not
+            a hardlink (other paths sharing its content would be changed as well)
+        """
+        if self.delta_threshold is None:
+            return False
+        try:
+            src_stat = os.lstat(src)
+            dst_stat = os.lstat(dst)
+        except FileNotFoundError:
+            return False
+        return (stat.S_ISREG(src_stat.st_mode) and stat.S_ISREG(dst_stat.st_mode) and dst_stat.st_nlink == 1 and
+                min(src_stat.st_size, dst_stat.st_size) >= self.delta_threshold)
+
+    def copy_small_files(self, files: list[tuple[str, str, Entry]],
+                         buffer: bytearray) -> tuple[int, list[tuple[str, str, Entry]]]:
+        """
+        Copies a batch of small regular files into the folder. Destination folders are checked once per batch,
+        every file is read at once into the reused buffer and its metadata is set by descriptor. Temporary copies
+        are put in place together at the end and a single summary is logged for the batch
+
+        :param files: source paths, destination paths and scanned entries of source files
+        :param buffer: reused buffer bigger than any of the files
+        :returns: number of written bytes and files which were not copied (symlinks, changed or failed files
+            which should be copied one by one)
+        """
+        checked, copied, failed = set(), list(), list()
+        written = 0
+        for file in files:
+            src, dst, entry = file
+            folder = os.path.dirname(dst)
+            if folder not in checked:
+                if not self._contains(folder):
+                    failed.append(file)
+                    continue
+                checked.add(folder)
+            if self.throttle is not None:
+                self.throttle.operation()
+            tmp = self.temp_path(dst)
+            try:
+                size = fastcopy.copy_small(src, tmp, entry.st_mode, entry.st_mtime_ns, buffer, self.throttle)
+                copied.append((tmp, file, size))
+            except OSError as e:
+                logging.debug(f"{src!r} is not copied in a batch: {e}")
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                failed.append(file)
+        for tmp, file, size in copied:
+            try:
+                os.replace(tmp, file[1])
+                written += size
+            except OSError as e:
+                logging.debug(f"{file[0]!r} is not copied in a batch: {e}")
+                os.remove(tmp)
+                failed.append(file)
+        logging.info(f"Batch of {len(files) - len(failed)} small file(s) copied into {self.path!r} ({written} bytes)")
+        return written, failed
+
+    @timed('copy', 1)
+    def copy_into(self, src: str, dst: str, entry: Entry | None = None,
+                  link: Callable[[str, str, str], bool] | None = None) -> int:
+        """
+        Copies file or entire folder to a folder (deep copy with metadata). Copies are written to temporary files
+        and put in place atomically so that an interrupted copy never leaves a partial file in the folder
+
+        :param src: full path from source folder to a file
+        :param dst: full destination path to a folder with its filename
+        :param entry: scanned entry of the source file (it's stat'ed if None)
+        :param link: function trying to create a temporary copy of a file as a link of a file with the same
+            content by its source path, temporary path and destination path (files are always copied if None)
+        :returns: number of written bytes"""
         # copy only inside the folder
-        if not (file_path.startswith(self.path + os.sep) or file_path == os.path.normpath(self.path)):
+        if not self._contains(dst):
             raise PermissionError(f"Can't copy a file outside of {self.path!r}")
+        if self.throttle is not None:
+            self.throttle.operation()
 
-        if not os.path.isdir(src):
+        if not (entry.is_dir if entry is not None else os.path.isdir(src)):
+            tmp = self.temp_path(dst)
+            if self.delta_applicable(src, dst):
+                logging.debug(f"Updating {dst!r} by blocks from {src!r}")
+                try:
+                    # a reflink shares content with the outdated copy, so it's updated aside and put in place atomically
+                    fastcopy.reflink(dst, tmp)
+                    target = tmp
+                except OSError:
+                    # a clone would be a full copy, so the file is updated in place (callers journal it as in progress)
+                    if os.path.lexists(tmp):
+                        os.remove(tmp)
+                    target = dst
+                try:
+                    written = delta_copy(src, target, self.block_size, self.throttle)
+                    shutil.copystat(src, target, follow_symlinks=False)
+                    if target == tmp:
+                        os.replace(tmp, dst)
+                except:
+                    if target == tmp and os.path.lexists(tmp):
+                        os.remove(tmp)
+                    raise
+                logging.info(f"File {src!r} was copied ({written} bytes rewritten)")
+                return written
             logging.debug(f"Copying {src!r} to {dst!r}")
-            shutil.copy2(src, dst, follow_symlinks=False)
+            try:
+                if link is not None and link(src, tmp, dst):
+                    os.replace(tmp, dst)
+                    return 0
+                fastcopy.copy2(src, tmp, follow_symlinks=False, throttle=self.throttle)
+                os.replace(tmp, dst)
+            except:
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                raise
             logging.info(f"File {src!r} was copied")
+            return entry.st_size if entry is not None else os.lstat(dst).st_size
         else:
             logging.debug(f"Copying entire folder {src!r} to {dst!r}")
-            shutil.copytree(src, dst)
+            written = 0
+
+            def copy_file(file_src: str, file_dst: str) -> None:
+                nonlocal written
+                if link is not None and link(file_src, file_dst, os.path.join(dst, os.path.relpath(file_dst, tmp))):
+                    return
+                if self.throttle is not None:
+                    self.throttle.operation()
+                fastcopy.copy2(file_src, file_dst, throttle=self.throttle)
+                written += os.lstat(file_dst).st_size
+            tmp = self.temp_path(dst)
+            try:
+                shutil.copytree(src, tmp, copy_function=copy_file, ignore=self._ignore(src, dst))
+                os.replace(tmp, dst)
+            except:
+                if os.path.lexists(tmp):
+                    shutil.rmtree(tmp)
+                raise
             logging.info(f"Folder {src!r} was copied")
+            return written
@@ -0,0 +1,150 @@
+import os
+import json
+import shutil
+import logging
+import threading
+
+from compressed import sidecar_path
+
+
+class Journal:
+    """Write-ahead log of a synchronization cycle (JSON lines). Planned copies and finished folders are recorded
+    so that a cycle interrupted by a crash is resumed and its leftover temporary files are removed"""
+    path: str
+
+    def __init__(self, path: str) -> None:
+        """
+        Opens existing journal or creates a new one
+
+        :param path: path to a journal file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # folders finished by an interrupted cycle
+        self._finished: set[str] = set()
+        # temporary copies which were planned and not put in place
+        self._temps: set[str] = set()
+        self._interrupted = False
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self) -> None:
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be written partially
+                    logging.warning(f"Skipping broken record of journal {self.path!r}")
+                    continue
+                op = record['op']
+                if op == 'begin':
+                    self._interrupted = True
+                    self._finished.clear()
+                    self._temps.clear()
+                elif op == 'folder':
+                    self._finished.add(record['path'])
+                elif op == 'copy':
+                    self._temps.add(record['tmp'])
+                elif op == 'copied':
+                    self._temps.discard(record['tmp'])
+                elif op == 'end':
+                    self._interrupted = False
+                    self._finished.clear()
+        if self._interrupted:
+            logging.info(f"Journal {self.path!r} has an interrupted cycle with {len(self._finished)} finished folder(s)")
+
+    def _write(self, op: str, **fields) -> None:
+        with self._lock:
+            self._file.write(json.dumps({'op': op, **fields}) + '\n')
+            self._file.flush()
+
+    def cleanup(self) -> None:
+        """
+        Removes temporary files and partially updated files left by interrupted copies along with sidecars
+        of compressed ones
+        """
+        for tmp in self._temps:
+            self._remove_temp(tmp)
+            self._remove_temp(sidecar_path(tmp))
+        self._temps.clear()
+
+    @staticmethod
+    def _remove_temp(tmp: str) -> None:
+        """
+        :param tmp: path to a temporary file or folder
+        """
+        try:
+            if os.path.isdir(tmp) and not os.path.islink(tmp):
+                shutil.rmtree(tmp)
+            elif os.path.lexists(tmp):
+                os.remove(tmp)
+            else:
+                return
+            logging.info(f"Leftover {tmp!r} of an interrupted copy removed")
+        except OSError:
+            logging.exception(f"Could not remove temporary file {tmp!r}")
+
+    def begin(self) -> bool:
+        """
+        Starts a new cycle or resumes the interrupted one
+
+        :returns: True if the interrupted cycle is resumed
+        """
+        self.cleanup()
+        if self._interrupted:
+            self._write('resume')
+            return True
+        with self._lock:
+            self._file.truncate(0)
+        self._write('begin')
+        self._interrupted = True
+        return False
+
+    def planned(self, tmp: str) -> None:
+        """
+        Records a copy before it starts
+
+        :param tmp: path to a temporary copy (or to a file updated in place which is removed if the copy is
+            interrupted)
+        """
+        self._write('copy', tmp=tmp)
+
+    def copied(self, tmp: str) -> None:
+        """
+        Records a copy which was put in place
+
+        :param tmp: path to a temporary copy
+        """
+        self._write('copied', tmp=tmp)
+
+    def finish_folder(self, path: str) -> None:
+        """
+        Records a checkpoint of a folder whose files were all synchronized
+
+        :param path: path to a source folder
+        """
+        self._write('folder', path=path)
+
+    def is_finished(self, path: str) -> bool:
+        """
+        :param path: path to a source folder
+        :returns: True if files of the folder were synchronized by the interrupted cycle
+        """
+        return path in self._finished
+
+    def end(self) -> None:
+        """
+        Records the end of a cycle (the next one starts from scratch)
+        """
+        self._write('end')
+        self._interrupted = False
+        self._finished.clear()
+
+    def close(self) -> None:
+        """
+        Closes journal file
+        """
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,177 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import NamedTuple
+
+
+class FileState(NamedTuple):
+    """Snapshot of a file as it was seen during the last synchronization"""
+    size: int
+    mtime_ns: int
+    inode: int
+    digest: str | None
+
+    @classmethod
+    def from_stat(cls, st: os.stat_result, digest: str | None = None) -> "FileState":
+        """
+        Builds file state from os.stat result
+
+        :param st: result of os.stat call
+        :param digest: content hash of a file (None if unknown)
+        """
+        return cls(st.st_size, st.st_mtime_ns, st.st_ino, digest)
+
+    def matches(self, st: os.stat_result) -> bool:
+        """
+        Checks whether the file was not changed since the state was recorded
+
+        :param st: current result of os.stat call
+        :returns: True if size, modification time and inode are the same
+        """
+        return self.size == st.st_size and self.mtime_ns == st.st_mtime_ns and self.inode == st.st_ino
+
+
+class FolderState(NamedTuple):
+    """Fingerprint of a source folder as it was seen during the last synchronization"""
+    mtime_ns: int
+    inode: int
+    # name, True for folders, size and modification time of every entry
+    children: tuple[tuple[str, bool, int, int], ...]
+
+    def matches(self, st: os.stat_result) -> bool:
+        """
+        Checks whether entries were not added, removed or renamed since the state was recorded
+
+        :param st: current result of os.stat call for the folder
+        :returns: True if modification time and inode are the same
+        """
+        return self.mtime_ns == st.st_mtime_ns and self.inode == st.st_ino
+
+
+class Manifest:
+    """Persistent index of file states (SQLite) which survives restarts"""
+    path: str
+
+    def __init__(self, path: str) -> None:
+        """
+        Opens existing manifest or creates a new one
+
+        :param path: path to a manifest file
+        """
+        logging.debug(f"Opening manifest {path!r}")
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS files ("
+                         "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, digest TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_inode ON files (inode)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS folders ("
+                         "path TEXT PRIMARY KEY, mtime_ns INTEGER, inode INTEGER, children TEXT)")
+        self._db.commit()
+
+    def get(self, file_path: str) -> FileState | None:
+        """
+        :param file_path: path to a file
+        :returns: recorded state of a file or None if it was not recorded
+        """
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, inode, digest FROM files WHERE path = ?",
+                                   (file_path,)).fetchone()
+        return FileState(*row) if row is not None else None
+
+    def put(self, file_path: str, state: FileState) -> None:
+        """
+        Records state of a file
+
+        :param file_path: path to a file
+        :param state: current state of a file
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", (file_path, *state))
+
+    def get_folder(self, folder_path: str) -> FolderState | None:
+        """
+        :param folder_path: path to a folder
+        :returns: recorded fingerprint of a folder or None if it was not recorded
+        """
+        with self._lock:
+            row = self._db.execute("SELECT mtime_ns, inode, children FROM folders WHERE path = ?",
+                                   (folder_path,)).fetchone()
+        if row is None:
+            return None
+        return FolderState(row[0], row[1], tuple(tuple(child) for child in json.loads(row[2])))
+
+    def put_folder(self, folder_path: str, state: FolderState) -> None:
+        """
+        Records fingerprint of a folder
+
+        :param folder_path: path to a folder
+        :param state: current fingerprint of a folder
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)",
+                             (folder_path, state.mtime_ns, state.inode, json.dumps(state.children)))
+
+    def find_inode(self, inode: int) -> list[str]:
+        """
+        :param inode: inode number of a file
+        :returns: paths of recorded files with the inode
+        """
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT path FROM files WHERE inode = ?", (inode,))]
+
+    @staticmethod
+    def _subtree(path: str) -> tuple[str, str]:
+        """
+        :param path: path to a file or a folder
+        :returns: bounds of paths inside the folder (prefix <= path < upper), so that lookups use the primary key
+        """
+        path = path.rstrip(os.sep)
+        return path + os.sep, path + chr(ord(os.sep) + 1)
+
+    def move(self, old_path: str, new_path: str) -> None:
+        """
+        Moves records of a renamed file or an entire renamed folder with its content
+
+        :param old_path: previous path to a file or a folder
+        :param new_path: current path to a file or a folder
+        """
+        old_path, new_path = old_path.rstrip(os.sep), new_path.rstrip(os.sep)
+        with self._lock:
+            for table in ('files', 'folders'):
+                # records of a replaced file are outdated
+                self._db.execute(f"DELETE FROM {table} WHERE path = ?", (new_path,))
+                self._db.execute(f"DELETE FROM {table} WHERE path >= ? AND path < ?", self._subtree(new_path))
+                self._db.execute(f"UPDATE {table} SET path = ? WHERE path = ?", (new_path, old_path))
+                self._db.execute(f"UPDATE {table} SET path = ? || substr(path, ?) "
+                                 f"WHERE path >= ? AND path < ?",
+                                 (new_path, len(old_path) + 1, *self._subtree(old_path)))
+
+    def discard(self, file_path: str) -> None:
+        """
+        Forgets a file or an entire folder with its content
+
+        :param file_path: path to a file or a folder
+        """
+        file_path = file_path.rstrip(os.sep)
+        with self._lock:
+            for table in ('files', 'folders'):
+                self._db.execute(f"DELETE FROM {table} WHERE path = ?", (file_path,))
+                self._db.execute(f"DELETE FROM {table} WHERE path >= ? AND path < ?", self._subtree(file_path))
+
+    def commit(self) -> None:
+        """
+        Flushes recorded states to the disk
+        """
+        with self._lock:
+            self._db.commit()
+
+    def close(self) -> None:
+        """
+        Flushes recorded states and closes the manifest
+        """
+        with self._lock:
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,103 @@
+from typing import NamedTuple, Iterable, Iterator
+from collections import Counter
+
+from folder import Entry
+from manifest import FolderState
+
+
+KINDS = ('mkdir', 'move', 'create', 'update', 'delete')
+# files smaller than this are copied in batches
+SMALL_FILE = 1 << 20
+BATCH_FILES = 64
+BATCH_BYTES = 1 << 24
+
+
+class Operation(NamedTuple):
+    """Single planned change of replica"""
+    kind: str
+    source: str | None
+    target: str
+    entry: Entry | None = None
+    origin: str | None = None
+
+    @property
+    def size(self) -> int:
+        """
+        :returns: number of bytes to transfer (0 for operations which do not copy data)
+        """
+        if self.kind in ('create', 'update') and not self.entry.is_dir:
+            return self.entry.st_size
+        return 0
+
+    def describe(self) -> str:
+        """
+        :returns: human readable description of the operation
+        """
+        if self.kind == 'move':
+            return f"{self.kind:<6} {self.origin} -> {self.target}"
+        if self.size > 0:
+            return f"{self.kind:<6} {self.target} ({self.size} bytes)"
+        return f"{self.kind:<6} {self.target}"
+
+
+class Plan:
+    """Operations synchronizing replica with source found by Synchronizer.plan"""
+
+    def __init__(self) -> None:
+        self.operations: list[Operation] = list()
+        # fingerprints of planned source folders recorded when all their operations succeed
+        self.fingerprints: dict[str, FolderState] = dict()
+
+    def add(self, operation: Operation) -> None:
+        """
+        :param operation: planned operation
+        """
+        self.operations.append(operation)
+
+    def of_kind(self, kind: str) -> list[Operation]:
+        """
+        :param kind: kind of operations (one of KINDS)
+        :returns: planned operations of the kind
+        """
+        return [operation for operation in self.operations if operation.kind == kind]
+
+    @property
+    def bytes_to_transfer(self) -> int:
+        """
+        :returns: estimated number of copied bytes (modified files are counted entirely)
+        """
+        return sum(operation.size for operation in self.operations)
+
+    def counts(self) -> dict[str, int]:
+        """
+        :returns: number of operations of every kind
+        """
+        counts = Counter(operation.kind for operation in self.operations)
+        return {kind: counts[kind] for kind in KINDS}
+
+    def __iter__(self) -> Iterator[Operation]:
+        return iter(self.operations)
+
+    def __len__(self) -> int:
+        return len(self.operations)
+
+
+def batches(operations: Iterable[Operation]) -> Iterator[list[Operation]]:
+    """
+    Groups consecutive copies of small files into batches keeping their order. Big files are copied alone
+
+    :param operations: copy operations
+    :returns: batches of operations
+    """
+    batch, batch_bytes = list(), 0
+    for operation in operations:
+        if operation.size >= SMALL_FILE:
+            yield [operation]
+            continue
+        batch.append(operation)
+        batch_bytes += operation.size
+        if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+            yield batch
+            batch, batch_bytes = list(), 0
+    if batch:
+        yield batch
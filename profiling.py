@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import heapq
+import logging
+import functools
+import threading
+from typing import Callable
+
+
+# upper bounds of latency buckets are powers of two microseconds
+BUCKETS = 32
+
+# profiler collecting timings of decorated operations (nothing is measured if None)
+_active: "Profiler | None" = None
+
+
+class Histogram:
+    """Latencies of calls of one operation in buckets growing by powers of two"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds: float) -> None:
+        """
+        :param seconds: duration of a call
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: quantile in [0, 1]
+        :returns: upper bound of latency of q share of calls in seconds
+        """
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << index) / 1e6, self.max)
+        return self.max
+
+    def describe(self) -> str:
+        """
+        :returns: summary of the histogram
+        """
+        mean = self.total / self.count if self.count else 0.0
+        return (f"{self.count} call(s), total {self.total:.3f} s, mean {mean * 1e3:.3f} ms, "
+                f"p50 <= {self.percentile(0.5) * 1e3:.3f} ms, p99 <= {self.percentile(0.99) * 1e3:.3f} ms, "
+                f"max {self.max * 1e3:.3f} ms")
+
+
+class Profiler:
+    """Collects latencies of Folder operations and listings while it is active (used as a context manager).
+    Calls are put to per operation histograms, the slowest paths are kept and, if tracing is on,
+    every call is recorded as a Chrome trace event"""
+    top: int
+    trace: bool
+    max_events: int
+
+    def __init__(self, top: int = 20, trace: bool = False, max_events: int = 1 << 20) -> None:
+        """
+        :param top: number of kept slowest calls
+        :param trace: True if calls are recorded as trace events
+        :param max_events: maximal number of recorded trace events (the rest are dropped)
+        """
+        self.top = top
+        self.trace = trace
+        self.max_events = max_events
+        self.histograms: dict[str, Histogram] = dict()
+        self.events: list[dict] = list()
+        self._slowest: list[tuple[float, int, str, str]] = list()
+        self._calls = 0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._previous = None
+
+    def __enter__(self) -> "Profiler":
+        global _active
+        self._previous, _active = _active, self
+        return self
+
+    def __exit__(self, *exc) -> None:
+        global _active
+        _active, self._previous = self._previous, None
+
+    def record(self, operation: str, path: str, start: float, seconds: float) -> None:
+        """
+        :param operation: name of an operation
+        :param path: path the operation was called for
+        :param start: start of the call by perf_counter
+        :param seconds: duration of the call
+        """
+        with self._lock:
+            histogram = self.histograms.get(operation)
+            if histogram is None:
+                histogram = self.histograms[operation] = Histogram()
+            histogram.add(seconds)
+            self._calls += 1
+            item = (seconds, self._calls, operation, path)
+            if len(self._slowest) < self.top:
+                heapq.heappush(self._slowest, item)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+            if self.trace and len(self.events) < self.max_events:
+                self.events.append({'name': operation, 'cat': 'sync', 'ph': 'X',
+                                    'ts': (start - self._start) * 1e6, 'dur': seconds * 1e6, 'pid': os.getpid(),
+                                    'tid': threading.get_ident(), 'args': {'path': path}})
+
+    def slowest(self) -> list[tuple[float, str, str]]:
+        """
+        :returns: durations, operations and paths of the slowest calls starting from the slowest one
+        """
+        with self._lock:
+            return [(seconds, operation, path) for seconds, _, operation, path in sorted(self._slowest, reverse=True)]
+
+    def report(self) -> str:
+        """
+        :returns: histograms of all operations followed by the slowest calls
+        """
+        lines = [f"{operation}: {histogram.describe()}" for operation, histogram in sorted(self.histograms.items())]
+        if self._slowest:
+            lines.append("Slowest calls:")
+            lines.extend(f"{seconds * 1e3:10.3f} ms {operation:<8} {path}" for seconds, operation, path in self.slowest())
+        return '\n'.join(lines)
+
+    def dump_trace(self, path: str) -> None:
+        """
+        Writes recorded calls in Chrome trace event format (viewed in chrome://tracing or Perfetto)
+
+        :param path: path to a JSON file
+        """
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+        logging.info(f"{len(events)} trace event(s) written to {path!r}")
+
+
+def timed(operation: str, path_index: int = 0) -> Callable:
+    """
+    Decorates a function measuring its calls while a profiler is active
+
+    :param operation: name of the operation in profiler's histograms
+    :param path_index: index of the positional argument with the path the function is called for
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                path = args[path_index] if len(args) > path_index else ''
+                profiler.record(operation, str(path), start, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,89 @@
+import os
+import logging
+from collections import Counter
+
+from stats import SyncStats
+
+
+class AdaptiveScheduler:
+    """Chooses delays between cycles from changes found by recent cycles and their duration.
+    Subtrees changing often are rescanned between full cycles"""
+    interval: float
+    min_interval: float
+    max_interval: float
+
+    def __init__(self, interval: float, min_interval: float | None = None, max_interval: float | None = None,
+                 backoff: float = 2.0, max_duty: float = 0.5, depth: int = 2, decay: float = 0.5,
+                 hot_score: float = 1.0, max_hot: int = 16) -> None:
+        """
+        :param interval: initial delay between full cycles in seconds
+        :param min_interval: minimal delay between full cycles and delay between rescans of hot subtrees
+            (a tenth of interval if None)
+        :param max_interval: maximal delay between full cycles of an idle tree (8 intervals if None)
+        :param backoff: factor the delay is multiplied by after an idle cycle and divided by after a busy one
+        :param max_duty: maximal share of time spent synchronizing (a long cycle is followed by a long delay)
+        :param depth: number of path components identifying a subtree
+        :param decay: factor applied to change scores of subtrees after every full cycle
+        :param hot_score: minimal change score of a hot subtree
+        :param max_hot: maximal number of subtrees rescanned between full cycles
+        """
+        if not 0 < max_duty <= 1:
+            raise ValueError("Duty should be in (0, 1]")
+        self.min_interval = min_interval if min_interval is not None else interval / 10
+        self.max_interval = max_interval if max_interval is not None else interval * 8
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.backoff = backoff
+        self.max_duty = max_duty
+        self.depth = depth
+        self.decay = decay
+        self.hot_score = hot_score
+        self.max_hot = max_hot
+        self.scores: Counter = Counter()
+
+    def _subtree(self, folder: str) -> str:
+        """
+        :param folder: path to a folder relative to source folder
+        :returns: subtree containing the folder
+        """
+        parts = [part for part in os.path.normpath(folder).split(os.sep) if part not in ('', '.')]
+        return os.path.join(*parts[:self.depth]) if parts else '.'
+
+    def _count(self, stats: SyncStats) -> int:
+        for folder, changes in stats.changed_folders.items():
+            self.scores[self._subtree(folder)] += changes
+        return stats.files_copied + stats.removals + stats.renames
+
+    def record_cycle(self, stats: SyncStats) -> float:
+        """
+        Adapts delay to a finished full cycle
+
+        :param stats: stats of the cycle
+        :returns: delay before the next full cycle in seconds
+        """
+        for subtree in list(self.scores):
+            self.scores[subtree] *= self.decay
+            if self.scores[subtree] < self.hot_score * self.decay ** 4:
+                del self.scores[subtree]
+        if self._count(stats) > 0:
+            self.interval = max(self.min_interval, self.interval / self.backoff)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        # cycles longer than interval are not run back to back
+        delay = max(self.interval, stats.wall_time * (1 - self.max_duty) / self.max_duty)
+        logging.debug(f"Next full synchronization in {delay:.1f} s")
+        return delay
+
+    def record_rescan(self, stats: SyncStats) -> None:
+        """
+        Counts changes found by a rescan of hot subtrees
+
+        :param stats: stats of the rescan
+        """
+        self._count(stats)
+
+    def hot_subtrees(self) -> list[str]:
+        """
+        :returns: subtrees changing often (relative to source folder) starting from the hottest one
+        """
+        return [subtree for subtree, score in self.scores.most_common()
+                if score >= self.hot_score and subtree != '.'][:self.max_hot]
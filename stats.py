@@ -0,0 +1,195 @@
+import time
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class SyncStats:
+    """Counters and timings of one synchronization cycle"""
+    COUNTERS = ('dirs_scanned', 'dirs_skipped', 'files_compared', 'bytes_compared', 'files_copied', 'bytes_copied',
+                'removals', 'renames', 'rename_bytes_saved', 'dedup_links', 'dedup_bytes_saved', 'errors')
+    PHASES = ('scan', 'compare', 'copy', 'remove')
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.wall_time = 0.0
+        # time spent in a phase by all threads together
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+        self.copy_strategies: dict[str, int] = dict()
+        # number of changed files by their folders relative to replica folder
+        self.changed_folders: Counter = Counter()
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, counter: str, value: int = 1) -> None:
+        """
+        Increases counter
+
+        :param counter: name of a counter (one of COUNTERS)
+        :param value: increment
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def change(self, folder: str) -> None:
+        """
+        Counts changed file
+
+        :param folder: folder of the file relative to replica folder
+        """
+        with self._lock:
+            self.changed_folders[folder] += 1
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measures time spent in a phase
+
+        :param name: name of a phase (one of PHASES)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] += elapsed
+
+    def finish(self, errors: int) -> None:
+        """
+        Stops measuring the cycle
+
+        :param errors: number of failed files
+        """
+        self.errors = errors
+        self.wall_time = time.perf_counter() - self._start
+
+    def merge(self, other: "SyncStats") -> None:
+        """
+        Adds counters and timings of another cycle (e.g. of a shard synchronized by another process)
+
+        :param other: stats of the cycle
+        """
+        with self._lock:
+            for counter in self.COUNTERS:
+                setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+            for name, elapsed in other.phases.items():
+                self.phases[name] += elapsed
+            for strategy, count in other.copy_strategies.items():
+                self.copy_strategies[strategy] = self.copy_strategies.get(strategy, 0) + count
+            self.changed_folders.update(other.changed_folders)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def as_dict(self) -> dict:
+        """
+        :returns: all counters and timings
+        """
+        return {'started': self.started, 'wall_time': self.wall_time,
+                **{counter: getattr(self, counter) for counter in self.COUNTERS},
+                'phases': dict(self.phases), 'copy_strategies': dict(self.copy_strategies)}
+
+
+class StatsFile:
+    """Appends stats of every cycle to a JSON lines file"""
+    path: str
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: path to a stats file (creates if not exists)
+        """
+        self.path = path
+
+    def publish(self, stats: SyncStats) -> None:
+        """
+        :param stats: stats of finished cycle
+        """
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(stats.as_dict()) + '\n')
+
+
+class MetricsServer:
+    """Serves totals of all cycles and stats of the last one in Prometheus text format on /metrics"""
+    PREFIX = 'folder_sync'
+
+    def __init__(self, port: int, host: str = '127.0.0.1') -> None:
+        """
+        Starts HTTP server in a background thread
+
+        :param port: port to listen on
+        :param host: address to listen on (local only by default)
+        """
+        self.cycles = 0
+        self.totals = dict.fromkeys(SyncStats.COUNTERS, 0)
+        self.last: SyncStats | None = None
+        self._lock = threading.Lock()
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                logging.debug(f"Metrics request: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        logging.info(f"Serving metrics on http://{host}:{self.port}/metrics")
+
+    def publish(self, stats: SyncStats) -> None:
+        """
+        :param stats: stats of finished cycle
+        """
+        with self._lock:
+            self.cycles += 1
+            for counter in SyncStats.COUNTERS:
+                self.totals[counter] += getattr(stats, counter)
+            self.last = stats
+
+    def render(self) -> str:
+        """
+        :returns: metrics in Prometheus text format
+        """
+        with self._lock:
+            lines = [f"# TYPE {self.PREFIX}_cycles_total counter", f"{self.PREFIX}_cycles_total {self.cycles}"]
+            for counter, value in self.totals.items():
+                lines.append(f"# TYPE {self.PREFIX}_{counter}_total counter")
+                lines.append(f"{self.PREFIX}_{counter}_total {value}")
+            if self.last is not None:
+                lines.append(f"# TYPE {self.PREFIX}_last_cycle_seconds gauge")
+                lines.append(f"{self.PREFIX}_last_cycle_seconds {self.last.wall_time:.6f}")
+                lines.append(f"# TYPE {self.PREFIX}_last_cycle_timestamp_seconds gauge")
+                lines.append(f"{self.PREFIX}_last_cycle_timestamp_seconds {self.last.started:.3f}")
+                lines.append(f"# TYPE {self.PREFIX}_last_phase_seconds gauge")
+                for phase, seconds in self.last.phases.items():
+                    lines.append(f'{self.PREFIX}_last_phase_seconds{{phase="{phase}"}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self) -> None:
+        """
+        Stops HTTP server
+        """
+        self._server.shutdown()
+        self._server.server_close()
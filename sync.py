@@ -1,43 +1,333 @@
-from time import sleep
+from time import sleep, monotonic
+from typing import Sequence
 import argparse
+import asyncio
+import cProfile
 import logging
 
 from synchronizer import Synchronizer
+from async_synchronizer import AsyncSynchronizer
+from fanout import FanOutSynchronizer, BUFFER_CHUNKS
+from coordinator import Coordinator, ShardOptions
 from folder import Folder
+from filters import Filter, read_rules
+from compressed import CompressedFolder, CODECS, MIN_SIZE as COMPRESS_MIN_SIZE, SKIP_EXTENSIONS
+from manifest import Manifest
+from journal import Journal
+from dedup import DedupIndex, DEDUP_MODES, MIN_SIZE
+from plan import Plan
+from digest import Comparator, DigestComparator, DigestStore, SampledComparator, SamplePolicy, SAMPLE_THRESHOLD
+from watcher import Watcher, create_watcher
+from stats import SyncStats, StatsFile, MetricsServer
+from throttle import Throttle, Profile, parse_rate, set_idle_io_priority
+from scheduler import AdaptiveScheduler
+from profiling import Profiler
 
 
-def keep_folders_sync(synchronizer: Synchronizer, interval: int = 600) -> None:
+def report(remove_err: list, update_err: list) -> None:
+    """
+    Logs results of a synchronization
+
+    :param remove_err: failed to remove files
+    :param update_err: failed to copy files
+    """
+    rm_err_num = len(remove_err)
+    upd_err_num = len(update_err)
+    if rm_err_num + upd_err_num == 0:
+        logging.info("Folders successfully synchronized!")
+    else:
+        info = ""
+        if rm_err_num > 0:
+            info += f"\nNot removed from replica ({rm_err_num}): {remove_err}"
+        if upd_err_num > 0:
+            info += f"\nNot updated from source ({upd_err_num}): {update_err}"
+        logging.info(f"Folders synchronized partially! Failed files ({rm_err_num + upd_err_num}): {info}")
+
+
+def wait(result):
+    """
+    Runs a cycle of asynchronous synchronizer to the end
+
+    :param result: result of synchronizer's call (a coroutine for AsyncSynchronizer)
+    :returns: result of the cycle
+    """
+    return asyncio.run(result) if asyncio.iscoroutine(result) else result
+
+
+def print_plan(plan: Plan) -> None:
+    """
+    Prints planned operations and their summary
+
+    :param plan: plan of a cycle
+    """
+    for operation in plan:
+        print(operation.describe())
+    counts = ', '.join(f"{count} {kind}" for kind, count in plan.counts().items())
+    print(f"Planned {len(plan)} operation(s): {counts}; about {plan.bytes_to_transfer} bytes to transfer")
+
+
+def publish(stats: SyncStats, sinks: Sequence[StatsFile | MetricsServer]) -> None:
+    """
+    Passes stats of finished cycle to exporters
+
+    :param stats: stats of finished cycle
+    :param sinks: stats exporters
+    """
+    logging.debug(f"Cycle stats: {stats.as_dict()}")
+    for sink in sinks:
+        try:
+            sink.publish(stats)
+        except OSError:
+            logging.exception("Could not publish stats")
+
+
+def profile_cycle(synchronizer: Synchronizer, path: str, planned: bool = False) -> None:
+    """
+    Runs a single cycle measuring latencies of listings, comparisons, copies and removals. Calls are written
+    as Chrome trace events if path ends with '.json', otherwise cProfile stats of the main thread are written
+
+    :param synchronizer: Synchronizer object for folders' sync
+    :param path: path to a file with the profile
+    :param planned: True if the cycle is planned entirely before changing replica
+    """
+    profiler = Profiler(trace=path.endswith('.json'))
+    c_profile = None if profiler.trace else cProfile.Profile()
+    with profiler:
+        if c_profile is not None:
+            c_profile.enable()
+        try:
+            if planned:
+                report(*synchronizer.execute(synchronizer.plan()))
+            else:
+                report(*wait(synchronizer.sync_folders()))
+        finally:
+            if c_profile is not None:
+                c_profile.disable()
+    logging.info(f"Profile of the cycle:\n{profiler.report()}")
+    if c_profile is None:
+        profiler.dump_trace(path)
+    else:
+        c_profile.dump_stats(path)
+        logging.info(f"cProfile stats written to {path!r}")
+
+
+def keep_folders_sync(synchronizer: Synchronizer, interval: int = 600,
+                      sinks: Sequence[StatsFile | MetricsServer] = (), planned: bool = False,
+                      scheduler: AdaptiveScheduler | None = None) -> None:
     """
     Synchronizes folders every 'interval' seconds
 
     :param synchronizer: Synchronizer object for folders' sync
     :param interval: synchronization period of time in seconds (10 mins by default)
+    :param sinks: exporters of cycles' stats
+    :param planned: True if every cycle is planned entirely before changing replica
+    :param scheduler: scheduler adapting the period to changes (fixed period if None)
     """
-    logging.debug(f"Running folders' synchronization with {interval = }")
+    logging.debug(f"Running folders' synchronization with {interval = }; {planned = }")
     while True:
         logging.info("Starting synchronization")
-        remove_err, update_err = synchronizer.sync_folders()
-        rm_err_num = len(remove_err)
-        upd_err_num = len(update_err)
-        if rm_err_num + upd_err_num == 0:
-            logging.info("Folders successfully synchronized!")
+        if planned:
+            report(*synchronizer.execute(synchronizer.plan()))
+        else:
+            report(*wait(synchronizer.sync_folders()))
+        publish(synchronizer.stats, sinks)
+        if scheduler is None:
+            sleep(interval)
         else:
-            info = ""
-            if rm_err_num > 0:
-                info += f"\nNot removed from replica ({rm_err_num}): {remove_err}"
-            if upd_err_num > 0:
-                info += f"\nNot updated from source ({upd_err_num}): {update_err}"
-            logging.info(f"Folders synchronized partially! Failed files ({rm_err_num + upd_err_num}): {info}")
-        sleep(interval)
+            rescan_hot(synchronizer, scheduler, monotonic() + scheduler.record_cycle(synchronizer.stats), sinks)
+
+
+def rescan_hot(synchronizer: Synchronizer, scheduler: AdaptiveScheduler, deadline: float,
+               sinks: Sequence[StatsFile | MetricsServer] = ()) -> None:
+    """
+    Rescans often changing subtrees until the next full synchronization
+
+    :param synchronizer: Synchronizer object for folders' sync
+    :param scheduler: scheduler tracking changes of subtrees
+    :param deadline: time of the next full synchronization (by monotonic clock)
+    :param sinks: exporters of cycles' stats
+    """
+    while (hot := scheduler.hot_subtrees()) and monotonic() + scheduler.min_interval < deadline:
+        sleep(scheduler.min_interval)
+        logging.info(f"Rescanning {len(hot)} often changing subtree(s)")
+        report(*wait(synchronizer.sync_paths(hot)))
+        publish(synchronizer.stats, sinks)
+        scheduler.record_rescan(synchronizer.stats)
+    sleep(max(0.0, deadline - monotonic()))
+
+
+def keep_folders_watch(synchronizer: Synchronizer, watcher: Watcher, interval: int = 600,
+                       debounce: float = 1.0, sinks: Sequence[StatsFile | MetricsServer] = ()) -> None:
+    """
+    Synchronizes changed files as soon as watcher reports them. Entire folders are synchronized
+    every 'interval' seconds as a safety net
+
+    :param synchronizer: Synchronizer object for folders' sync
+    :param watcher: watcher of source folder
+    :param interval: period of full synchronization in seconds (10 mins by default)
+    :param debounce: quiet period in seconds after which collected changes are synchronized
+    :param sinks: exporters of cycles' stats
+    """
+    logging.debug(f"Watching source folder with {interval = }; {debounce = }")
+    next_full_sync = monotonic()
+    while True:
+        if monotonic() >= next_full_sync:
+            logging.info("Starting synchronization")
+            report(*wait(synchronizer.sync_folders()))
+            publish(synchronizer.stats, sinks)
+            next_full_sync = monotonic() + interval
+        changes = watcher.collect(max(0.0, next_full_sync - monotonic()), debounce)
+        if changes is None:
+            # some events were lost
+            next_full_sync = monotonic()
+        elif changes:
+            logging.info(f"Synchronizing {len(changes)} changed path(s)")
+            report(*wait(synchronizer.sync_paths(changes)))
+            publish(synchronizer.stats, sinks)
 
 
 def configure_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Synchronizing 2 folders (source and replica)')
     parser.add_argument('-s', '--source', type=str, help='path to a source folder (must exist)', required=True)
-    parser.add_argument('-r', '--replica', type=str, help='path to a replica folder (must exist)', required=True)
+    parser.add_argument('-r', '--replica', type=str, action='append', required=True,
+                        help='path to a replica folder (must exist), may be repeated to keep several replicas')
+    parser.add_argument('--buffer-chunks', type=int, default=BUFFER_CHUNKS,
+                        help='number of 1 MiB chunks buffered for every replica (with several replicas)')
     parser.add_argument('-i', '--interval', type=float, help='synchronization period of time in seconds', default=600)
+    parser.add_argument('-m', '--manifest', type=str, help='path to a file state index (skips unchanged files)',
+                        default=None)
+    parser.add_argument('--skip-unchanged', choices=('stat', 'trust-mtime'), default=None,
+                        help='do not list folders unchanged since the last cycle (with --manifest): '
+                             'stat checks their files, trust-mtime does not')
+    parser.add_argument('-w', '--workers', type=int, help='number of threads comparing and copying files', default=1)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of processes synchronizing top level subtrees balanced by the previous cycle '
+                             '(digests of --compare digest are kept in memory of the processes only)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='overlap listings and copies of many folders (for network filesystems)')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='maximal number of concurrent filesystem calls (with --async)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adapt the period to found changes and rescan often changing subtrees more often')
+    parser.add_argument('--min-interval', type=float, default=None,
+                        help='minimal period and period of rescans of hot subtrees in seconds (with --adaptive)')
+    parser.add_argument('--max-interval', type=float, default=None,
+                        help='maximal period of an idle tree in seconds (with --adaptive)')
+    parser.add_argument('--watch', action='store_true',
+                        help='synchronize changes as they happen (interval sets the period of full resync)')
+    parser.add_argument('--debounce', type=float, help='quiet period in seconds before changes are synchronized',
+                        default=1.0)
+    parser.add_argument('--delta-threshold', type=int, default=None,
+                        help='minimal size in bytes of a modified file which is updated by changed blocks only')
+    parser.add_argument('--small-file-size', type=int, default=None,
+                        help='new files smaller than this number of bytes are copied in batches with one log record')
+    parser.add_argument('--dedup-index', type=str, default=None,
+                        help='path to an index of replica contents: new files whose content is present in replica '
+                             'are linked instead of copied (without --async)')
+    parser.add_argument('--dedup', choices=DEDUP_MODES, default='hardlink',
+                        help='how duplicates are linked (with --dedup-index): hardlinks share metadata as well, '
+                             'reflinks need btrfs or XFS')
+    parser.add_argument('--dedup-min-size', type=int, default=MIN_SIZE,
+                        help='minimal size in bytes of deduplicated files (with --dedup-index)')
+    parser.add_argument('--compress', choices=CODECS, default=None,
+                        help='keep replica files compressed with sidecars of their digests (zstd needs zstandard)')
+    parser.add_argument('--compress-level', type=int, default=None, help='compression level (with --compress)')
+    parser.add_argument('--compress-min-size', type=int, default=COMPRESS_MIN_SIZE,
+                        help='minimal size in bytes of compressed files (with --compress)')
+    parser.add_argument('--compress-skip', type=lambda value: tuple(filter(None, value.split(','))),
+                        default=SKIP_EXTENSIONS,
+                        help='comma separated extensions of already compressed files stored as is (with --compress)')
+    parser.add_argument('--compress-workers', type=int, default=None,
+                        help='number of threads compressing blocks of files (number of CPUs by default)')
+    parser.add_argument('--exclude', dest='filter_rules', type=lambda rule: [rule], action='append', default=[],
+                        help='gitignore-style pattern of paths which are not synchronized (may be repeated)')
+    parser.add_argument('--include', dest='filter_rules', type=lambda rule: ['!' + rule], action='append',
+                        help='gitignore-style pattern of paths synchronized despite earlier exclusions')
+    parser.add_argument('--filter-file', dest='filter_rules', type=read_rules, action='append',
+                        help='path to a file with rules in gitignore format (rules given later win)')
+    parser.add_argument('--block-size', type=int, help='size of compared blocks in bytes', default=1 << 17)
+    parser.add_argument('--compare', choices=('bytes', 'digest', 'sampled'), default='bytes',
+                        help='comparison of files: byte by byte, by cached digests or by sampled blocks of huge files')
+    parser.add_argument('--sample-threshold', type=int, default=SAMPLE_THRESHOLD,
+                        help='minimal size in bytes of files compared by samples (with --compare sampled)')
+    parser.add_argument('--samples', type=int, default=8,
+                        help='number of blocks sampled at random offsets besides the head and the tail')
+    parser.add_argument('--full-every', type=int, default=10,
+                        help='number of cycles after which a sampled file is compared entirely (0 for never)')
+    parser.add_argument('--sample-policy', type=SamplePolicy.parse, action='append', default=[],
+                        help="samples and period of full comparisons of matching paths as 'PATTERN=SAMPLES[/EVERY]' "
+                             "(may be repeated, the first match is used)")
+    parser.add_argument('--digest-cache', type=str, default=None,
+                        help='path to a file keeping digests between runs (with --compare digest)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='port of local HTTP server exposing /metrics in Prometheus format')
+    parser.add_argument('--stats-file', type=str, default=None, help='path to a JSON lines file with stats of cycles')
+    parser.add_argument('--error-limit', type=int, default=1000,
+                        help='maximal number of failed paths of each kind kept in memory and logged')
+    parser.add_argument('--error-file', type=str, default=None,
+                        help='path to a file listing failed paths over the limit of the last cycle')
+    parser.add_argument('--journal', type=str, default=None,
+                        help='path to a journal letting an interrupted synchronization be resumed (without --async)')
+    parser.add_argument('--plan', action='store_true',
+                        help='plan every cycle before changing replica (copies are ordered and batched)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print planned operations and bytes to transfer without changing replica')
+    parser.add_argument('--bwlimit', type=parse_rate, default=None,
+                        help='limit of read and written bytes per second (e.g. 512K or 20M)')
+    parser.add_argument('--ops-limit', type=parse_rate, default=None,
+                        help='limit of copied, compared and removed files per second')
+    parser.add_argument('--throttle-profile', type=Profile.parse, action='append', default=[],
+                        help="limits during a period of a day as 'HH:MM-HH:MM=BYTES[/OPS]' (may be repeated)")
+    parser.add_argument('--profile', type=str, default=None,
+                        help='run a single cycle and write its profile: Chrome trace events if the path ends '
+                             'with .json, cProfile stats of the main thread otherwise')
+    parser.add_argument('--idle-io', action='store_true', help='run with idle I/O priority (Linux only)')
     parser.add_argument('-l', '--log_file', type=str, help='path to a log file (creates if not exists)', default='sync.log')
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.processes is not None:
+        unsupported = [flag for flag, value in (('--manifest', args.manifest), ('--journal', args.journal),
+                                                ('--async', args.use_async), ('--plan', args.plan),
+                                                ('--dry-run', args.dry_run), ('--dedup-index', args.dedup_index),
+                                                ('--digest-cache', args.digest_cache), ('--profile', args.profile),
+                                                ('--compress', args.compress),
+                                                ('--compare sampled', args.compare == 'sampled'),
+                                                ('several replicas', len(args.replica) > 1))
+                       if value]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} can't be used with --processes")
+    if len(args.replica) > 1:
+        # replicas are written from chunks of source files read once, so copies are neither parallel nor by blocks
+        unsupported = [flag for flag, value in (('--manifest', args.manifest), ('--journal', args.journal),
+                                                ('--async', args.use_async), ('--plan', args.plan),
+                                                ('--dry-run', args.dry_run), ('--dedup-index', args.dedup_index),
+                                                ('--compress', args.compress), ('--workers', args.workers != 1),
+                                                ('--small-file-size', args.small_file_size is not None),
+                                                ('--skip-unchanged', args.skip_unchanged),
+                                                ('--delta-threshold', args.delta_threshold is not None),
+                                                ('--block-size', args.block_size != parser.get_default('block_size')))
+                       if value]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} can't be used with several replicas")
+    if args.use_async:
+        # concurrency of asynchronous synchronizer is set by --concurrency, planned cycles are executed synchronously
+        unsupported = [flag for flag, value in (('--journal', args.journal), ('--dedup-index', args.dedup_index),
+                                                ('--skip-unchanged', args.skip_unchanged),
+                                                ('--small-file-size', args.small_file_size is not None),
+                                                ('--workers', args.workers != 1), ('--plan', args.plan))
+                       if value]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} can't be used with --async")
+    if args.adaptive and args.watch:
+        # watcher reports changes as they happen, full cycles of watch mode keep the fixed period
+        parser.error("--adaptive can't be used with --watch")
+    if args.skip_unchanged is not None and args.manifest is None:
+        parser.error("--skip-unchanged needs --manifest")
+    if args.profile is not None and not args.profile.endswith('.json') and args.workers > 1:
+        # cProfile sees the main thread only, copies of worker threads would be missing from the stats
+        parser.error("--profile with cProfile output can't be used with --workers, write a .json trace instead")
+    if args.compress is not None and args.dedup_index is not None:
+        parser.error("--dedup-index can't be used with --compress")
+    return args
 
 
 def configure_logger() -> None:
@@ -54,17 +344,85 @@ if __name__ == '__main__':
     args = configure_args()
     configure_logger()
 
+    if args.idle_io:
+        set_idle_io_priority()
+    throttle = None
+    if args.bwlimit is not None or args.ops_limit is not None or args.throttle_profile:
+        throttle = Throttle(args.bwlimit, args.ops_limit, args.throttle_profile)
+
+    filter_rules = [rule for rules in args.filter_rules for rule in rules]
+    filters = Filter(filter_rules)
     try:
-        source = Folder(args.source)
+        source = Folder(args.source, filters=filters)
     except ValueError as e:
         raise ValueError(f"{e} ({args.source!r})")
-    try:
-        replica = Folder(args.replica)
-    except ValueError as e:
-        raise ValueError(f"{e} ({args.replica!r})")
+    replicas = list()
+    for path in args.replica:
+        try:
+            if args.compress is not None:
+                replicas.append(CompressedFolder(path, args.compress, args.compress_level, args.compress_min_size,
+                                                 args.compress_skip, args.compress_workers, throttle,
+                                                 filters=filters))
+            else:
+                replicas.append(Folder(path, args.delta_threshold, args.block_size, throttle, filters))
+        except ValueError as e:
+            raise ValueError(f"{e} ({path!r})")
 
-    sync = Synchronizer(source, replica)
+    manifest = Manifest(args.manifest) if args.manifest is not None else None
+    journal = Journal(args.journal) if args.journal is not None else None
+    dedup = DedupIndex(args.dedup_index, args.dedup, args.dedup_min_size) if args.dedup_index is not None else None
+    if args.compare == 'digest':
+        comparator = DigestComparator(DigestStore(args.digest_cache), throttle)
+    elif args.compare == 'sampled':
+        comparator = SampledComparator(args.sample_threshold, args.samples, args.full_every or None,
+                                       args.sample_policy, throttle=throttle)
+    else:
+        comparator = Comparator(throttle)
+    if args.processes is not None:
+        options = ShardOptions(args.workers, args.delta_threshold, args.block_size, args.compare, args.error_limit,
+                               args.error_file, args.small_file_size, args.bwlimit, args.ops_limit,
+                               tuple(args.throttle_profile), tuple(filter_rules))
+        sync = Coordinator(source, replicas[0], args.processes, options)
+    elif len(replicas) > 1:
+        sync = FanOutSynchronizer(source, replicas, comparator, args.error_limit, args.error_file, args.buffer_chunks)
+    elif args.use_async:
+        sync = AsyncSynchronizer(source, replicas[0], manifest, comparator, args.concurrency, args.error_limit,
+                                 args.error_file)
+    else:
+        sync = Synchronizer(source, replicas[0], manifest, args.workers, comparator, args.error_limit, args.error_file,
+                            journal, args.skip_unchanged, args.small_file_size, dedup)
+    sinks = list()
+    if args.stats_file is not None:
+        sinks.append(StatsFile(args.stats_file))
+    if args.metrics_port is not None:
+        sinks.append(MetricsServer(args.metrics_port))
+    watcher = None
     try:
-        keep_folders_sync(sync, args.interval)
+        if args.dry_run:
+            print_plan(sync.plan())
+        elif args.profile is not None:
+            profile_cycle(sync, args.profile, args.plan)
+        elif args.watch:
+            watcher = create_watcher(source.path)
+            keep_folders_watch(sync, watcher, args.interval, args.debounce, sinks)
+        else:
+            scheduler = None
+            if args.adaptive:
+                scheduler = AdaptiveScheduler(args.interval, args.min_interval, args.max_interval)
+            keep_folders_sync(sync, args.interval, sinks, args.plan, scheduler)
     except:
         logging.exception("Unknown error occurs", exc_info=True)
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if manifest is not None:
+            manifest.close()
+        if dedup is not None:
+            dedup.close()
+        if isinstance(sync, Coordinator):
+            sync.close()
+        for replica in replicas:
+            if isinstance(replica, CompressedFolder):
+                replica.close()
+        if journal is not None:
+            journal.close()
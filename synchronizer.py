@@ -1,98 +1,842 @@
 import os
+import time
+import stat
+import shutil
 import logging
+import threading
+from typing import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 
-from folder import Folder
+from folder import Folder, Entry, merge_entries
+from manifest import Manifest, FileState, FolderState
+from digest import Comparator, file_digest, DEFAULT_ALGORITHM
+from watcher import coalesce
+from stats import SyncStats
+from errorlog import ErrorLog
+from journal import Journal
+from plan import Plan, Operation, batches, BATCH_FILES, BATCH_BYTES
+from dedup import DedupIndex
+import fastcopy
+
+
+# folders modified less than this number of nanoseconds before their scan are not fingerprinted
+RACY_INTERVAL_NS = 2 * 10 ** 9
 
 
 class Synchronizer:
     """Keeps track of folders' changes and synchronizes them"""
     source: Folder
     replica: Folder
+    manifest: Manifest | None
+    comparator: Comparator
+    workers: int
+    stats: SyncStats
 
-    def __init__(self, source: Folder, replica: Folder) -> None:
+    def __init__(self, source: Folder, replica: Folder, manifest: Manifest | None = None, workers: int = 1,
+                 comparator: Comparator | None = None, error_limit: int = 1000, error_file: str | None = None,
+                 journal: Journal | None = None, skip_unchanged: str | None = None,
+                 small_file_size: int | None = None, dedup: DedupIndex | None = None) -> None:
         """
         :param source: folder with initial files
         :param replica: intended copy of source folder
+        :param manifest: index of file states from previous runs (files are compared by comparator if None)
+        :param workers: number of threads comparing, copying and removing files (1 runs everything in place)
+        :param comparator: strategy of checking files for identity (byte by byte comparison if None)
+        :param error_limit: maximal number of failed paths of each kind kept in memory during a cycle
+        :param error_file: path to a file where failed paths over the limit are written (only counted if None)
+        :param journal: write-ahead log of cycles letting an interrupted one be resumed (not resumed if None)
+        :param skip_unchanged: folders which did not change since the last synchronization are not listed
+            (requires manifest): 'stat' checks their files by stat data, 'trust-mtime' does not check them at all
+        :param small_file_size: new files smaller than this number of bytes are copied in batches with reused buffers
+            and a single log record per batch (files are copied one by one if None)
+        :param dedup: index of replica contents letting files with present content be linked instead of copied
+            (files are always copied if None)
         """
-        logging.debug(f"Initializing synchronizer with {source.path = }; {replica.path = }")
+        logging.debug(f"Initializing synchronizer with {source.path = }; {replica.path = }; {workers = }")
+        if workers < 1:
+            raise ValueError("Number of workers should be positive")
+        if skip_unchanged not in (None, 'stat', 'trust-mtime'):
+            raise ValueError(f"Unknown mode of skipping unchanged folders {skip_unchanged!r}")
+        if skip_unchanged is not None and manifest is None:
+            raise ValueError("Skipping unchanged folders requires manifest")
         self.source = source
         self.replica = replica
+        self.manifest = manifest
+        self.comparator = comparator if comparator is not None else Comparator()
+        self.workers = workers
+        self.error_limit = error_limit
+        self.error_file = error_file
+        self.journal = journal
+        self.skip_unchanged = skip_unchanged
+        self.small_file_size = small_file_size
+        self.dedup = dedup
+        # stats of the current or the last finished cycle
+        self.stats = SyncStats()
+        if self.error_file is not None:
+            # spill file keeps failures of the last cycle only
+            open(self.error_file, 'w').close()
+        self._bytes_read = self.comparator.bytes_read
+        self._strategy_counts = fastcopy.strategy_counts.copy()
+        self._pool: ThreadPoolExecutor | None = None
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._pending: list[tuple[bool, Future]] = list()
+        self._deferred: list[Entry] | None = None
+        # True while a full cycle is recorded in the journal
+        self._journaling = False
+        self._resuming = False
+        # copy buffers of small files reused by every thread
+        self._buffers = threading.local()
+        # True if stale records of dedup index are dropped at the end of the cycle
+        self._collect = False
+
+    def _run(self, message: str, error_path: str, action: Callable, *args, removal: bool = False) -> str | None:
+        """
+        Runs file operation in place or passes it to the worker pool if parallel sync is running.
+        Failed operations of the pool are collected at the end of the sync
+
+        :param message: message logged if operation fails
+        :param error_path: path reported if operation fails
+        :param action: operation to run
+        :param args: arguments of operation
+        :param removal: True if operation removes file from replica
+        :returns: error_path if operation failed in place and None otherwise
+        """
+        def run() -> str | None:
+            try:
+                action(*args)
+            except:
+                logging.exception(message)
+                return error_path
+
+        if self._pool is None:
+            return run()
+        self._submit(run, removal)
+
+    def _submit(self, run: Callable, removal: bool = False) -> None:
+        """
+        Passes operation to the worker pool
+
+        :param run: operation returning failed path (or a list of failed paths) and None if it succeeded
+        :param removal: True if operation removes files from replica
+        """
+        # bounding number of queued operations so that walk does not run far ahead of workers
+        self._slots.acquire()
+        future = self._pool.submit(run)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append((removal, future))
+
+    def _sync_parallel(self, sync: Callable, *args) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Runs synchronization walking directories in current thread while files are processed by the worker pool
+
+        :param sync: synchronization method (sync_folders or sync_paths)
+        :param args: arguments of synchronization method
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sync") as pool:
+            self._pool = pool
+            try:
+                remove_errors, update_errors = sync(*args)
+                for removal, future in self._pending:
+                    failed = future.result()
+                    if isinstance(failed, list):
+                        (remove_errors if removal else update_errors).extend(failed)
+                    elif failed is not None:
+                        (remove_errors if removal else update_errors).append(failed)
+                self._finish_cycle(remove_errors, update_errors)
+            finally:
+                self._pool = None
+                self._pending = list()
+        return remove_errors, update_errors
+
+    def _scan(self, scan: Callable, path: str):
+        """
+        Lists folder measuring time of scan phase
+
+        :param scan: scanning method of source or replica folder
+        :param path: path to a current folder inside it
+        :returns: scanned entries
+        """
+        with self.stats.phase('scan'):
+            return scan(path)
+
+    def _checkpoint(self, s_dir: str, failed: bool, pending: list[tuple[bool, Future]],
+                    fingerprint: FolderState | None = None) -> None:
+        """
+        Records folder as finished in journal and its fingerprint in manifest as soon as all its file operations succeed
+
+        :param s_dir: path to a source folder
+        :param failed: True if some operations of the folder failed in place
+        :param pending: operations of the folder passed to the worker pool
+        :param fingerprint: fingerprint of the folder taken before it was scanned (not recorded if None)
+        """
+        if failed or (not self._journaling and fingerprint is None):
+            return
+
+        def finish() -> None:
+            if self._journaling:
+                self.journal.finish_folder(s_dir)
+            if fingerprint is not None:
+                self.manifest.put_folder(s_dir, fingerprint)
+
+        if not pending:
+            finish()
+            return
+        remaining = len(pending)
+        succeeded = True
+        lock = threading.Lock()
+
+        def done(future: Future) -> None:
+            nonlocal remaining, succeeded
+            with lock:
+                remaining -= 1
+                succeeded = succeeded and future.result() is None
+                finished = remaining == 0 and succeeded
+            if finished:
+                finish()
+
+        for _, future in pending:
+            future.add_done_callback(done)
+
+    def _fingerprint(self, s_dir: str) -> os.stat_result | None:
+        """
+        Stats source folder before it is scanned if folder fingerprints are used
 
-    def _remove_obsolete(self, s_files: set, r_files: set, r_base: str) -> list[str]:
+        :param s_dir: path to a source folder
+        :returns: stat data of the folder or None if fingerprints are not used or the folder was modified
+            too recently for its modification time to be trusted
         """
-        Removes files and folders (non recursively) from current replica folder if it's not found in source folder
+        if self.skip_unchanged is None:
+            return None
+        st = os.stat(s_dir)
+        # entries added during the same tick of a coarse clock would not change modification time
+        if time.time_ns() - st.st_mtime_ns < RACY_INTERVAL_NS:
+            return None
+        return st
 
-        :param s_files: list of file names in current source folder
-        :param r_files: list of file names in current replica folder
+    def _unchanged_subfolders(self, s_dir: str, r_dir: str) -> list[str] | None:
+        """
+        Checks folder fingerprint recorded by the last synchronization. Files of the folder are stat'ed
+        unless modification times are trusted
+
+        :param s_dir: path to a source folder
+        :param r_dir: path to its copy in replica
+        :returns: names of subfolders if the folder and its files are unchanged and None otherwise
+        """
+        if self.skip_unchanged is None:
+            return None
+        state = self.manifest.get_folder(s_dir)
+        if state is None:
+            return None
+        try:
+            if not state.matches(os.stat(s_dir)) or not os.path.isdir(r_dir):
+                return None
+            subfolders = list()
+            for name, is_dir, size, mtime_ns in state.children:
+                if is_dir:
+                    subfolders.append(name)
+                elif self.skip_unchanged != 'trust-mtime':
+                    st = os.stat(os.path.join(s_dir, name))
+                    if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                        return None
+        except OSError:
+            return None
+        return subfolders
+
+    def _changed(self, replica_path: str) -> None:
+        """
+        Counts changed file in stats of its folder
+
+        :param replica_path: path of a file in replica folder
+        """
+        self.stats.change(os.path.relpath(os.path.dirname(os.path.normpath(replica_path)), self.replica.path))
+
+    def _error_log(self, kind: str) -> ErrorLog:
+        """
+        :param kind: kind of failed operations ('remove' or 'update')
+        :returns: new bounded log of failed paths
+        """
+        return ErrorLog(kind, self.error_limit, self.error_file)
+
+    def _known_digest(self, file_path: str, st: os.stat_result | Entry) -> str:
+        """
+        Gets content hash of a file from manifest if the file was not changed since it was recorded,
+        otherwise calculates it and records new state
+
+        :param file_path: path to a file
+        :param st: current stat data of the file (result of os.stat call or scanned entry)
+        :returns: hex digest of file content
+        """
+        state = self.manifest.get(file_path)
+        if state is not None and state.digest is not None and state.matches(st):
+            return state.digest
+        digest = file_digest(file_path, throttle=self.comparator.throttle)
+        self.stats.add('bytes_compared', st.st_size)
+        self.manifest.put(file_path, FileState.from_stat(st, digest))
+        return digest
+
+    def _digest(self, file_path: str, st: os.stat_result | Entry, algorithm: str = 'blake2b') -> str:
+        """
+        Gets content hash of a file from manifest if it's used, otherwise calculates it by comparator
+
+        :param file_path: path to a file
+        :param st: current stat data of the file (result of os.stat call or scanned entry)
+        :param algorithm: name of hash algorithm (manifest keeps 'blake2b' digests only)
+        :returns: hex digest of file content
+        """
+        if self.manifest is not None and algorithm == 'blake2b':
+            return self._known_digest(file_path, st)
+        return self.comparator.digest(file_path, st, algorithm)
+
+    def _files_identical(self, source_path: str, replica_path: str,
+                         s_entry: Entry | None = None, r_entry: Entry | None = None) -> bool:
+        """
+        Checks source and replica files for identity. Files unchanged since the last run are not read again
+        if manifest is used instead of byte by byte comparison (other comparators have their own strategies).
+        Files transformed in replica (e.g. compressed) are compared by their stored digests
+
+        :param source_path: path of a file in source folder
+        :param replica_path: path of a file in replica folder
+        :param s_entry: scanned entry of source file (it's stat'ed if None)
+        :param r_entry: scanned entry of replica file (it's stat'ed if None)
+        :returns: True if files are the same and False otherwise
+        """
+        self.stats.add('files_compared')
+        with self.stats.phase('compare'):
+            stored = self.replica.stored_digest(replica_path)
+            if stored is not None:
+                # replica keeps digest of original content, so only source file is read
+                size, algorithm, digest = stored
+                s_stat = s_entry if s_entry is not None else os.stat(source_path)
+                if s_stat.st_size != size:
+                    return False
+                return self._digest(source_path, s_stat, algorithm) == digest
+            if self.manifest is None or type(self.comparator) is not Comparator:
+                return self.comparator.same(source_path, replica_path, s_entry, r_entry)
+
+            s_stat = s_entry if s_entry is not None else os.stat(source_path)
+            r_stat = r_entry if r_entry is not None else os.stat(replica_path)
+            if s_stat.st_size != r_stat.st_size:
+                return False
+            return self._known_digest(source_path, s_stat) == self._known_digest(replica_path, r_stat)
+
+    def _remove_obsolete(self, s_files: set | dict[str, Entry], r_files: set | dict[str, Entry],
+                         r_base: str) -> ErrorLog:
+        """
+        Removes files and folders (non recursively) from current replica folder if it's not found in source folder.
+        Files excluded by replica's filters are kept
+
+        :param s_files: file names (or scanned entries by names) in current source folder
+        :param r_files: file names (or scanned entries by names) in current replica folder
         :param r_base: path to a current replica folder
         :returns: a list of file paths those could not be deleted
         """
-        to_delete = r_files - s_files
-        remove_errors = list()
+        to_delete = r_files.keys() - s_files if isinstance(r_files, dict) else r_files - set(s_files)
+        if self.replica.filters is not None and not isinstance(r_files, dict):
+            # scanned entries are filtered already, bare names are not
+            to_delete = {file for file in to_delete if not self.replica.excluded(os.path.join(r_base, file))}
+        remove_errors = self._error_log('remove')
 
         if len(to_delete) > 0:
             logging.info(f"Found {len(to_delete)} obsolete file(s)")
         for file in to_delete:
+            r_entry = r_files[file] if isinstance(r_files, dict) else None
+            if self._deferred is not None and r_entry is not None:
+                self._deferred.append(r_entry)
+                continue
+            failed = self._run("Could not remove file", os.path.join(r_base, file), self._remove_file,
+                               os.path.join(r_base, file), r_entry, removal=True)
+            if failed is not None:
+                remove_errors.append(failed)
+
+        return remove_errors
+
+    def _source_path(self, replica_path: str) -> str:
+        """
+        :param replica_path: path of a file in replica folder
+        :returns: path of the same file in source folder
+        """
+        return os.path.join(self.source.path, os.path.relpath(replica_path, self.replica.path))
+
+    def _moved_from(self, source_path: str, s_entry: Entry) -> str | None:
+        """
+        Finds replica file which is a copy of moved source file using inode recorded in manifest
+
+        :param source_path: current path of a file in source folder
+        :param s_entry: scanned entry of source file
+        :returns: path of a file copy in replica or None if the file is not found
+        """
+        for old_path in self.manifest.find_inode(s_entry.st_ino):
+            if old_path == source_path or not self.source._contains(old_path) or os.path.lexists(old_path):
+                continue
+            replica_path = os.path.join(self.replica.path, os.path.relpath(old_path, self.source.path))
+            if os.path.lexists(replica_path) and os.path.isdir(replica_path) == s_entry.is_dir:
+                return replica_path
+
+    def _match_renames(self, s_files: dict[str, Entry], r_files: dict[str, Entry],
+                       s_base: str) -> Iterator[tuple[str, str, str | None]]:
+        """
+        Finds new source files which were renamed or moved. Files are matched by inodes recorded in manifest
+        or by size and digest of content (every file is hashed at most once)
+
+        :param s_files: scanned entries in current source folder
+        :param r_files: scanned entries in current replica folder
+        :param s_base: path to a current folder in source
+        :returns: names of new files with paths of their copies in replica and names of the copies
+            if they are in current replica folder (None if they were moved from another folder)
+        """
+        new_files = s_files.keys() - r_files.keys()
+        if not new_files:
+            return
+        obsolete = {file: r_files[file] for file in r_files.keys() - s_files.keys()}
+        by_inode = dict()
+        if self.manifest is not None:
+            for file in obsolete:
+                state = self.manifest.get(os.path.join(s_base, file))
+                if state is not None:
+                    by_inode[state.inode] = file
+        # obsolete files are hashed only if a new file has the same size
+        by_size = dict()
+        for name, r_entry in obsolete.items():
+            if not r_entry.is_dir and r_entry.st_size > 0:
+                by_size.setdefault(r_entry.st_size, []).append(name)
+        by_digest = dict()
+
+        for file in new_files:
+            s_entry = s_files[file]
+            s_full_file = os.path.join(s_base, file)
+            try:
+                old = by_inode.get(s_entry.st_ino)
+                if old not in obsolete or obsolete[old].is_dir != s_entry.is_dir:
+                    old = None
+                if old is None and not s_entry.is_dir and s_entry.st_size > 0:
+                    old = self._match_content(s_full_file, s_entry, obsolete, by_size, by_digest)
+                if old is not None:
+                    old_path = obsolete.pop(old).path
+                elif self.manifest is not None:
+                    old_path = self._moved_from(s_full_file, s_entry)
+                else:
+                    old_path = None
+            except:
+                logging.exception("Could not rename a file, it will be copied")
+                continue
+            if old_path is not None:
+                yield file, old_path, old
+
+    def _match_content(self, source_path: str, s_entry: Entry, obsolete: dict[str, Entry],
+                       by_size: dict[int, list[str]],
+                       by_digest: dict[int, dict[str, dict[str, list[str]]]]) -> str | None:
+        """
+        Finds obsolete replica file with the same content as a new source file
+
+        :param source_path: path of a new file in source folder
+        :param s_entry: scanned entry of the new file
+        :param obsolete: scanned entries of not yet matched obsolete files in current replica folder
+        :param by_size: names of not yet hashed obsolete files by sizes (hashed files are moved to by_digest)
+        :param by_digest: names of hashed obsolete files by sizes, hash algorithms and digests
+        :returns: name of a matching obsolete file or None
+        """
+        algorithm = 'blake2b' if self.manifest is not None else DEFAULT_ALGORITHM
+        with self.stats.phase('compare'):
+            hashed = by_digest.setdefault(s_entry.st_size, dict())
+            for name in by_size.pop(s_entry.st_size, ()):
+                r_entry = obsolete.get(name)
+                if r_entry is None:
+                    continue
+                try:
+                    stored = self.replica.stored_digest(r_entry.path)
+                    if stored is not None:
+                        _, r_algorithm, digest = stored
+                    else:
+                        r_algorithm, digest = algorithm, self._digest(r_entry.path, r_entry, algorithm)
+                except OSError as e:
+                    logging.debug(f"{r_entry.path!r} is not checked for renames: {e}")
+                    continue
+                hashed.setdefault(r_algorithm, dict()).setdefault(digest, []).append(name)
+
+            for r_algorithm, names_by_digest in hashed.items():
+                names = names_by_digest.get(self._digest(source_path, s_entry, r_algorithm), [])
+                while names:
+                    name = names.pop()
+                    if name in obsolete:
+                        return name
+        return None
+
+    def _rename(self, old_path: str, new_path: str, s_entry: Entry) -> None:
+        """
+        Renames file in replica instead of copying it again
+
+        :param old_path: path to a copy of the file in replica
+        :param new_path: new path of the file in replica
+        :param s_entry: scanned entry of source file
+        """
+        self.replica.move(old_path, new_path)
+        if self.manifest is not None:
+            self.manifest.move(old_path, new_path)
+            # the file is recorded under its new source path when it's scanned
+            self.manifest.discard(self._source_path(old_path))
+        if self.dedup is not None:
+            self.dedup.move(old_path, new_path)
+        saved = s_entry.st_size if not s_entry.is_dir else self._tree_size(new_path)
+        self.stats.add('renames')
+        self.stats.add('rename_bytes_saved', saved)
+        self._changed(new_path)
+        logging.info(f"{old_path!r} renamed to {new_path!r} ({saved} bytes not copied)")
+
+    def _detect_renames(self, s_files: dict[str, Entry], r_files: dict[str, Entry], s_base: str, r_base: str) -> None:
+        """
+        Renames files in replica instead of copying them again if new source files were renamed or moved.
+        Entries of renamed replica files are put to r_files under their new names
+
+        :param s_files: scanned entries in current source folder
+        :param r_files: scanned entries in current replica folder
+        :param s_base: path to a current folder in source
+        :param r_base: path to a current folder in replica
+        """
+        for file, old_path, old in self._match_renames(s_files, r_files, s_base):
+            if old is not None:
+                del r_files[old]
+            new_path = os.path.join(r_base, file)
             try:
-                self.replica.remove(os.path.join(r_base, file))
+                self._rename(old_path, new_path, s_files[file])
+                r_files[file] = Entry.from_path(new_path)
             except:
-                logging.exception("Could not remove file")
-                remove_errors.append(os.path.join(r_base, file))
+                logging.exception("Could not rename a file, it will be copied")
+
+    @staticmethod
+    def _tree_size(path: str) -> int:
+        """
+        :param path: path to a folder
+        :returns: total size of files in a folder in bytes
+        """
+        size = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                size += os.lstat(os.path.join(root, file)).st_size
+        return size
 
+    def _remove_deferred(self, deferred: list[Entry]) -> ErrorLog:
+        """
+        Removes obsolete files postponed till the end of the cycle unless they were moved
+
+        :param deferred: scanned entries of obsolete replica files
+        :returns: a list of file paths those could not be deleted
+        """
+        remove_errors = self._error_log('remove')
+        for r_entry in deferred:
+            if not os.path.lexists(r_entry.path):
+                continue
+            failed = self._run("Could not remove file", r_entry.path, self._remove_file, r_entry.path, r_entry,
+                               removal=True)
+            if failed is not None:
+                remove_errors.append(failed)
         return remove_errors
 
-    def _update_file(self, source_path: str, replica_path: str) -> tuple[list, list] | None:
+    def _remove_file(self, replica_path: str, r_entry: Entry | None = None) -> None:
+        """
+        Removes file or folder from replica
+
+        :param replica_path: path of a file in replica folder
+        :param r_entry: scanned entry of replica file (it's stat'ed if None)
+        """
+        with self.stats.phase('remove'):
+            self.replica.remove(replica_path, r_entry)
+        self.stats.add('removals')
+        self._changed(replica_path)
+        if self.manifest is not None:
+            self.manifest.discard(replica_path)
+            # records of removed source file are outdated as well
+            self.manifest.discard(self._source_path(replica_path))
+        if self.dedup is not None:
+            self.dedup.discard(replica_path)
+
+    def _refresh_file(self, source_path: str, replica_path: str,
+                      s_entry: Entry | None = None, r_entry: Entry | None = None) -> None:
         """
-        Updates existing file if its content differs from source file. It calls sync_folders method if file is a folder
+        Copies existing file from source if its content differs
 
         :param source_path: path of a file in source folder
         :param replica_path: path of a file in replica folder
+        :param s_entry: scanned entry of source file (it's stat'ed if None)
+        :param r_entry: scanned entry of replica file (it's stat'ed if None)
+        """
+        if not self._files_identical(source_path, replica_path, s_entry, r_entry):
+            self._replace_file(source_path, replica_path, s_entry)
+
+    def _replace_file(self, source_path: str, replica_path: str, s_entry: Entry | None = None) -> None:
+        """
+        Copies existing file from source which is known to differ
+
+        :param source_path: path of a file in source folder
+        :param replica_path: path of a file in replica folder
+        :param s_entry: scanned entry of source file (it's stat'ed if None)
+        """
+        logging.debug(f"Updating {source_path!r} from source")
+        self._copy(source_path, replica_path, s_entry)
+        self.comparator.copied(source_path, replica_path, s_entry)
+        if self.manifest is not None:
+            # replica has the same content as source now
+            s_state = self.manifest.get(source_path)
+            s_stat = s_entry if s_entry is not None else os.stat(source_path)
+            digest = s_state.digest if s_state is not None and s_state.matches(s_stat) else None
+            self.manifest.put(replica_path, FileState.from_stat(os.stat(replica_path), digest))
+        logging.info(f"File {source_path!r} updated from source")
+
+    def _copy(self, source_path: str, replica_path: str, s_entry: Entry | None = None) -> None:
+        """
+        Copies file or folder from source counting copied bytes
+
+        :param source_path: path of a file in source folder
+        :param replica_path: path of a file in replica folder
+        :param s_entry: scanned entry of source file (it's stat'ed if None)
+        """
+        journaled = [self.replica.temp_path(replica_path)]
+        if self.journal is not None:
+            # files updated by blocks may be rewritten in place, so an interrupted update is removed as a leftover
+            if self.replica.delta_applicable(source_path, replica_path):
+                journaled.append(replica_path)
+            for path in journaled:
+                self.journal.planned(path)
+        with self.stats.phase('copy'):
+            copied = self.replica.copy_into(source_path, replica_path, s_entry,
+                                            self._link_duplicate if self.dedup is not None else None)
+        if self.journal is not None:
+            for path in journaled:
+                self.journal.copied(path)
+        self.stats.add('files_copied')
+        self.stats.add('bytes_copied', copied)
+        self._changed(replica_path)
+
+    def _is_small(self, s_entry: Entry) -> bool:
+        """
+        :param s_entry: scanned entry of source file
+        :returns: True if the file is copied in batches of small files
+        """
+        return self.small_file_size is not None and s_entry.is_file() and s_entry.st_size < self.small_file_size
+
+    def _copy_small(self, files: list[tuple[str, str, Entry]]) -> list[tuple[str, str, Entry]]:
+        """
+        Copies a batch of small new files with a buffer reused by current thread
+
+        :param files: source paths, replica paths and scanned entries of source files
+        :returns: files which were not copied in the batch and should be copied one by one
+        """
+        buffer = getattr(self._buffers, 'buffer', None)
+        if buffer is None:
+            buffer = self._buffers.buffer = bytearray(self.small_file_size + 1)
+        if self.journal is not None:
+            for _, replica_path, _ in files:
+                self.journal.planned(self.replica.temp_path(replica_path))
+        with self.stats.phase('copy'):
+            copied, rest = self.replica.copy_small_files(files, buffer)
+        not_copied = {source_path for source_path, _, _ in rest}
+        for source_path, replica_path, s_entry in files:
+            if source_path in not_copied:
+                continue
+            if self.journal is not None:
+                self.journal.copied(self.replica.temp_path(replica_path))
+            self.comparator.copied(source_path, replica_path, s_entry)
+            self._changed(replica_path)
+        self.stats.add('files_copied', len(files) - len(rest))
+        self.stats.add('bytes_copied', copied)
+        return rest
+
+    def _run_small(self, files: list[tuple[str, str, Entry]], update_errors: ErrorLog) -> None:
+        """
+        Copies a batch of small new files in place or passes it to the worker pool as a single task
+
+        :param files: source paths, replica paths and scanned entries of source files
+        :param update_errors: log of failed to copy files
+        """
+        def run() -> list[str] | None:
+            try:
+                rest = self._copy_small(files)
+            except:
+                logging.exception("Could not copy a batch of files!")
+                return [source_path for source_path, _, _ in files]
+            failed = list()
+            for source_path, replica_path, s_entry in rest:
+                try:
+                    self._copy_new(source_path, replica_path, s_entry)
+                except:
+                    logging.exception("Could not copy a file!")
+                    failed.append(source_path)
+            return failed or None
+
+        if self._pool is None:
+            update_errors.extend(run() or ())
+        else:
+            self._submit(run)
+
+    def _link_duplicate(self, source_path: str, tmp: str, replica_path: str) -> bool:
+        """
+        Links temporary copy of a source file to a replica file with the same content if it's present.
+        Contents of copied files are recorded in dedup index
+
+        :param source_path: path of a file in source folder
+        :param tmp: path of its temporary copy in replica
+        :param replica_path: path of the copy in replica after it's put in place
+        :returns: True if the copy was linked and False if it should be copied
+        """
+        s_stat = os.lstat(source_path)
+        if not stat.S_ISREG(s_stat.st_mode) or s_stat.st_size < self.dedup.min_size:
+            return False
+        if self.manifest is not None:
+            digest = self._known_digest(source_path, s_stat)
+        else:
+            digest = file_digest(source_path, throttle=self.comparator.throttle)
+            self.stats.add('bytes_compared', s_stat.st_size)
+        found = self.dedup.find(digest)
+        if found is not None and os.path.normpath(found[0]) != os.path.normpath(replica_path):
+            existing_path, existing = found
+            try:
+                self.dedup.link(existing_path, tmp)
+                if self.dedup.mode == 'reflink':
+                    shutil.copystat(source_path, tmp)
+                    existing = s_stat
+            except OSError as e:
+                logging.warning(f"Could not link {tmp!r} to {existing_path!r}, the file will be copied: {e}")
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+            else:
+                # hardlinks keep metadata of the present file
+                self.dedup.add(replica_path, digest, existing.st_size, existing.st_mtime_ns)
+                self.stats.add('dedup_links')
+                self.stats.add('dedup_bytes_saved', s_stat.st_size)
+                logging.info(f"{replica_path!r} linked to {existing_path!r} ({s_stat.st_size} bytes not copied)")
+                return True
+        # the copy keeps size and modification time of the source file
+        self.dedup.add(replica_path, digest, s_stat.st_size, s_stat.st_mtime_ns)
+        return False
+
+    def _copy_new(self, source_path: str, replica_path: str, s_entry: Entry | None = None) -> None:
+        """
+        Copies new file or folder from source
+
+        :param source_path: path of a file in source folder
+        :param replica_path: path of a file in replica folder
+        :param s_entry: scanned entry of source file (it's stat'ed if None)
+        """
+        self._copy(source_path, replica_path, s_entry)
+        if not (s_entry.is_dir if s_entry is not None else os.path.isdir(source_path)):
+            self.comparator.copied(source_path, replica_path, s_entry)
+
+    def _update_file(self, source_path: str, replica_path: str,
+                     s_entry: Entry | None = None, r_entry: Entry | None = None) -> tuple[list, list] | None:
+        """
+        Updates existing file if its content differs from source file. It synchronizes entire folder if file is a folder
+
+        :param source_path: path of a file in source folder
+        :param replica_path: path of a file in replica folder
+        :param s_entry: scanned entry of source file (it's stat'ed if None)
+        :param r_entry: scanned entry of replica file (it's stat'ed if None)
         :returns: a list of current failed to remove files and a list of current failed to copy files
         """
         # if it's an existing folder recursively synchronize
-        if os.path.isdir(source_path):
-            return self.sync_folders(source_path, replica_path)
-        else:
-            # if it's an existing file check for changes and copy if it's needed
-            if not Folder.compare_files(source_path, replica_path):
-                logging.debug(f"Updating {source_path!r} from source")
-                self.replica.copy_into(source_path, replica_path)
-                logging.info(f"File {source_path!r} updated from source")
+        if s_entry.is_dir if s_entry is not None else os.path.isdir(source_path):
+            return self._sync_folder(source_path, replica_path)
+        # if it's an existing file check for changes and copy if it's needed
+        failed = self._run("Could not update a file!", source_path, self._refresh_file,
+                           source_path, replica_path, s_entry, r_entry)
+        if failed is not None:
+            return [], [failed]
 
-    def sync_folders(self, s_base: str = None, r_base: str = None) -> tuple[list, list]:
+    def _begin_cycle(self) -> None:
         """
-        Recursively synchronizes source folder with replica.
+        Starts collecting stats of a new cycle
+        """
+        self.stats = SyncStats()
+        if self.error_file is not None:
+            # spill file keeps failures of the last cycle only
+            open(self.error_file, 'w').close()
+        self._bytes_read = self.comparator.bytes_read
+        self._strategy_counts = fastcopy.strategy_counts.copy()
 
-        :param s_base: path to a current folder in source
-        :param r_base: path to a current folder in replica
-        :returns: a list of failed to remove files and a list of failed to copy files
+    def _finish_cycle(self, remove_errors: ErrorLog, update_errors: ErrorLog) -> None:
+        """
+        Saves file states and digests collected during synchronization and finishes stats of the cycle
+
+        :param remove_errors: failed to remove files
+        :param update_errors: failed to copy files
+        """
+        remove_errors.close()
+        update_errors.close()
+        if self._journaling:
+            self.journal.end()
+            self._journaling = self._resuming = False
+        if self.manifest is not None:
+            self.manifest.commit()
+        if self.dedup is not None:
+            if self._collect:
+                self.dedup.collect_garbage()
+                self._collect = False
+            self.dedup.commit()
+        self.comparator.flush()
+        self.stats.add('bytes_compared', self.comparator.bytes_read - self._bytes_read)
+        self.stats.copy_strategies = dict(fastcopy.strategy_counts - self._strategy_counts)
+        self.stats.finish(len(remove_errors) + len(update_errors))
+
+    def _check_folders(self) -> bool:
+        """
+        Checks that source and replica folders exist. Replica is created again if it was removed
+
+        :returns: True if both folders exist and False if replica was revived
         """
         if not self.source.is_alive():
             msg = "Source folder was removed during runtime"
             logging.critical(msg)
             raise RuntimeError(msg)
-        # if replica folder is removed while running for some reason => create new and sync again
         if not self.replica.is_alive():
             logging.error("Replica folder was removed during runtime. Trying to resync..")
             self.replica.revive()
-            return self.sync_folders()
+            return False
+        return True
 
-        s_base = s_base if s_base is not None else self.source.path
-        r_base = r_base if r_base is not None else self.replica.path
-        s_files = set(os.listdir(s_base))
-        r_files = set(os.listdir(r_base))
+    def sync_paths(self, paths: Iterable[str]) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes only given files and folders (e.g. reported by a watcher) instead of entire source folder
 
-        update_errors = list()
+        :param paths: paths of changed files relative to source folder
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        if self.workers > 1 and self._pool is None:
+            return self._sync_parallel(self.sync_paths, paths)
+        if not self._check_folders():
+            return self.sync_folders()
+        self._begin_cycle()
 
-        # keep track of removed files
-        remove_errors = self._remove_obsolete(s_files, r_files, r_base)
+        targets = set()
+        for path in paths:
+            path = os.path.normpath(path)
+            # excluded paths are neither copied nor removed
+            if (self.source.excluded(os.path.join(self.source.path, path)) or
+                    self.replica.excluded(os.path.join(self.replica.path, path))):
+                continue
+            # changes of a file inside not yet synchronized folder are applied with the whole folder
+            while os.path.dirname(path) and not os.path.isdir(os.path.join(self.replica.path, os.path.dirname(path))):
+                path = os.path.dirname(path)
+            targets.add(path)
 
-        # keep track of new and updated files
-        for file in s_files:
-            s_full_file = os.path.join(s_base, file)
-            if file in r_files:
+        remove_errors, update_errors = self._error_log('remove'), self._error_log('update')
+        for path in coalesce(targets):
+            s_full_file = os.path.join(self.source.path, path)
+            r_full_file = os.path.join(self.replica.path, path)
+            s_is_dir = os.path.isdir(s_full_file)
+
+            if os.path.lexists(r_full_file) and (not os.path.lexists(s_full_file) or
+                                                 s_is_dir != os.path.isdir(r_full_file)):
+                # removing in place since the same path may be copied right after
+                try:
+                    self._remove_file(r_full_file)
+                except:
+                    logging.exception("Could not remove file")
+                    remove_errors.append(r_full_file)
+                    continue
+            if not os.path.lexists(s_full_file):
+                continue
+            if os.path.lexists(r_full_file):
                 try:
-                    upd_res = self._update_file(s_full_file, os.path.join(r_base, file))
+                    upd_res = self._update_file(s_full_file, r_full_file)
                     if upd_res is not None:
                         remove_errors.extend(upd_res[0])
                         update_errors.extend(upd_res[1])
@@ -100,11 +844,404 @@ class Synchronizer:
                     logging.exception("Could not update a file!")
                     update_errors.append(s_full_file)
             else:
-                try:
-                    # if new file created in source
-                    self.replica.copy_into(s_full_file, os.path.join(r_base, file))
-                except:
-                    logging.exception("Could not copy a file!")
-                    update_errors.append(s_full_file)
+                failed = self._run("Could not copy a file!", s_full_file, self._copy_new, s_full_file, r_full_file)
+                if failed is not None:
+                    update_errors.append(failed)
+
+        if self._pool is None:
+            self._finish_cycle(remove_errors, update_errors)
+        return remove_errors, update_errors
+
+    def sync_folders(self, s_base: str = None, r_base: str = None) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Recursively synchronizes source folder with replica.
+
+        :param s_base: path to a current folder in source
+        :param r_base: path to a current folder in replica
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        if self.workers > 1 and self._pool is None:
+            return self._sync_parallel(self.sync_folders, s_base, r_base)
+        if s_base is not None:
+            return self._sync_folder(s_base, r_base)
+
+        # if replica folder is removed while running for some reason => create new and sync again
+        if not self._check_folders():
+            return self.sync_folders()
+        self._begin_cycle()
+        self._collect = True
+        if self.journal is not None:
+            self._resuming = self.journal.begin()
+            self._journaling = True
+            if self._resuming:
+                logging.info("Resuming interrupted synchronization")
+
+        if self.manifest is None:
+            remove_errors, update_errors = self._sync_folder(self.source.path, self.replica.path)
+        else:
+            # obsolete files are removed at the end of the cycle since they may be moved to another folder
+            self._deferred = list()
+            try:
+                remove_errors, update_errors = self._sync_folder(self.source.path, self.replica.path)
+                deferred, self._deferred = self._deferred, None
+                remove_errors.extend(self._remove_deferred(deferred))
+            finally:
+                self._deferred = None
+        if self._pool is None:
+            self._finish_cycle(remove_errors, update_errors)
+        return remove_errors, update_errors
+
+    def _sync_folder(self, s_base: str, r_base: str) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Synchronizes folder in source with its copy in replica walking subfolders with an explicit stack.
+        Sorted entries of both sides are merged so that only the current folder is kept in memory
+
+        :param s_base: path to a current folder in source
+        :param r_base: path to a current folder in replica
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        remove_errors, update_errors = self._error_log('remove'), self._error_log('update')
+        folders = [(s_base, r_base)]
+
+        def update(s_entry: Entry, r_entry: Entry, s_full_file: str, r_full_file: str) -> None:
+            if s_entry.is_dir:
+                # subfolders are synchronized after the current folder
+                folders.append((s_full_file, r_full_file))
+                return
+            if resumed:
+                # the file was synchronized before the interruption
+                return
+            failed = self._run("Could not update a file!", s_full_file, self._refresh_file,
+                               s_full_file, r_full_file, s_entry, r_entry)
+            if failed is not None:
+                update_errors.append(failed)
+
+        while folders:
+            s_dir, r_dir = folders.pop()
+            subfolders = self._unchanged_subfolders(s_dir, r_dir)
+            if subfolders is not None:
+                # entries were not added or removed, so the folder is not listed
+                self.stats.add('dirs_skipped')
+                folders.extend((os.path.join(s_dir, name), os.path.join(r_dir, name)) for name in subfolders)
+                self._checkpoint(s_dir, False, [])
+                continue
+            try:
+                s_st = self._fingerprint(s_dir)
+                s_entries = self._scan(self.source.scan_sorted, s_dir)
+                r_entries = self._scan(self.replica.scan_sorted, r_dir)
+            except:
+                if s_dir == s_base:
+                    raise
+                logging.exception("Could not update a file!")
+                update_errors.append(s_dir)
+                continue
+            self.stats.add('dirs_scanned')
+            resumed = self._resuming and self.journal.is_finished(s_dir)
+            errors = len(remove_errors) + len(update_errors)
+            pending = len(self._pending)
+
+            # only new and obsolete entries are kept until the whole folder is merged
+            new, obsolete = dict(), dict()
+            for s_entry, r_entry in merge_entries(s_entries, r_entries):
+                if r_entry is None:
+                    new[s_entry.name] = s_entry
+                elif s_entry is None:
+                    obsolete[r_entry.name] = r_entry
+                else:
+                    s_full_file = os.path.join(s_dir, s_entry.name)
+                    if self.manifest is not None and s_entry.is_dir:
+                        # inodes of folders are recorded to find them if they are moved
+                        self.manifest.put(s_full_file, FileState.from_stat(s_entry))
+                    update(s_entry, r_entry, s_full_file, os.path.join(r_dir, s_entry.name))
+            fingerprint = None
+            if s_st is not None:
+                fingerprint = FolderState(s_st.st_mtime_ns, s_st.st_ino, tuple(
+                    (s_entry.name, s_entry.is_dir, s_entry.st_size, s_entry.st_mtime_ns) for s_entry in s_entries))
+            del s_entries, r_entries
+
+            # renamed files are not removed and copied again, their replica entries are put to obsolete by new names
+            self._detect_renames(new, obsolete, s_dir, r_dir)
+            remove_errors.extend(self._remove_obsolete(new, obsolete, r_dir))
+
+            small, small_bytes = list(), 0
+            for file, s_entry in new.items():
+                s_full_file = os.path.join(s_dir, file)
+                r_full_file = os.path.join(r_dir, file)
+                if self.manifest is not None and (s_entry.is_dir or file not in obsolete):
+                    # inodes of folders and new files are recorded to find them if they are moved
+                    self.manifest.put(s_full_file, FileState.from_stat(s_entry))
+                if file in obsolete:
+                    update(s_entry, obsolete[file], s_full_file, r_full_file)
+                    continue
+                if self._is_small(s_entry):
+                    small.append((s_full_file, r_full_file, s_entry))
+                    small_bytes += s_entry.st_size
+                    if len(small) >= BATCH_FILES or small_bytes >= BATCH_BYTES:
+                        self._run_small(small, update_errors)
+                        small, small_bytes = list(), 0
+                    continue
+                # if new file created in source
+                failed = self._run("Could not copy a file!", s_full_file, self._copy_new, s_full_file, r_full_file,
+                                   s_entry)
+                if failed is not None:
+                    update_errors.append(failed)
+            if small:
+                self._run_small(small, update_errors)
+            self._checkpoint(s_dir, len(remove_errors) + len(update_errors) > errors, self._pending[pending:],
+                             fingerprint)
+
+        return remove_errors, update_errors
+
+    def _plan_update(self, plan: Plan, folders: list, s_entry: Entry, r_entry: Entry, s_full_file: str,
+                     r_full_file: str, r_path: str) -> None:
+        """
+        Plans update of a file existing on both sides
+
+        :param plan: plan of the cycle
+        :param folders: stack of folders left to plan
+        :param s_entry: scanned entry of source file
+        :param r_entry: scanned entry of replica file
+        :param s_full_file: path of a file in source folder
+        :param r_full_file: path of a file in replica folder
+        :param r_path: current path of the replica file (it differs from r_full_file if the file is going to be moved)
+        """
+        if s_entry.is_dir and r_entry.is_dir:
+            folders.append((s_full_file, r_full_file, r_path))
+        elif s_entry.is_dir:
+            plan.add(Operation('mkdir', s_full_file, r_full_file, s_entry))
+            folders.append((s_full_file, r_full_file, None))
+        elif r_entry.is_dir:
+            plan.add(Operation('create', s_full_file, r_full_file, s_entry))
+        else:
+            try:
+                identical = self._files_identical(s_full_file, r_path, s_entry, r_entry)
+            except:
+                logging.exception("Could not compare files, the file will be copied")
+                identical = False
+            if not identical:
+                plan.add(Operation('update', s_full_file, r_full_file, s_entry))
+
+    def plan(self) -> Plan:
+        """
+        Finds operations synchronizing replica with source without changing replica. It starts a new cycle
+        which is finished by execute method
+
+        :returns: plan of the cycle
+        """
+        self._begin_cycle()
+        plan = Plan()
+        # source folder, replica folder and its current path (None if the folder is going to be created)
+        folders = [(self.source.path, self.replica.path, self.replica.path)]
+        while folders:
+            s_dir, r_dir, r_scan = folders.pop()
+            subfolders = self._unchanged_subfolders(s_dir, r_dir) if r_scan == r_dir else None
+            if subfolders is not None:
+                # entries were not added or removed, so the folder is not listed
+                self.stats.add('dirs_skipped')
+                folders.extend((os.path.join(s_dir, name), os.path.join(r_dir, name), os.path.join(r_dir, name))
+                               for name in subfolders)
+                continue
+            try:
+                s_st = self._fingerprint(s_dir)
+                s_entries = self._scan(self.source.scan_sorted, s_dir)
+                r_entries = self._scan(self.replica.scan_sorted, r_scan) if r_scan is not None else []
+            except:
+                if s_dir == self.source.path:
+                    raise
+                logging.exception("Could not plan synchronization of a folder")
+                continue
+            self.stats.add('dirs_scanned')
+
+            new, obsolete = dict(), dict()
+            for s_entry, r_entry in merge_entries(s_entries, r_entries):
+                if r_entry is None:
+                    new[s_entry.name] = s_entry
+                elif s_entry is None:
+                    obsolete[r_entry.name] = r_entry
+                else:
+                    self._plan_update(plan, folders, s_entry, r_entry, os.path.join(s_dir, s_entry.name),
+                                      os.path.join(r_dir, s_entry.name), r_entry.path)
+            if s_st is not None:
+                plan.fingerprints[s_dir] = FolderState(s_st.st_mtime_ns, s_st.st_ino, tuple(
+                    (s_entry.name, s_entry.is_dir, s_entry.st_size, s_entry.st_mtime_ns) for s_entry in s_entries))
+            del s_entries, r_entries
+
+            for file, old_path, old in self._match_renames(new, obsolete, s_dir):
+                s_entry = new.pop(file)
+                r_entry = obsolete.pop(old) if old is not None else Entry.from_path(old_path)
+                origin = os.path.join(r_dir, old) if old is not None else old_path
+                plan.add(Operation('move', os.path.join(s_dir, file), os.path.join(r_dir, file), s_entry, origin))
+                self._plan_update(plan, folders, s_entry, r_entry, os.path.join(s_dir, file),
+                                  os.path.join(r_dir, file), r_entry.path)
+            for file, r_entry in obsolete.items():
+                plan.add(Operation('delete', None, os.path.join(r_dir, file), r_entry))
+            for file, s_entry in new.items():
+                s_full_file = os.path.join(s_dir, file)
+                r_full_file = os.path.join(r_dir, file)
+                if s_entry.is_dir:
+                    plan.add(Operation('mkdir', s_full_file, r_full_file, s_entry))
+                    folders.append((s_full_file, r_full_file, None))
+                else:
+                    plan.add(Operation('create', s_full_file, r_full_file, s_entry))
+        return plan
+
+    def _make_folder(self, operation: Operation) -> None:
+        """
+        Creates new folder in replica replacing a file with the same name
+
+        :param operation: planned 'mkdir' operation
+        """
+        if os.path.lexists(operation.target):
+            self._remove_file(operation.target)
+        os.mkdir(operation.target)
+        if self.manifest is not None:
+            self.manifest.put(operation.source, FileState.from_stat(operation.entry))
+
+    def _apply_copy(self, operation: Operation) -> bool:
+        """
+        Runs planned 'create' or 'update' operation
+
+        :param operation: planned operation
+        :returns: True if the operation succeeded
+        """
+        try:
+            if operation.kind == 'update':
+                self._replace_file(operation.source, operation.target, operation.entry)
+                return True
+            if os.path.isdir(operation.target) and not os.path.islink(operation.target):
+                self._remove_file(operation.target)
+            self._copy_new(operation.source, operation.target, operation.entry)
+            if self.manifest is not None:
+                self.manifest.put(operation.source, FileState.from_stat(operation.entry))
+        except:
+            logging.exception("Could not copy a file!")
+            return False
+        return True
+
+    def _run_batch(self, operations: list[Operation], update_errors: ErrorLog) -> None:
+        """
+        Copies a batch of files in place or passes it to the worker pool as a single task
+
+        :param operations: planned copies
+        :param update_errors: log of failed to copy files
+        """
+        def run() -> list[str] | None:
+            # replica folders replaced by small files are not copied in the batch and fall back to single copies
+            small = [operation for operation in operations
+                     if operation.kind == 'create' and self._is_small(operation.entry)]
+            batched = {operation.source for operation in small}
+            try:
+                rest = self._copy_small([(operation.source, operation.target, operation.entry)
+                                         for operation in small]) if small else []
+                batched -= {source_path for source_path, _, _ in rest}
+            except:
+                logging.exception("Could not copy a batch of files!")
+                batched = set()
+            failed = list()
+            for operation in operations:
+                if operation.source in batched:
+                    if self.manifest is not None:
+                        self.manifest.put(operation.source, FileState.from_stat(operation.entry))
+                elif not self._apply_copy(operation):
+                    failed.append(operation.source)
+            return failed or None
+
+        if self._pool is None:
+            update_errors.extend(run() or ())
+        else:
+            self._submit(run)
+
+    def _record_fingerprints(self, plan: Plan, remove_errors: ErrorLog, update_errors: ErrorLog) -> None:
+        """
+        Records fingerprints of planned folders whose operations all succeeded
+
+        :param plan: executed plan
+        :param remove_errors: failed to remove files
+        :param update_errors: failed to copy files
+        """
+        failed = list(remove_errors) + list(update_errors)
+        if len(failed) < len(remove_errors) + len(update_errors):
+            # spilled paths are unknown, so no folder is trusted
+            return
+        for _, future in self._pending:
+            result = future.result()
+            if isinstance(result, list):
+                failed.extend(result)
+            elif result is not None:
+                failed.append(result)
+        replica = os.path.normpath(self.replica.path)
+        failed_dirs = set()
+        for path in failed:
+            folder = os.path.dirname(os.path.normpath(path))
+            # removals fail by replica paths
+            if folder == replica or folder.startswith(replica + os.sep):
+                folder = os.path.join(self.source.path, os.path.relpath(folder, replica))
+            failed_dirs.add(os.path.normpath(folder))
+        for s_dir, fingerprint in plan.fingerprints.items():
+            if os.path.normpath(s_dir) not in failed_dirs:
+                self.manifest.put_folder(s_dir, fingerprint)
+
+    def execute(self, plan: Plan) -> tuple[ErrorLog, ErrorLog]:
+        """
+        Runs planned operations. Folders are created and files are moved first, then files are copied in order
+        of source inodes with small files grouped into batches, obsolete files are removed last
+
+        :param plan: plan found by plan method
+        :returns: a list of failed to remove files and a list of failed to copy files
+        """
+        if self.workers > 1 and self._pool is None:
+            return self._sync_parallel(self.execute, plan)
+        if not self._check_folders():
+            # planned operations are outdated since replica was created again
+            plan = self.plan()
+        if self.journal is not None:
+            # the plan reflects current state of replica, so an interrupted cycle only leaves temporary files to remove
+            if self.journal.begin():
+                logging.info("Resuming interrupted synchronization with a new plan")
+            self._journaling = True
+        remove_errors, update_errors = self._error_log('remove'), self._error_log('update')
+
+        folders = plan.of_kind('mkdir')
+        for operation in folders:
+            try:
+                self._make_folder(operation)
+            except:
+                logging.exception("Could not create a folder!")
+                update_errors.append(operation.source)
+        for operation in plan.of_kind('move'):
+            try:
+                self._rename(operation.origin, operation.target, operation.entry)
+            except:
+                logging.exception("Could not rename a file, it will be copied")
+                if not self._apply_copy(operation._replace(kind='create')):
+                    update_errors.append(operation.source)
+
+        # neighbouring inodes are usually close on the disk
+        copies = sorted(plan.of_kind('create') + plan.of_kind('update'),
+                        key=lambda operation: (operation.entry.st_dev, operation.entry.st_ino))
+        for batch in batches(copies):
+            self._run_batch(batch, update_errors)
+        if self._pool is not None:
+            wait([future for _, future in self._pending])
+
+        for operation in plan.of_kind('delete'):
+            # moved files are not removed
+            if os.path.lexists(operation.target):
+                failed = self._run("Could not remove file", operation.target, self._remove_file, operation.target,
+                                   operation.entry, removal=True)
+                if failed is not None:
+                    remove_errors.append(failed)
+        if self._pool is not None:
+            wait([future for _, future in self._pending])
+        # modification times of new folders are restored after their content is written
+        for operation in reversed(folders):
+            try:
+                shutil.copystat(operation.source, operation.target)
+            except OSError:
+                logging.exception("Could not copy folder metadata")
+        if plan.fingerprints:
+            self._record_fingerprints(plan, remove_errors, update_errors)
 
+        if self._pool is None:
+            self._finish_cycle(remove_errors, update_errors)
         return remove_errors, update_errors
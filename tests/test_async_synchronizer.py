@@ -0,0 +1,124 @@
+import os
+import shutil
+import asyncio
+import pytest
+
+from folder import Folder
+from manifest import Manifest
+import async_synchronizer
+from async_synchronizer import AsyncSynchronizer
+
+
+@pytest.fixture()
+def source():
+    try:
+        os.mkdir("test_source")
+    except:
+        pass
+    return Folder("test_source")
+
+
+@pytest.fixture()
+def replica():
+    try:
+        os.mkdir("test_replica")
+    except:
+        pass
+    return Folder("test_replica")
+
+
+def test_sync_folders(source, replica):
+    for folder in ("a", "b", "b/c"):
+        os.mkdir(source.path + "/" + folder)
+        os.mkdir(replica.path + "/" + folder)
+        with open(source.path + f"/{folder}/new", 'w+') as file:
+            file.write("new file")
+        with open(source.path + f"/{folder}/modified", 'w+') as file:
+            file.write("new line")
+        with open(replica.path + f"/{folder}/modified", 'w+') as file:
+            file.write("old line")
+        with open(replica.path + f"/{folder}/obsolete", 'w+') as file:
+            file.write("obsolete line")
+
+    s = AsyncSynchronizer(source, replica, concurrency=4)
+    errors = asyncio.run(s.sync_folders())
+    status = all(sorted(os.listdir(replica.path + "/" + folder)) == sorted(os.listdir(source.path + "/" + folder))
+                 for folder in ("a", "b", "b/c"))
+    status = status and Folder.compare_files(source.path + "/b/c/modified", replica.path + "/b/c/modified")
+    stats = s.stats
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], [])
+    assert stats.dirs_scanned == 4 and stats.files_copied == 6 and stats.removals == 3
+
+
+def test_sync_folders_errors(source, replica, monkeypatch):
+    for name in ("text1", "text2"):
+        with open(source.path + "/" + name, 'w+') as file:
+            file.write("text line")
+
+    def fail(src, dst, entry=None):
+        raise OSError("copy failed")
+
+    monkeypatch.setattr(replica, "copy_into", fail)
+    s = AsyncSynchronizer(source, replica)
+    remove_errors, update_errors = asyncio.run(s.sync_folders())
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert remove_errors == [] and sorted(update_errors) == [source.path + "/text1", source.path + "/text2"]
+    assert s.stats.errors == 2
+
+
+def test_sync_folders_moved_file(source, replica):
+    os.mkdir(source.path + "/inner")
+    os.mkdir(source.path + "/other")
+    with open(source.path + "/inner/text", 'w+') as file:
+        file.write("text line")
+    m = Manifest("test.manifest")
+    s = AsyncSynchronizer(source, replica, m)
+    asyncio.run(s.sync_folders())
+    asyncio.run(s.sync_folders())
+    inode = os.stat(replica.path + "/inner/text").st_ino
+    os.rename(source.path + "/inner/text", source.path + "/other/text")
+    asyncio.run(s.sync_folders())
+    status = os.listdir(replica.path + "/inner") == [] and os.stat(replica.path + "/other/text").st_ino == inode
+    m.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and s.stats.renames == 1
+
+
+def test_sync_paths(source, replica):
+    with open(source.path + "/text", 'w+') as file:
+        file.write("text line")
+    s = AsyncSynchronizer(source, replica)
+    errors = asyncio.run(s.sync_paths(["text"]))
+    status = os.listdir(replica.path) == ["text"]
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], [])
+
+
+def test_sync_folders_bounds_pending_operations(source, replica, monkeypatch):
+    for folder in ("a", "b"):
+        os.mkdir(source.path + "/" + folder)
+        os.mkdir(replica.path + "/" + folder)
+        for i in range(10):
+            with open(source.path + f"/{folder}/new{i}", 'w+') as file:
+                file.write("new file")
+    monkeypatch.setattr(async_synchronizer, "PENDING_PER_CALL", 1)
+    s = AsyncSynchronizer(source, replica, concurrency=2)
+    pending = list()
+    copy_new = s._copy_new
+
+    def record(*args):
+        pending.append(len(s._tasks))
+        copy_new(*args)
+    s._copy_new = record
+    errors = asyncio.run(s.sync_folders())
+    copied = sorted(os.listdir(replica.path + "/b"))
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert errors == ([], []) and copied == sorted(f"new{i}" for i in range(10))
+    assert len(pending) == 20 and max(pending) <= 2
@@ -0,0 +1,116 @@
+import os
+import gzip
+import shutil
+import pytest
+
+import compressed
+from compressed import CompressedFolder, sidecar_path, read_sidecar
+from folder import Folder
+from synchronizer import Synchronizer
+from digest import Comparator
+from filters import Filter
+
+
+@pytest.fixture()
+def folders():
+    for path in ("test_source", "test_replica"):
+        shutil.rmtree(path, ignore_errors=True)
+        os.mkdir(path)
+    yield Folder("test_source"), CompressedFolder("test_replica", min_size=1000, workers=2)
+    shutil.rmtree("test_source")
+    shutil.rmtree("test_replica")
+
+
+def test_copy_into_compresses_by_blocks(folders, monkeypatch):
+    source, replica = folders
+    monkeypatch.setattr(compressed, 'BLOCK_SIZE', 1000)
+    data = b"text line\n" * 1000
+    with open("test_source/big", 'wb') as file:
+        file.write(data)
+    written = replica.copy_into("test_source/big", "test_replica/big")
+    with open("test_replica/big", 'rb') as file:
+        stored = file.read()
+    original = read_sidecar(sidecar_path("test_replica/big"))
+    replica.close()
+    assert written == len(stored) < len(data) and gzip.decompress(stored) == data
+    assert original.size == len(data) and original.mtime_ns == os.stat("test_source/big").st_mtime_ns
+
+
+def test_small_and_skipped_files_are_stored_as_is(folders):
+    source, replica = folders
+    for name, size in (("small", 10), ("image.JPG", 5000)):
+        with open("test_source/" + name, 'wb') as file:
+            file.write(b"x" * size)
+        replica.copy_into("test_source/" + name, "test_replica/" + name)
+    replica.close()
+    assert sorted(os.listdir("test_replica")) == ["image.JPG", "small"]
+
+
+def test_scan_hides_sidecars(folders):
+    source, replica = folders
+    os.mkdir("test_source/inner")
+    with open("test_source/inner/big", 'w+') as file:
+        file.write("text line" * 1000)
+    replica.copy_into("test_source/inner", "test_replica/inner")
+    entries = replica.scan_sorted("test_replica/inner")
+    replica.close()
+    assert [entry.name for entry in entries] == ["big"] and entries[0].st_size == 9000
+    assert os.path.exists(sidecar_path("test_replica/inner/big"))
+
+
+def test_sync_folders_compares_stored_digests(folders, monkeypatch):
+    source, replica = folders
+    with open("test_source/big", 'w+') as file:
+        file.write("text line" * 1000)
+    with open("test_source/small", 'w+') as file:
+        file.write("text line")
+    s = Synchronizer(source, replica)
+    s.sync_folders()
+    compared = list()
+    monkeypatch.setattr(Comparator, 'same', lambda self, *args: compared.append(args) or True)
+    s.sync_folders()
+    with open("test_source/big", 'w+') as file:
+        file.write("text lime" * 1000)
+    s.sync_folders()
+    with open("test_replica/big", 'rb') as file:
+        restored = gzip.decompress(file.read())
+    os.rename("test_source/big", "test_source/renamed")
+    s.sync_folders()
+    names = sorted(os.listdir("test_replica"))
+    replica.close()
+    # only the small file is compared by content
+    assert [args[0] for args in compared] == ["test_source/small"] * 3
+    assert restored == b"text lime" * 1000
+    assert names == [".renamed.sync-meta", "renamed", "small"]
+
+
+def test_remove_drops_sidecar(folders):
+    source, replica = folders
+    with open("test_source/big", 'w+') as file:
+        file.write("text line" * 1000)
+    replica.copy_into("test_source/big", "test_replica/big")
+    replica.remove("test_replica/big")
+    replica.close()
+    assert os.listdir("test_replica") == []
+
+
+def test_scan_removes_orphan_sidecars(folders):
+    source, replica = folders
+    os.mkdir("test_replica/inner")
+    os.mkdir("test_replica/folder")
+    for path in ("test_replica/inner/gone", "test_replica/folder", "test_replica/kept.log"):
+        with open(sidecar_path(path), 'w+') as file:
+            file.write("{}")
+    filtered = CompressedFolder("test_replica", filters=Filter(["*.log"]))
+    entries = filtered.scan("test_replica")
+    filtered.remove("test_replica/inner", entries["inner"])
+    listed = sorted(os.listdir("test_replica"))
+    filtered.close()
+    replica.close()
+    # sidecars of excluded files are kept
+    assert sorted(entries) == ["folder", "inner"] and listed == [".kept.log.sync-meta", "folder"]
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        CompressedFolder(".", codec='lzma')
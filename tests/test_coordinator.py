@@ -0,0 +1,100 @@
+import os
+import pickle
+import shutil
+import pytest
+
+from folder import Folder
+from stats import SyncStats
+from coordinator import Coordinator, ShardOptions, sync_shard
+
+
+@pytest.fixture()
+def source():
+    try:
+        os.mkdir("test_source")
+    except:
+        pass
+    return Folder("test_source")
+
+
+@pytest.fixture()
+def replica():
+    try:
+        os.mkdir("test_replica")
+    except:
+        pass
+    return Folder("test_replica")
+
+
+def test_sync_folders(source, replica):
+    for folder in ("a", "b", "c/d"):
+        os.makedirs(source.path + "/" + folder)
+        with open(source.path + f"/{folder}/new", 'w+') as file:
+            file.write("new file")
+    with open(source.path + "/text", 'w+') as file:
+        file.write("text line")
+    os.mkdir(replica.path + "/obsolete")
+    with open(replica.path + "/b", 'w+') as file:
+        file.write("not a folder")
+
+    coordinator = Coordinator(source, replica, 2, ShardOptions(error_limit=10))
+    try:
+        errors = coordinator.sync_folders()
+        status = all(Folder.compare_files(source.path + path, replica.path + path)
+                     for path in ("/a/new", "/b/new", "/c/d/new", "/text"))
+        listed = sorted(os.listdir(replica.path))
+        stats = coordinator.stats
+        costs = sorted(coordinator.costs)
+    finally:
+        coordinator.close()
+        shutil.rmtree(source.path)
+        shutil.rmtree(replica.path)
+    assert status and errors == ([], []) and listed == ["a", "b", "c", "text"]
+    # the obsolete folder is removed by coordinator and the replaced file by a shard
+    assert stats.removals == 2 and stats.files_copied == 4 and costs == ["a", "b", "c", "text"]
+
+
+def test_shards_balanced_and_split(source, replica):
+    os.makedirs(source.path + "/big/inner")
+    coordinator = Coordinator(source, replica, 2)
+    coordinator.costs = {"a": 1.0, "b": 2.0, "c": 3.0}
+    shards = coordinator._shards(["a", "b", "c", "d"])
+    coordinator._rebalance({"big": 10.0, "small": 1.0})
+    split = set(coordinator.split)
+    coordinator._rebalance({"big/inner": 0.1, "small": 1.0})
+    merged = set(coordinator.split)
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    # unknown unit is expected to take the mean time
+    assert shards == [["c", "a"], ["b", "d"]]
+    assert split == {"big"} and merged == set()
+
+
+def test_sync_shard_spills_to_error_file(source, replica, monkeypatch):
+    for name in ("a", "b"):
+        with open(source.path + "/" + name, 'w+') as file:
+            file.write("text line")
+
+    def failing_copy(*args, **kwargs):
+        raise OSError("copy failed")
+    monkeypatch.setattr(Folder, "copy_into", failing_copy)
+    open("test_file", 'w').close()
+    remove_errors, update_errors, _, _ = sync_shard(source.path, replica.path, ["a", "b"],
+                                                    ShardOptions(error_limit=0, error_file="test_file"))
+    with open("test_file") as file:
+        spilled = sorted(file.read().splitlines())
+    leftovers = [name for name in os.listdir() if name.startswith("test_file.")]
+    os.remove("test_file")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    # paths over the limit of every path's logs are kept by the shared error file
+    assert len(remove_errors) == 0 and len(update_errors) == 2 and leftovers == []
+    assert spilled == [f"update\t{source.path}/a", f"update\t{source.path}/b"]
+
+
+def test_sync_stats_merge_pickled():
+    stats, other = SyncStats(), SyncStats()
+    other.add('files_copied', 2)
+    other.change('inner')
+    stats.merge(pickle.loads(pickle.dumps(other)))
+    assert stats.files_copied == 2 and stats.changed_folders['inner'] == 1
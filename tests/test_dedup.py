@@ -0,0 +1,49 @@
+import os
+import pytest
+
+from dedup import DedupIndex
+
+
+def test_find_checks_files():
+    index = DedupIndex("test.manifest")
+    with open("test_file", 'w+') as file:
+        file.write("text line")
+    st = os.stat("test_file")
+    index.add("test_file", "digest", st.st_size, st.st_mtime_ns)
+    index.add("test_file1", "digest", st.st_size, st.st_mtime_ns)
+    found = index.find("digest")
+    missing = index.find("other")
+    os.utime("test_file", ns=(10 ** 18, 10 ** 18))
+    changed = index.find("digest")
+    index.close()
+    os.remove("test_file")
+    os.remove("test.manifest")
+    assert found[0] == "test_file" and missing is None and changed is None
+
+
+def test_collect_garbage_and_discard():
+    index = DedupIndex("test.manifest")
+    os.mkdir("test_folder")
+    for name in ("a", "b"):
+        with open("test_folder/" + name, 'w+') as file:
+            file.write("text line")
+        st = os.stat("test_folder/" + name)
+        index.add("test_folder/" + name, name, st.st_size, st.st_mtime_ns)
+    index.add("test_folder/missing", "missing", 1, 1)
+    dropped = index.collect_garbage()
+    index.move("test_folder", "test_folder1")
+    os.rename("test_folder", "test_folder1")
+    moved = index.find("a")
+    index.discard("test_folder1")
+    discarded = index.find("b")
+    index.close()
+    for name in ("a", "b"):
+        os.remove("test_folder1/" + name)
+    os.rmdir("test_folder1")
+    os.remove("test.manifest")
+    assert dropped == 1 and moved[0] == "test_folder1/a" and discarded is None
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        DedupIndex("test.manifest", mode='copy')
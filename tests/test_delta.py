@@ -0,0 +1,42 @@
+import os
+
+from delta import delta_copy
+
+
+def test_delta_copy_changed_block():
+    with open("test_file", 'wb') as file:
+        file.write(b"a" * 40)
+    with open("test_file1", 'wb') as file:
+        file.write(b"a" * 20 + b"b" + b"a" * 19)
+    written = delta_copy("test_file", "test_file1", block_size=10)
+    with open("test_file1", 'rb') as file:
+        content = file.read()
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert content == b"a" * 40 and written == 10
+
+
+def test_delta_copy_truncated():
+    with open("test_file", 'wb') as file:
+        file.write(b"a" * 15)
+    with open("test_file1", 'wb') as file:
+        file.write(b"a" * 40)
+    written = delta_copy("test_file", "test_file1", block_size=10)
+    with open("test_file1", 'rb') as file:
+        content = file.read()
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert content == b"a" * 15 and written == 0
+
+
+def test_delta_copy_extended():
+    with open("test_file", 'wb') as file:
+        file.write(b"a" * 25)
+    with open("test_file1", 'wb') as file:
+        file.write(b"a" * 10)
+    written = delta_copy("test_file", "test_file1", block_size=10)
+    with open("test_file1", 'rb') as file:
+        content = file.read()
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert content == b"a" * 25 and written == 15
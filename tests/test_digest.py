@@ -0,0 +1,128 @@
+import os
+import shutil
+import hashlib
+import pytest
+
+import digest
+from digest import DigestStore, DigestComparator, SampledComparator, SamplePolicy, file_digest
+from folder import Folder
+
+
+def test_file_digest_chunks():
+    data = os.urandom(100 * 1024 + 100)
+    with open("test_file", 'wb') as file:
+        file.write(data)
+    regular = file_digest("test_file")
+    chunked = file_digest("test_file", chunk_size=4096)
+    os.remove("test_file")
+    assert regular == chunked == hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def test_digest_store_lru():
+    store = DigestStore(capacity=2)
+    stats = [os.stat_result((0, i, 0, 0, 0, 0, 1, 0, 0, 0)) for i in range(3)]
+    store.put(stats[0], "a")
+    store.put(stats[1], "b")
+    store.get(stats[0])
+    store.put(stats[2], "c")
+    assert store.get(stats[0]) == "a" and store.get(stats[1]) is None and store.get(stats[2]) == "c"
+
+
+def test_digest_store_persists():
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    store = DigestStore("test.digests")
+    value = store.digest("test_file")
+    store.save()
+    reopened = DigestStore("test.digests")
+    status = reopened.get(os.stat("test_file")) == value
+    os.remove("test_file")
+    os.remove("test.digests")
+    assert status
+
+
+def test_digest_comparator_skips_copied(monkeypatch):
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    comparator = DigestComparator(DigestStore())
+    comparator.store.digest("test_file")
+    shutil.copy2("test_file", "test_file1")
+    comparator.copied("test_file", "test_file1")
+
+    def fail(*args):
+        raise AssertionError("file is read again")
+    monkeypatch.setattr(digest, "file_digest", fail)
+    status = comparator.same("test_file", "test_file1")
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status
+
+
+def test_digest_comparator_differs():
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    with open("test_file1", 'w+') as file:
+        file.write("old line")
+    status = not DigestComparator(DigestStore()).same("test_file", "test_file1")
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status
+
+
+def write_pair(middle: bytes) -> None:
+    data = b"x" * 100000
+    with open("test_file", 'wb') as file:
+        file.write(data)
+    with open("test_file1", 'wb') as file:
+        file.write(data[:50000] + middle + data[50000 + len(middle):])
+    os.utime("test_file1", ns=(os.stat("test_file").st_atime_ns, os.stat("test_file").st_mtime_ns))
+
+
+def test_sampled_comparator_detects_by_samples(monkeypatch):
+    write_pair(b"x")
+    with open("test_file1", 'r+b') as file:
+        file.write(b"y")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("file is read entirely")
+    monkeypatch.setattr(Folder, "_compare_contents", fail)
+    comparator = SampledComparator(threshold=1000, samples=2, full_every=None, block_size=100)
+    status = comparator.same("test_file", "test_file1")
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert not status and comparator.bytes_read == 200
+
+
+def test_sampled_comparator_full_every():
+    write_pair(b"y")
+    comparator = SampledComparator(threshold=1000, samples=0, full_every=2, block_size=100)
+    statuses = [comparator.same("test_file", "test_file1") for _ in range(2)]
+    never = SampledComparator(threshold=1000, samples=0, full_every=None, block_size=100,
+                              policies=[SamplePolicy.parse("*_file=0/1")])
+    status = never.same("test_file", "test_file1")
+    os.utime("test_file1", ns=(0, 0))
+    modified = SampledComparator(threshold=1000, samples=0, full_every=None, block_size=100)
+    modified_status = modified.same("test_file", "test_file1")
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert sorted(statuses) == [False, True] and comparator.full_comparisons == 1
+    assert not status and not modified_status
+
+
+def test_sample_policy_parse():
+    assert SamplePolicy.parse("*.vmdk=16/7") == SamplePolicy("*.vmdk", 16, 7)
+    assert SamplePolicy.parse("data/*=4") == SamplePolicy("data/*", 4, None)
+    with pytest.raises(ValueError):
+        SamplePolicy.parse("=4/2")
+
+
+def test_sampled_comparator_flush_drops_removed():
+    write_pair(b"x")
+    comparator = SampledComparator(threshold=1000, samples=0, full_every=3, block_size=100)
+    comparator.same("test_file", "test_file1")
+    comparator.flush()
+    kept = list(comparator._cycles)
+    os.remove("test_file")
+    os.remove("test_file1")
+    comparator.flush()
+    assert kept == ["test_file"] and comparator._cycles == {}
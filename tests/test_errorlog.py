@@ -0,0 +1,31 @@
+import os
+
+from errorlog import ErrorLog
+
+
+def test_error_log_within_limit():
+    errors = ErrorLog('update', limit=3)
+    errors.extend(["a", "b"])
+    assert len(errors) == 2 and "a" in errors and list(errors) == ["a", "b"]
+    assert errors == ["a", "b"] and repr(errors) == "['a', 'b']"
+
+
+def test_error_log_over_limit():
+    errors = ErrorLog('update', limit=2)
+    errors.extend(["a", "b", "c", "d"])
+    assert len(errors) == 4 and list(errors) == ["a", "b"] and "c" not in errors
+    assert errors != ["a", "b"] and repr(errors) == "['a', 'b'] and 2 more"
+
+
+def test_error_log_spill():
+    errors = ErrorLog('remove', limit=1, spill_path="test_file")
+    errors.append("a")
+    other = ErrorLog('remove', limit=1, spill_path="test_file")
+    other.extend(["b", "c"])
+    errors.extend(other)
+    errors.close()
+    with open("test_file", encoding='utf-8') as file:
+        lines = file.read().splitlines()
+    os.remove("test_file")
+    assert len(errors) == 3 and list(errors) == ["a"]
+    assert lines == ["remove\tc", "remove\tb"]
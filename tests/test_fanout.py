@@ -0,0 +1,133 @@
+import os
+import shutil
+import pytest
+
+import fanout
+from folder import Folder
+from digest import Comparator, DEFAULT_ALGORITHM
+from fanout import FanOutSynchronizer
+
+
+@pytest.fixture()
+def source():
+    try:
+        os.mkdir("test_source")
+    except:
+        pass
+    return Folder("test_source")
+
+
+@pytest.fixture()
+def replicas():
+    folders = list()
+    for path in ("test_replica", "test_replica1"):
+        try:
+            os.mkdir(path)
+        except:
+            pass
+        folders.append(Folder(path))
+    return folders
+
+
+def cleanup(source, replicas):
+    for folder in (source, *replicas):
+        shutil.rmtree(folder.path)
+
+
+def test_sync_folders(source, replicas, monkeypatch):
+    os.makedirs(source.path + "/a/b")
+    for folder in ("", "/a", "/a/b"):
+        with open(source.path + folder + "/new", 'w+') as file:
+            file.write("new file" * 1000)
+    with open(source.path + "/modified", 'w+') as file:
+        file.write("new line")
+    with open(replicas[0].path + "/modified", 'w+') as file:
+        file.write("old line")
+    with open(replicas[1].path + "/modified", 'w+') as file:
+        file.write("new line")
+    with open(replicas[1].path + "/obsolete", 'w+') as file:
+        file.write("obsolete line")
+    # the second replica has a file where source has a folder
+    with open(replicas[1].path + "/a", 'w+') as file:
+        file.write("not a folder")
+    monkeypatch.setattr(fanout, "CHUNK_SIZE", 1000)
+    opened = list()
+    real_open = open
+
+    def tracking_open(path, mode='r', *args, **kwargs):
+        if mode == 'rb':
+            opened.append(path)
+        return real_open(path, mode, *args, **kwargs)
+    monkeypatch.setattr(fanout, "open", tracking_open, raising=False)
+
+    s = FanOutSynchronizer(source, replicas, buffer_chunks=2)
+    errors = s.sync_folders()
+    status = all(Folder.compare_files(source.path + path, replica.path + path)
+                 for path in ("/new", "/modified", "/a/new", "/a/b/new") for replica in replicas)
+    listed = [sorted(os.listdir(replica.path)) for replica in replicas]
+    stats = s.stats
+    cleanup(source, replicas)
+    assert status and errors == ([], []) and listed == [["a", "modified", "new"]] * 2
+    # every copied file is read once for all replicas
+    assert sorted(opened) == sorted(source.path + path for path in ("/new", "/modified", "/a/new", "/a/b/new"))
+    assert stats.dirs_scanned == 3 and stats.files_copied == 7 and stats.removals == 2
+
+
+def test_sync_folders_replica_errors(source, replicas, monkeypatch):
+    for name in ("text1", "text2"):
+        with open(source.path + "/" + name, 'w+') as file:
+            file.write("text line")
+    real_open = open
+
+    def failing_open(path, mode='r', *args, **kwargs):
+        if mode == 'wb' and path.startswith(replicas[0].path + os.sep):
+            raise OSError("disk is full")
+        return real_open(path, mode, *args, **kwargs)
+    monkeypatch.setattr(fanout, "open", failing_open, raising=False)
+
+    s = FanOutSynchronizer(source, replicas)
+    remove_errors, update_errors = s.sync_folders()
+    first, second = s.errors[replicas[0].path], s.errors[replicas[1].path]
+    listed = [sorted(os.listdir(replica.path)) for replica in replicas]
+    cleanup(source, replicas)
+    assert remove_errors == [] and len(update_errors) == 2
+    assert len(first[1]) == 2 and second == ([], [])
+    assert listed == [[], ["text1", "text2"]]
+
+
+def test_sync_paths(source, replicas):
+    os.mkdir(source.path + "/inner")
+    with open(source.path + "/inner/text", 'w+') as file:
+        file.write("text line")
+    with open(replicas[0].path + "/removed", 'w+') as file:
+        file.write("removed line")
+
+    s = FanOutSynchronizer(source, replicas)
+    errors = s.sync_paths(["inner/text", "removed"])
+    status = all(Folder.compare_files(source.path + "/inner/text", replica.path + "/inner/text")
+                 for replica in replicas)
+    removed = os.path.exists(replicas[0].path + "/removed")
+    cleanup(source, replicas)
+    assert status and not removed and errors == ([], [])
+
+
+def test_sync_folders_digests_source_once(source, replicas):
+    with open(source.path + "/same", 'w+') as file:
+        file.write("same line")
+    for replica, line in zip(replicas, ("same line", "sane line")):
+        with open(replica.path + "/same", 'w+') as file:
+            file.write(line)
+    digested = list()
+
+    class TrackingComparator(Comparator):
+        def digest(self, file_path, st=None, algorithm=DEFAULT_ALGORITHM):
+            digested.append(file_path)
+            return super().digest(file_path, st, algorithm)
+
+    s = FanOutSynchronizer(source, replicas, TrackingComparator())
+    errors = s.sync_folders()
+    status = all(Folder.compare_files(source.path + "/same", replica.path + "/same") for replica in replicas)
+    cleanup(source, replicas)
+    assert status and errors == ([], [])
+    # every replica is compared with the digest of source file found once
+    assert sorted(digested) == sorted(path + "/same" for path in ("test_source", "test_replica", "test_replica1"))
@@ -0,0 +1,92 @@
+import os
+import errno
+
+import fastcopy
+from folder import Folder
+
+
+def test_copy_file_content():
+    with open("test_file", 'wb') as file:
+        file.write(os.urandom(3 * 1024 + 7))
+    strategy = fastcopy.copy_file("test_file", "test_file1")
+    status = Folder.compare_files("test_file", "test_file1")
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status and strategy in fastcopy.STRATEGIES
+
+
+def test_copy_file_fallback(monkeypatch):
+    def unsupported(src_fd, dst_fd, size, throttle=None):
+        raise OSError(errno.EXDEV, "cross-device link")
+    for strategy in ('reflink', 'copy_file_range', 'sendfile'):
+        monkeypatch.setitem(fastcopy._COPIERS, strategy, unsupported)
+    monkeypatch.setattr(fastcopy, "_strategies", dict())
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    strategy = fastcopy.copy_file("test_file", "test_file1")
+    status = Folder.compare_files("test_file", "test_file1")
+    devices = (os.stat("test_file").st_dev, os.stat("test_file1").st_dev)
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status and strategy == 'buffered' and fastcopy._strategies[devices] == 'buffered'
+
+
+def test_copy_file_fallback_after_partial_copy(monkeypatch):
+    def partial(src_fd, dst_fd, size, throttle=None):
+        os.write(dst_fd, b"partial")
+        raise OSError(errno.EINVAL, "invalid argument")
+    for strategy in ('reflink', 'copy_file_range', 'sendfile'):
+        monkeypatch.setitem(fastcopy._COPIERS, strategy, partial)
+    monkeypatch.setattr(fastcopy, "_strategies", dict())
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    fastcopy.copy_file("test_file", "test_file1")
+    status = Folder.compare_files("test_file", "test_file1")
+    size = os.path.getsize("test_file1")
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status and size == len("new line")
+
+
+def test_copy2_metadata():
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    os.utime("test_file", ns=(10 ** 18, 10 ** 18))
+    fastcopy.copy2("test_file", "test_file1")
+    status = os.stat("test_file1").st_mtime_ns == 10 ** 18
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status
+
+
+def test_copy2_symlink():
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    os.symlink("test_file", "test_link")
+    fastcopy.copy2("test_link", "test_link1", follow_symlinks=False)
+    status = os.path.islink("test_link1") and os.readlink("test_link1") == "test_file"
+    for path in ("test_file", "test_link", "test_link1"):
+        os.remove(path)
+    assert status
+
+
+def test_copy_small_metadata():
+    with open("test_file", 'wb') as file:
+        file.write(os.urandom(100))
+    os.chmod("test_file", 0o640)
+    os.utime("test_file", ns=(10 ** 18, 10 ** 18))
+    st = os.stat("test_file")
+    buffer = bytearray(101)
+    copied = fastcopy.copy_small("test_file", "test_file1", st.st_mode, st.st_mtime_ns, buffer)
+    copy_st = os.stat("test_file1")
+    status = Folder.compare_files("test_file", "test_file1")
+    try:
+        # the file does not fit the buffer
+        fastcopy.copy_small("test_file", "test_file1", st.st_mode, st.st_mtime_ns, bytearray(100))
+        too_big = False
+    except OSError:
+        too_big = True
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status and copied == 100 and too_big
+    assert copy_st.st_mtime_ns == 10 ** 18 and copy_st.st_mode & 0o777 == 0o640
@@ -0,0 +1,50 @@
+import os
+
+from filters import Filter, parse_rule, read_rules
+
+
+def test_unanchored_and_anchored_rules():
+    rules = Filter(["*.tmp", "/build", "docs/*.html", "# comment", ""])
+    assert len(rules.rules) == 3
+    assert rules.matches("a.tmp", False) and rules.matches("x/y/a.tmp", False)
+    assert rules.matches("build", True) and not rules.matches("src/build", True)
+    assert rules.matches("docs/index.html", False) and not rules.matches("docs/api/index.html", False)
+
+
+def test_double_star_and_classes():
+    rules = Filter(["**/cache/**", "logs/**/*.log", "file[0-9]", "name[!a]"])
+    assert rules.matches("cache/x", False) and rules.matches("a/cache/b/c", False) and not rules.matches("cache", True)
+    assert rules.matches("logs/a.log", False) and rules.matches("logs/a/b/c.log", False)
+    assert rules.matches("file1", False) and not rules.matches("filex", False)
+    assert rules.matches("nameb", False) and not rules.matches("namea", False)
+
+
+def test_last_rule_wins():
+    rules = Filter(["*.log", "!keep.log", "!old/*.log", "old/drop.log"])
+    assert rules.matches("a.log", False) and not rules.matches("keep.log", False)
+    assert not rules.matches("old/a.log", False) and rules.matches("old/drop.log", False)
+
+
+def test_folders_only_and_parents():
+    rules = Filter([".git/", "!.git/keep"])
+    assert rules.matches(".git", True) and not rules.matches(".git", False)
+    # a file inside excluded folder can't be included again
+    assert rules.excluded(os.path.join(".git", "keep"), False) and not rules.excluded(".", True)
+
+
+def test_parse_rule_escapes():
+    assert parse_rule("\\#name").regex.endswith("\\#name") and not parse_rule("\\!name").negated
+    assert parse_rule("!name").negated and parse_rule("name/").dir_only
+
+
+def test_read_rules():
+    with open("test_file", 'w+') as file:
+        file.write("*.tmp\n!keep.tmp\n")
+    rules = read_rules("test_file")
+    os.remove("test_file")
+    assert rules == ["*.tmp", "!keep.tmp"]
+
+
+def test_empty_filter():
+    rules = Filter([])
+    assert not rules and not rules.matches("a", False)
@@ -1,8 +1,12 @@
 import os
+import errno
 import shutil
 import pytest
 
-from folder import Folder
+import folder
+import fastcopy
+from folder import Folder, merge_entries
+from filters import Filter
 
 
 def test_folder_creation_exist():
@@ -237,3 +241,253 @@ def test_copy_outside():
         shutil.rmtree("test_folder")
         shutil.rmtree("test_folder1")
         assert True
+
+
+def test_scan_entries():
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    os.mkdir("test_folder/inner")
+    with open("test_folder/text", 'w+') as file:
+        file.write("line of text")
+
+    entries = Folder("test_folder").scan("test_folder")
+    shutil.rmtree("test_folder")
+    assert entries.keys() == {"inner", "text"}
+    assert entries["inner"].is_dir and not entries["text"].is_dir
+    assert entries["text"].is_file() and entries["text"].st_size == len("line of text")
+
+
+def test_copy_into_failed_leaves_no_temp(monkeypatch):
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+
+    def fail(src, dst, follow_symlinks=True, throttle=None):
+        with open(dst, 'w') as file:
+            file.write("partial")
+        raise OSError("copy failed")
+
+    monkeypatch.setattr(fastcopy, "copy2", fail)
+    f = Folder("test_folder")
+    try:
+        f.copy_into("test_file", "test_folder/test_file")
+        status = False
+    except OSError:
+        status = os.listdir("test_folder") == []
+    shutil.rmtree("test_folder")
+    os.remove("test_file")
+    assert status
+
+
+def test_scan_sorted_merge():
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    os.mkdir("test_folder1")
+    for name in ("c", "a", "b"):
+        open("test_folder/" + name, 'w').close()
+    for name in ("d", "b"):
+        open("test_folder1/" + name, 'w').close()
+
+    entries1 = Folder("test_folder").scan_sorted("test_folder")
+    entries2 = Folder("test_folder1").scan_sorted("test_folder1")
+    merged = [(entry1.name if entry1 else None, entry2.name if entry2 else None)
+              for entry1, entry2 in merge_entries(entries1, entries2)]
+    shutil.rmtree("test_folder")
+    shutil.rmtree("test_folder1")
+    assert [entry.name for entry in entries1] == ["a", "b", "c"]
+    assert merged == [("a", None), ("b", "b"), ("c", None), (None, "d")]
+
+
+def test_compare_files_with_entries():
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    with open("test_folder/text", 'w+') as file:
+        file.write("line of text")
+    with open("test_folder/text1", 'w+') as file:
+        file.write("line of test")
+    shutil.copy("test_folder/text", "test_folder/copy")
+
+    entries = Folder("test_folder").scan("test_folder")
+    same = Folder.compare_files("test_folder/text", "test_folder/copy", entry1=entries["text"], entry2=entries["copy"])
+    differ = Folder.compare_files("test_folder/text", "test_folder/text1",
+                                  entry1=entries["text"], entry2=entries["text1"])
+    shutil.rmtree("test_folder")
+    assert same and not differ
+
+
+def test_remove_absolute_path():
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    with open("test_folder/test_file", 'w+') as file:
+        file.write("new line")
+
+    f = Folder(os.path.abspath("test_folder"))
+    f.remove(os.path.abspath("test_folder/test_file"))
+    status = "test_file" not in os.listdir("test_folder")
+    shutil.rmtree("test_folder")
+    assert status
+
+
+def test_copy_into_delta(monkeypatch):
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    with open("test_file", 'w+') as file:
+        file.write("line of text" * 100)
+    with open("test_folder/test_file", 'w+') as file:
+        file.write("line of test" + "line of text" * 99)
+    f = Folder("test_folder", delta_threshold=100, block_size=64)
+    inode = os.stat("test_folder/test_file").st_ino
+    monkeypatch.setattr(fastcopy, 'reflink', fail_reflink)
+    written = f.copy_into("test_file", "test_folder/test_file")
+    status = Folder.compare_files("test_file", "test_folder/test_file")
+    # without reflinks the file is updated in place
+    status = status and os.stat("test_folder/test_file").st_ino == inode
+    listed = os.listdir("test_folder")
+    os.remove("test_file")
+    shutil.rmtree("test_folder")
+    assert status and written == 64 and listed == ["test_file"]
+
+
+def fail_reflink(src, dst):
+    raise OSError(errno.EOPNOTSUPP, "reflinks are not supported")
+
+
+def test_copy_into_delta_interrupted(monkeypatch):
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    with open("test_file", 'w+') as file:
+        file.write("line of text" * 100)
+    with open("test_folder/test_file", 'w+') as file:
+        file.write("line of test" * 100)
+
+    def interrupted(src, dst, block_size, throttle):
+        with open(dst, 'r+') as file:
+            file.write("partial")
+        raise OSError("interrupted")
+    monkeypatch.setattr(folder, 'delta_copy', interrupted)
+    # a reflink is simulated by a copy
+    monkeypatch.setattr(fastcopy, 'reflink', shutil.copyfile)
+    f = Folder("test_folder", delta_threshold=100, block_size=64)
+    try:
+        f.copy_into("test_file", "test_folder/test_file")
+    except OSError:
+        pass
+    with open("test_folder/test_file") as file:
+        content = file.read()
+    listed = os.listdir("test_folder")
+    os.remove("test_file")
+    shutil.rmtree("test_folder")
+    assert content == "line of test" * 100 and listed == ["test_file"]
+
+
+def test_copy_small_files():
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    os.mkdir("test_folder1")
+    for name in ("a", "b"):
+        with open("test_folder1/" + name, 'w+') as file:
+            file.write("text of " + name)
+    os.symlink("a", "test_folder1/link")
+    # a folder can't be replaced by a file in the batch
+    os.mkdir("test_folder/b")
+
+    f = Folder("test_folder")
+    files = [(f"test_folder1/{name}", f"test_folder/{name}", Folder("test_folder1").scan("test_folder1")[name])
+             for name in ("a", "b", "link")]
+    written, rest = f.copy_small_files(files, bytearray(1024))
+    status = Folder.compare_files("test_folder1/a", "test_folder/a")
+    listed = sorted(os.listdir("test_folder"))
+    shutil.rmtree("test_folder")
+    shutil.rmtree("test_folder1")
+    assert status and written == len("text of a") and listed == ["a", "b"]
+    assert sorted(src for src, _, _ in rest) == ["test_folder1/b", "test_folder1/link"]
+
+
+def test_copy_into_delta_skips_hardlinks():
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    with open("test_file", 'w+') as file:
+        file.write("line of text" * 100)
+    with open("test_folder/test_file", 'w+') as file:
+        file.write("line of test" * 100)
+    os.link("test_folder/test_file", "test_folder/test_link")
+    f = Folder("test_folder", delta_threshold=100, block_size=64)
+    f.copy_into("test_file", "test_folder/test_file")
+    status = Folder.compare_files("test_file", "test_folder/test_file")
+    with open("test_folder/test_link") as file:
+        linked = file.read()
+    os.remove("test_file")
+    shutil.rmtree("test_folder")
+    assert status and linked == "line of test" * 100
+
+
+def make_tree(path: str) -> None:
+    for folder in ("", "/inner", "/inner/build", "/.git"):
+        os.makedirs(path + folder, exist_ok=True)
+    for name in ("/a", "/a.tmp", "/inner/b", "/inner/keep.tmp", "/inner/build/c", "/.git/d"):
+        with open(path + name, 'w+') as file:
+            file.write("text line")
+
+
+def test_scan_skips_excluded():
+    shutil.rmtree("test_folder", ignore_errors=True)
+    make_tree("test_folder")
+    folder = Folder("test_folder", filters=Filter(["*.tmp", "!keep.tmp", "build/", ".git"]))
+    names = sorted(folder.scan("test_folder"))
+    inner = [entry.name for entry in folder.scan_sorted("test_folder/inner")]
+    excluded = folder.excluded("test_folder/inner/build/c")
+    shutil.rmtree("test_folder")
+    assert names == ["a", "inner"] and inner == ["b", "keep.tmp"] and excluded
+
+
+def test_remove_folder_keeps_excluded():
+    shutil.rmtree("test_folder", ignore_errors=True)
+    make_tree("test_folder")
+    folder = Folder("test_folder", filters=Filter(["build/"]))
+    folder.remove("test_folder/inner")
+    kept = sorted(os.listdir("test_folder/inner"))
+    folder.remove("test_folder/.git")
+    removed = not os.path.exists("test_folder/.git")
+    shutil.rmtree("test_folder")
+    assert kept == ["build"] and removed
+
+
+def test_copy_into_folder_skips_excluded():
+    for path in ("test_folder", "test_replica"):
+        shutil.rmtree(path, ignore_errors=True)
+    make_tree("test_folder")
+    os.mkdir("test_replica")
+    replica = Folder("test_replica", filters=Filter(["/inner/build", "*.tmp"]))
+    replica.copy_into("test_folder/inner", "test_replica/inner")
+    copied = sorted(os.listdir("test_replica/inner"))
+    shutil.rmtree("test_folder")
+    shutil.rmtree("test_replica")
+    assert copied == ["b"]
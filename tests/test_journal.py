@@ -0,0 +1,66 @@
+import os
+import pytest
+
+from journal import Journal
+from compressed import sidecar_path
+
+
+@pytest.fixture()
+def journal():
+    j = Journal("test.journal")
+    yield j
+    j.close()
+    os.remove("test.journal")
+
+
+def test_journal_new_cycle(journal):
+    assert not journal.begin()
+    journal.finish_folder("test_source")
+    journal.end()
+    journal.close()
+    j = Journal("test.journal")
+    resumed = j.begin()
+    j.close()
+    assert not resumed and not j.is_finished("test_source")
+
+
+def test_journal_resume(journal):
+    journal.begin()
+    journal.finish_folder("test_source")
+    journal.close()
+    j = Journal("test.journal")
+    resumed = j.begin()
+    j.finish_folder("test_source/inner")
+    j.close()
+    j = Journal("test.journal")
+    assert resumed and j.begin()
+    assert j.is_finished("test_source") and j.is_finished("test_source/inner")
+    j.close()
+
+
+def test_journal_cleanup(journal):
+    journal.begin()
+    with open("test_file", 'w+') as file:
+        file.write("partial line")
+    with open(sidecar_path("test_file"), 'w+') as file:
+        file.write("{}")
+    journal.planned("test_file")
+    journal.planned("test_folder")
+    journal.copied("test_folder")
+    journal.close()
+    j = Journal("test.journal")
+    j.begin()
+    j.close()
+    assert not os.path.exists("test_file") and not os.path.exists(sidecar_path("test_file"))
+
+
+def test_journal_broken_record(journal):
+    journal.begin()
+    journal.finish_folder("test_source")
+    journal.close()
+    with open("test.journal", 'a', encoding='utf-8') as file:
+        file.write('{"op": "fold')
+    j = Journal("test.journal")
+    resumed = j.begin()
+    j.close()
+    assert resumed and j.is_finished("test_source")
@@ -0,0 +1,77 @@
+import os
+import pytest
+
+from manifest import Manifest, FileState, FolderState
+from digest import file_digest
+
+
+@pytest.fixture()
+def manifest():
+    m = Manifest("test.manifest")
+    yield m
+    m.close()
+    os.remove("test.manifest")
+
+
+def test_file_state_matches():
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    state = FileState.from_stat(os.stat("test_file"), file_digest("test_file"))
+    status = state.matches(os.stat("test_file"))
+    with open("test_file", 'a') as file:
+        file.write("\nappended text")
+    status = status and not state.matches(os.stat("test_file"))
+    os.remove("test_file")
+    assert status
+
+
+def test_file_digest_differs():
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+    with open("test_file1", 'w+') as file:
+        file.write("old line")
+    status = file_digest("test_file") != file_digest("test_file1")
+    os.remove("test_file")
+    os.remove("test_file1")
+    assert status
+
+
+def test_manifest_persists():
+    state = FileState(10, 20, 30, "abc")
+    manifest = Manifest("test.manifest")
+    manifest.put("folder/file", state)
+    manifest.close()
+    reopened = Manifest("test.manifest")
+    status = reopened.get("folder/file") == state
+    reopened.close()
+    os.remove("test.manifest")
+    assert status
+
+
+def test_manifest_discard_folder(manifest):
+    manifest.put("folder/file", FileState(1, 1, 1, None))
+    manifest.put("folder/inner/file", FileState(1, 1, 1, None))
+    manifest.put("folder1/file", FileState(1, 1, 1, None))
+    manifest.put("folder0", FileState(1, 1, 1, None))
+    manifest.discard("folder")
+    assert manifest.get("folder/file") is None and manifest.get("folder/inner/file") is None
+    assert manifest.get("folder1/file") is not None and manifest.get("folder0") is not None
+
+
+def test_manifest_move_folder(manifest):
+    manifest.put("folder/file", FileState(1, 1, 1, None))
+    manifest.put("folder/inner/file", FileState(2, 2, 2, None))
+    manifest.put("folder1/file", FileState(3, 3, 3, None))
+    manifest.put("moved/old", FileState(4, 4, 4, None))
+    manifest.move("folder", "moved")
+    assert manifest.get("moved/file").size == 1 and manifest.get("moved/inner/file").size == 2
+    assert manifest.get("folder/file") is None and manifest.get("moved/old") is None
+    assert manifest.get("folder1/file").size == 3
+
+
+def test_manifest_folder_state(manifest):
+    state = FolderState(10, 20, (("text", False, 5, 30), ("inner", True, 0, 40)))
+    manifest.put_folder("test_source/inner", state)
+    status = manifest.get_folder("test_source/inner") == state
+    manifest.discard("test_source")
+    assert status and manifest.get_folder("test_source/inner") is None
@@ -0,0 +1,34 @@
+import os
+
+from folder import Entry
+from plan import Plan, Operation, batches, SMALL_FILE, BATCH_FILES
+
+
+def entry(size: int, is_dir: bool = False) -> Entry:
+    with open("test_file", 'wb') as file:
+        file.truncate(size)
+    e = Entry.from_path("test_file")
+    os.remove("test_file")
+    e.is_dir = is_dir
+    return e
+
+
+def test_plan_counts_and_bytes():
+    plan = Plan()
+    plan.add(Operation('create', "s/a", "r/a", entry(10)))
+    plan.add(Operation('update', "s/b", "r/b", entry(20)))
+    plan.add(Operation('mkdir', "s/c", "r/c", entry(0, True)))
+    plan.add(Operation('move', "s/d", "r/d", entry(30), "r/e"))
+    plan.add(Operation('delete', None, "r/f", entry(40)))
+    assert len(plan) == 5 and plan.bytes_to_transfer == 30
+    assert plan.counts() == {'mkdir': 1, 'move': 1, 'create': 1, 'update': 1, 'delete': 1}
+    assert [operation.target for operation in plan.of_kind('move')] == ["r/d"]
+    assert plan.of_kind('move')[0].describe() == "move   r/e -> r/d"
+
+
+def test_batches():
+    small, big = entry(1), entry(SMALL_FILE)
+    operations = [Operation('create', f"s/{i}", f"r/{i}", small) for i in range(BATCH_FILES + 1)]
+    operations.insert(1, Operation('create', "s/big", "r/big", big))
+    sizes = [len(batch) for batch in batches(operations)]
+    assert sizes == [1, BATCH_FILES, 1]
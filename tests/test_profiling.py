@@ -0,0 +1,58 @@
+import os
+import json
+import shutil
+
+import profiling
+from profiling import Profiler, Histogram, timed
+from folder import Folder
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.add(0.000001)
+    histogram.add(0.5)
+    assert histogram.count == 100 and histogram.max == 0.5
+    assert histogram.percentile(0.5) <= 0.000002 and histogram.percentile(1.0) == 0.5
+
+
+def test_timed_only_while_active():
+    @timed('work')
+    def work(path):
+        return path
+
+    profiler = Profiler(top=2)
+    work("before")
+    with profiler:
+        for path in ("a", "b", "c"):
+            work(path)
+    work("after")
+    assert profiler.histograms['work'].count == 3 and profiling._active is None
+    assert len(profiler.slowest()) == 2
+
+
+def test_profile_folder_operations():
+    try:
+        shutil.rmtree("test_folder")
+    except:
+        pass
+    os.mkdir("test_folder")
+    with open("test_file", 'w+') as file:
+        file.write("new line")
+
+    profiler = Profiler(trace=True)
+    folder = Folder("test_folder")
+    with profiler:
+        folder.scan_sorted("test_folder")
+        folder.copy_into("test_file", "test_folder/test_file")
+        Folder.compare_files("test_file", "test_folder/test_file")
+        folder.remove("test_folder/test_file")
+    profiler.dump_trace("test_file.json")
+    with open("test_file.json") as file:
+        events = json.load(file)['traceEvents']
+    os.remove("test_file.json")
+    os.remove("test_file")
+    shutil.rmtree("test_folder")
+    assert sorted(profiler.histograms) == ['compare', 'copy', 'list', 'remove']
+    assert [event['name'] for event in events] == ['list', 'copy', 'compare', 'remove']
+    assert events[1]['args']['path'] == "test_file" and "test_file" in profiler.report()
@@ -0,0 +1,41 @@
+import os
+import pytest
+
+from stats import SyncStats
+from scheduler import AdaptiveScheduler
+
+
+def cycle(wall_time: float = 0.0, **changed_folders) -> SyncStats:
+    stats = SyncStats()
+    for folder, changes in changed_folders.items():
+        for _ in range(changes):
+            stats.change(folder.replace('__', os.sep))
+            stats.add('files_copied')
+    stats.wall_time = wall_time
+    return stats
+
+
+def test_backoff_and_speedup():
+    scheduler = AdaptiveScheduler(100, 10, 400)
+    assert scheduler.record_cycle(cycle()) == 200
+    assert scheduler.record_cycle(cycle()) == 400
+    assert scheduler.record_cycle(cycle()) == 400
+    assert scheduler.record_cycle(cycle(inner=1)) == 200
+
+
+def test_long_cycle_is_not_repeated_at_once():
+    scheduler = AdaptiveScheduler(100, 10, 400, max_duty=0.5)
+    assert scheduler.record_cycle(cycle(1000, inner=1)) == pytest.approx(1000)
+
+
+def test_hot_subtrees():
+    scheduler = AdaptiveScheduler(100, depth=1)
+    scheduler.record_cycle(cycle(hot__a__b=3, cold=1))
+    scheduler.record_rescan(cycle(hot__c=2))
+    assert scheduler.hot_subtrees() == ["hot", "cold"]
+    # scores of quiet subtrees decay
+    scheduler.record_cycle(cycle())
+    assert scheduler.hot_subtrees() == ["hot"]
+    for _ in range(5):
+        scheduler.record_cycle(cycle())
+    assert scheduler.hot_subtrees() == []
@@ -0,0 +1,43 @@
+import os
+import json
+import urllib.request
+
+from stats import SyncStats, StatsFile, MetricsServer
+
+
+def test_sync_stats_phases():
+    stats = SyncStats()
+    with stats.phase('copy'):
+        stats.add('files_copied')
+        stats.add('bytes_copied', 10)
+    stats.finish(errors=2)
+    result = stats.as_dict()
+    assert result['files_copied'] == 1 and result['bytes_copied'] == 10 and result['errors'] == 2
+    assert result['phases']['copy'] > 0 and result['wall_time'] >= result['phases']['copy']
+
+
+def test_stats_file_lines():
+    stats_file = StatsFile("test_stats.jsonl")
+    for _ in range(2):
+        stats = SyncStats()
+        stats.add('removals', 3)
+        stats.finish(errors=0)
+        stats_file.publish(stats)
+    with open("test_stats.jsonl") as file:
+        lines = [json.loads(line) for line in file]
+    os.remove("test_stats.jsonl")
+    assert len(lines) == 2 and all(line['removals'] == 3 for line in lines)
+
+
+def test_metrics_server():
+    server = MetricsServer(0)
+    stats = SyncStats()
+    stats.add('files_copied', 5)
+    stats.finish(errors=0)
+    server.publish(stats)
+    server.publish(stats)
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+        body = response.read().decode('utf-8')
+    server.close()
+    assert "folder_sync_cycles_total 2" in body and "folder_sync_files_copied_total 10" in body
+    assert 'folder_sync_last_phase_seconds{phase="scan"}' in body
@@ -1,10 +1,17 @@
 import os
+import json
 import shutil
 import stat
 import pytest
 
+import fastcopy
 from folder import Folder
 from synchronizer import Synchronizer
+from manifest import Manifest
+from journal import Journal
+from dedup import DedupIndex
+from digest import Comparator, file_digest
+from filters import Filter
 
 
 @pytest.fixture()
@@ -190,3 +197,572 @@ def test_sync_folders_new_folder(source, replica):
     shutil.rmtree(source.path)
     shutil.rmtree(replica.path)
     assert status
+
+
+def test_sync_folders_manifest_skips_unchanged(source, replica, monkeypatch):
+    with open(source.path + "/text", 'w+') as file:
+        file.write("text line")
+    shutil.copy2(source.path + "/text", replica.path + '/text')
+
+    m = Manifest("test.manifest")
+    s = Synchronizer(source, replica, m)
+    s.sync_folders()
+    hashed = list()
+    monkeypatch.setattr("synchronizer.file_digest", lambda path, *args, **kwargs: hashed.append(path))
+    errors = s.sync_folders()
+    m.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert hashed == [] and errors == ([], [])
+
+
+def test_sync_folders_manifest_keeps_comparator(source, replica):
+    with open(source.path + "/text", 'w+') as file:
+        file.write("text line")
+    shutil.copy2(source.path + "/text", replica.path + '/text')
+    compared = list()
+
+    class TrackingComparator(Comparator):
+        def same(self, file_path1, file_path2, entry1=None, entry2=None):
+            compared.append(file_path1)
+            return super().same(file_path1, file_path2, entry1, entry2)
+
+    m = Manifest("test.manifest")
+    s = Synchronizer(source, replica, m, comparator=TrackingComparator())
+    s.sync_folders()
+    m.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    # manifest replaces byte by byte comparison only
+    assert compared == [source.path + "/text"]
+
+
+def test_sync_folders_parallel(source, replica):
+    os.mkdir(source.path + "/inner")
+    for i in range(20):
+        with open(source.path + f"/inner/new{i}", 'w+') as file:
+            file.write(f"file{i}")
+    with open(replica.path + '/obsolete', 'w+') as file:
+        file.write('obsolete line')
+
+    s = Synchronizer(source, replica, workers=4)
+    remove_errors, update_errors = s.sync_folders()
+    status = os.listdir(replica.path) == ['inner'] and len(os.listdir(replica.path + '/inner')) == 20
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and remove_errors == [] and update_errors == []
+
+
+def test_sync_folders_parallel_errors(source, replica, monkeypatch):
+    with open(source.path + "/text", 'w+') as file:
+        file.write("text line")
+
+    def fail(src, dst):
+        raise OSError("disk is full")
+    monkeypatch.setattr(replica, "copy_into", fail)
+    s = Synchronizer(source, replica, workers=2)
+    remove_errors, update_errors = s.sync_folders()
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert update_errors == [os.path.join(source.path, "text")]
+
+
+def test_sync_paths(source, replica):
+    os.mkdir(source.path + "/inner")
+    with open(source.path + "/inner/new", 'w+') as file:
+        file.write("new file")
+    with open(source.path + "/untouched", 'w+') as file:
+        file.write("untouched file")
+    with open(replica.path + '/obsolete', 'w+') as file:
+        file.write('obsolete line')
+
+    s = Synchronizer(source, replica)
+    errors = s.sync_paths([os.path.join("inner", "new"), "obsolete"])
+    status = set(os.listdir(replica.path)) == {"inner"} and os.listdir(replica.path + "/inner") == ["new"]
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], [])
+
+
+def test_sync_folders_stats_once(source, replica, monkeypatch):
+    os.mkdir(source.path + "/inner")
+    for name in ("inner/text", "text"):
+        with open(source.path + "/" + name, 'w+') as file:
+            file.write("text line")
+    s = Synchronizer(source, replica)
+    s.sync_folders()
+
+    stat_calls = list()
+    original_stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        stat_calls.append(path)
+        return original_stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, "stat", counting_stat)
+    s.sync_folders()
+    monkeypatch.undo()
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    # only roots are checked for existence
+    assert stat_calls == [source.path, replica.path]
+
+
+def test_sync_folders_renamed_file(source, replica):
+    with open(source.path + "/text", 'w+') as file:
+        file.write("text line")
+    s = Synchronizer(source, replica)
+    s.sync_folders()
+    inode = os.stat(replica.path + "/text").st_ino
+    os.rename(source.path + "/text", source.path + "/renamed")
+    s.sync_folders()
+    status = os.listdir(replica.path) == ["renamed"] and os.stat(replica.path + "/renamed").st_ino == inode
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and s.stats.renames == 1 and s.stats.rename_bytes_saved == len("text line")
+
+
+def test_sync_folders_moved_folder(source, replica):
+    os.mkdir(source.path + "/inner")
+    os.mkdir(source.path + "/inner/folder")
+    os.mkdir(source.path + "/other")
+    with open(source.path + "/inner/folder/text", 'w+') as file:
+        file.write("text line")
+    m = Manifest("test.manifest")
+    s = Synchronizer(source, replica, m)
+    # the first cycle copies new folders entirely, the second one records their content
+    s.sync_folders()
+    s.sync_folders()
+    inode = os.stat(replica.path + "/inner/folder/text").st_ino
+    os.rename(source.path + "/inner/folder", source.path + "/other/moved")
+    s.sync_folders()
+    status = os.listdir(replica.path + "/inner") == [] and os.listdir(replica.path + "/other") == ["moved"]
+    status = status and os.stat(replica.path + "/other/moved/text").st_ino == inode
+    m.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and s.stats.renames == 1 and s.stats.rename_bytes_saved == len("text line")
+
+
+def test_sync_folders_stats(source, replica):
+    os.mkdir(source.path + "/inner")
+    with open(source.path + "/inner/text", 'w+') as file:
+        file.write("text line")
+    with open(source.path + "/modified", 'w+') as file:
+        file.write("new line")
+    with open(replica.path + "/modified", 'w+') as file:
+        file.write("old line")
+    with open(replica.path + '/obsolete', 'w+') as file:
+        file.write('obsolete line')
+
+    s = Synchronizer(source, replica)
+    s.sync_folders()
+    stats = s.stats
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert stats.dirs_scanned == 1 and stats.files_compared == 1 and stats.bytes_compared == 2 * len("new line")
+    assert stats.files_copied == 2 and stats.bytes_copied == len("text line") + len("new line")
+    assert stats.removals == 1 and stats.errors == 0 and stats.wall_time > 0
+
+
+def test_sync_folders_deep_tree(source, replica):
+    path = os.path.join(replica.path, *["inner"] * 100)
+    os.makedirs(path)
+    os.makedirs(os.path.join(source.path, *["inner"] * 100))
+    for base in (source.path, os.path.dirname(path.replace(replica.path, source.path, 1))):
+        with open(base + "/text", 'w+') as file:
+            file.write("text line")
+    with open(path + "/obsolete", 'w+') as file:
+        file.write("obsolete line")
+
+    s = Synchronizer(source, replica)
+    errors = s.sync_folders()
+    status = not os.path.exists(path + "/obsolete")
+    status = status and os.path.exists(os.path.join(os.path.dirname(path), "text"))
+    dirs_scanned = s.stats.dirs_scanned
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], []) and dirs_scanned == 101
+
+
+def test_sync_folders_error_limit(source, replica, monkeypatch):
+    for i in range(5):
+        with open(source.path + f"/text{i}", 'w+') as file:
+            file.write("text line")
+
+    def fail(src, dst, entry=None):
+        raise OSError("copy failed")
+
+    monkeypatch.setattr(replica, "copy_into", fail)
+    s = Synchronizer(source, replica, error_limit=2, error_file="test_file")
+    remove_errors, update_errors = s.sync_folders()
+    with open("test_file", encoding='utf-8') as file:
+        spilled = file.read().splitlines()
+    os.remove("test_file")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert len(update_errors) == 5 and len(list(update_errors)) == 2 and len(spilled) == 3
+    assert all(line.startswith("update\t") for line in spilled) and s.stats.errors == 5
+
+
+def test_sync_folders_resume(source, replica):
+    os.mkdir(source.path + "/inner")
+    os.mkdir(replica.path + "/inner")
+    for folder in (source.path, replica.path):
+        with open(folder + "/text", 'w+') as file:
+            file.write("same line" if folder == replica.path else "text line")
+        with open(folder + "/inner/text", 'w+') as file:
+            file.write("same line" if folder == replica.path else "text line")
+    with open(source.path + "/new", 'w+') as file:
+        file.write("new line")
+    # the root folder was finished by the interrupted cycle
+    j = Journal("test.journal")
+    j.begin()
+    j.finish_folder(source.path)
+    j.close()
+
+    j = Journal("test.journal")
+    s = Synchronizer(source, replica, journal=j)
+    s.sync_folders()
+    status = os.listdir(replica.path + "/inner") == ["text"] and os.path.exists(replica.path + "/new")
+    status = status and not Folder.compare_files(source.path + "/text", replica.path + "/text")
+    status = status and Folder.compare_files(source.path + "/inner/text", replica.path + "/inner/text")
+    # the next cycle starts from scratch
+    s.sync_folders()
+    status = status and Folder.compare_files(source.path + "/text", replica.path + "/text")
+    j.close()
+    os.remove("test.journal")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status
+
+
+def test_plan_dry_run(source, replica):
+    os.mkdir(source.path + "/inner")
+    with open(source.path + "/inner/new", 'w+') as file:
+        file.write("new line")
+    with open(source.path + "/modified", 'w+') as file:
+        file.write("new line")
+    with open(replica.path + "/modified", 'w+') as file:
+        file.write("old line")
+    with open(replica.path + "/obsolete", 'w+') as file:
+        file.write("obsolete line")
+
+    s = Synchronizer(source, replica)
+    plan = s.plan()
+    untouched = sorted(os.listdir(replica.path)) == ["modified", "obsolete"]
+    kinds = sorted((operation.kind, operation.target) for operation in plan)
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert untouched and plan.bytes_to_transfer == 2 * len("new line")
+    assert kinds == [('create', os.path.join(replica.path, "inner", "new")),
+                     ('delete', os.path.join(replica.path, "obsolete")),
+                     ('mkdir', os.path.join(replica.path, "inner")),
+                     ('update', os.path.join(replica.path, "modified"))]
+
+
+def test_sync_folders_journals_updates_in_place(source, replica, monkeypatch):
+    with open(source.path + "/text", 'w+') as file:
+        file.write("line of text" * 100)
+    with open(replica.path + "/text", 'w+') as file:
+        file.write("line of test" + "line of text" * 99)
+
+    def fail_reflink(src, dst):
+        raise OSError("reflinks are not supported")
+    monkeypatch.setattr(fastcopy, 'reflink', fail_reflink)
+    j = Journal("test.journal")
+    s = Synchronizer(source, Folder(replica.path, delta_threshold=100, block_size=64), journal=j)
+    errors = s.sync_folders()
+    j.close()
+    with open("test.journal") as file:
+        records = [json.loads(line) for line in file]
+    status = Folder.compare_files(source.path + "/text", replica.path + "/text")
+    os.remove("test.journal")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], [])
+    # the file rewritten in place would be removed by the next cycle if the update was interrupted
+    assert [record.get('tmp') for record in records if record['op'] == 'copy'][-1] == replica.path + "/text"
+
+
+def test_plan_execute_journal(source, replica):
+    with open(source.path + "/text", 'w+') as file:
+        file.write("text line")
+    # a copy interrupted by the previous cycle
+    tmp = replica.temp_path(replica.path + "/text")
+    j = Journal("test.journal")
+    j.begin()
+    j.planned(tmp)
+    with open(tmp, 'w+') as file:
+        file.write("text")
+    j.close()
+
+    j = Journal("test.journal")
+    s = Synchronizer(source, replica, journal=j)
+    errors = s.execute(s.plan())
+    j.close()
+    with open("test.journal") as file:
+        ops = [json.loads(line)['op'] for line in file]
+    status = os.listdir(replica.path) == ["text"]
+    os.remove("test.journal")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], [])
+    assert ops[-3:] == ["copy", "copied", "end"] and "resume" in ops
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_plan_execute(source, replica, workers):
+    os.makedirs(source.path + "/inner/deep")
+    with open(source.path + "/inner/deep/new", 'w+') as file:
+        file.write("new line")
+    with open(source.path + "/renamed", 'w+') as file:
+        file.write("text line")
+    with open(replica.path + "/text", 'w+') as file:
+        file.write("text line")
+    with open(source.path + "/modified", 'w+') as file:
+        file.write("new line")
+    with open(replica.path + "/modified", 'w+') as file:
+        file.write("old line")
+    with open(replica.path + "/obsolete", 'w+') as file:
+        file.write("obsolete line")
+    inode = os.stat(replica.path + "/text").st_ino
+
+    s = Synchronizer(source, replica, workers=workers)
+    errors = s.execute(s.plan())
+    status = sorted(os.listdir(replica.path)) == ["inner", "modified", "renamed"]
+    status = status and os.stat(replica.path + "/renamed").st_ino == inode
+    status = status and Folder.compare_files(source.path + "/modified", replica.path + "/modified")
+    status = status and Folder.compare_files(source.path + "/inner/deep/new", replica.path + "/inner/deep/new")
+    stats = s.stats
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], [])
+    assert stats.renames == 1 and stats.removals == 1 and stats.files_copied == 2
+
+
+def test_sync_folders_changed_folders(source, replica):
+    os.makedirs(source.path + "/inner/deep")
+    os.makedirs(replica.path + "/inner/deep")
+    with open(source.path + "/inner/deep/new", 'w+') as file:
+        file.write("new line")
+    with open(source.path + "/new", 'w+') as file:
+        file.write("new line")
+    with open(replica.path + "/inner/obsolete", 'w+') as file:
+        file.write("obsolete line")
+
+    s = Synchronizer(source, replica)
+    s.sync_folders()
+    changed = dict(s.stats.changed_folders)
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert changed == {".": 1, "inner": 1, os.path.join("inner", "deep"): 1}
+
+
+@pytest.mark.parametrize("mode", ['stat', 'trust-mtime'])
+def test_sync_folders_skip_unchanged(source, replica, monkeypatch, mode):
+    os.makedirs(source.path + "/inner/deep")
+    with open(source.path + "/inner/text", 'w+') as file:
+        file.write("text line")
+    # folders modified just now are not fingerprinted
+    for folder in (source.path, source.path + "/inner", source.path + "/inner/deep"):
+        os.utime(folder, ns=(10 ** 18, 10 ** 18))
+    m = Manifest("test.manifest")
+    s = Synchronizer(source, replica, m, skip_unchanged=mode)
+    s.sync_folders()
+    s.sync_folders()
+    first_skipped = s.stats.dirs_skipped
+    scanned = list()
+    scan_sorted = Folder.scan_sorted
+    monkeypatch.setattr(Folder, "scan_sorted", lambda self, path: scanned.append(path) or scan_sorted(self, path))
+    s.sync_folders()
+    skipped, listed = s.stats.dirs_skipped, list(scanned)
+    with open(source.path + "/inner/text", 'a') as file:
+        file.write("\nnew line")
+    s.sync_folders()
+    updated = Folder.compare_files(source.path + "/inner/text", replica.path + "/inner/text")
+    m.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert first_skipped == 1 and skipped == 3 and listed == []
+    assert updated == (mode == 'stat')
+
+
+def test_plan_skip_unchanged(source, replica, monkeypatch):
+    os.makedirs(source.path + "/inner/deep")
+    with open(source.path + "/inner/text", 'w+') as file:
+        file.write("text line")
+    for folder in (source.path, source.path + "/inner", source.path + "/inner/deep"):
+        os.utime(folder, ns=(10 ** 18, 10 ** 18))
+    m = Manifest("test.manifest")
+    s = Synchronizer(source, replica, m, skip_unchanged='stat')
+    errors = s.execute(s.plan())
+    # fingerprints are recorded by executed plans
+    s.execute(s.plan())
+    scanned = list()
+    scan_sorted = Folder.scan_sorted
+    monkeypatch.setattr(Folder, "scan_sorted", lambda self, path: scanned.append(path) or scan_sorted(self, path))
+    plan = s.plan()
+    skipped, listed = s.stats.dirs_skipped, list(scanned)
+    with open(source.path + "/inner/text", 'a') as file:
+        file.write("\nnew line")
+    changed = [operation.target for operation in s.plan()]
+    m.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert errors == ([], []) and len(plan) == 0 and skipped == 3 and listed == []
+    assert changed == [replica.path + "/inner/text"]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_sync_folders_small_files(source, replica, workers, monkeypatch):
+    os.mkdir(source.path + "/inner")
+    for i in range(100):
+        with open(source.path + f"/inner/{i}", 'w+') as file:
+            file.write(f"small file {i}")
+    with open(source.path + "/big", 'wb') as file:
+        file.write(os.urandom(2048))
+    os.symlink("inner/0", source.path + "/link")
+    os.mkdir(replica.path + "/inner")
+    batches = list()
+    copy_small_files = Folder.copy_small_files
+
+    def tracking(self, files, buffer):
+        batches.append(len(files))
+        return copy_small_files(self, files, buffer)
+    monkeypatch.setattr(Folder, "copy_small_files", tracking)
+
+    s = Synchronizer(source, replica, workers=workers, small_file_size=1024)
+    errors = s.sync_folders()
+    status = all(Folder.compare_files(source.path + f"/inner/{i}", replica.path + f"/inner/{i}") for i in range(100))
+    status = status and Folder.compare_files(source.path + "/big", replica.path + "/big")
+    status = status and os.readlink(replica.path + "/link") == "inner/0"
+    stats = s.stats
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], [])
+    # the symlink is copied alone after its batch
+    assert sorted(batches) == [1, 36, 64] and stats.files_copied == 102
+
+
+def test_plan_execute_small_files(source, replica):
+    for name in ("a", "b"):
+        with open(source.path + "/" + name, 'w+') as file:
+            file.write("text line")
+    # a folder replaced by a small file
+    os.mkdir(replica.path + "/b")
+
+    s = Synchronizer(source, replica, small_file_size=1024)
+    errors = s.execute(s.plan())
+    status = all(Folder.compare_files(source.path + "/" + name, replica.path + "/" + name) for name in ("a", "b"))
+    stats = s.stats
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], []) and stats.files_copied == 2
+
+
+def test_sync_folders_dedup(source, replica):
+    content = os.urandom(4096)
+    os.mkdir(source.path + "/inner")
+    for path in ("/a", "/inner/b", "/inner/c"):
+        with open(source.path + path, 'wb') as file:
+            file.write(content)
+    index = DedupIndex("test.manifest", min_size=1024)
+
+    s = Synchronizer(source, replica, dedup=index)
+    errors = s.sync_folders()
+    inodes = {os.stat(replica.path + path).st_ino for path in ("/a", "/inner/b", "/inner/c")}
+    status = all(Folder.compare_files(source.path + path, replica.path + path) for path in ("/a", "/inner/b"))
+    first = (s.stats.dedup_links, s.stats.dedup_bytes_saved, s.stats.bytes_copied)
+    # a linked copy is replaced instead of being changed in place
+    with open(source.path + "/a", 'wb') as file:
+        file.write(os.urandom(4096))
+    os.remove(source.path + "/inner/b")
+    s.sync_folders()
+    status = status and Folder.compare_files(source.path + "/a", replica.path + "/a")
+    status = status and Folder.compare_files(source.path + "/inner/c", replica.path + "/inner/c")
+    found = index.find(file_digest(source.path + "/inner/c"))
+    index.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert status and errors == ([], []) and len(inodes) == 1
+    assert first == (2, 8192, 4096) and found[0] == os.path.join(replica.path, "inner", "c")
+
+
+def test_sync_folders_filters():
+    for path in ("test_source", "test_replica"):
+        shutil.rmtree(path, ignore_errors=True)
+        os.mkdir(path)
+    os.makedirs("test_source/cache/inner")
+    os.mkdir("test_replica/cache")
+    for path in ("test_source/a", "test_source/a.tmp", "test_source/cache/inner/b", "test_replica/cache/local",
+                 "test_replica/local.tmp"):
+        with open(path, 'w+') as file:
+            file.write("text line")
+    filters = Filter(["*.tmp", "cache/"])
+    s = Synchronizer(Folder("test_source", filters=filters), Folder("test_replica", filters=filters))
+    s.sync_folders()
+    s.sync_paths(["a.tmp", "cache/inner/b"])
+    listed = sorted(os.listdir("test_replica"))
+    local = os.listdir("test_replica/cache")
+    shutil.rmtree("test_source")
+    shutil.rmtree("test_replica")
+    # excluded files are neither copied nor removed
+    assert listed == ["a", "cache", "local.tmp"] and local == ["local"]
+
+
+def test__remove_obsolete_keeps_excluded():
+    shutil.rmtree("test_replica", ignore_errors=True)
+    os.mkdir("test_replica")
+    for name in ("text", "text.tmp"):
+        with open("test_replica/" + name, 'w+') as file:
+            file.write("text line")
+    s = Synchronizer(Folder("test_replica"), Folder("test_replica", filters=Filter(["*.tmp"])))
+    s._remove_obsolete(set(), set(os.listdir("test_replica")), "test_replica")
+    left = os.listdir("test_replica")
+    shutil.rmtree("test_replica")
+    assert left == ["text.tmp"]
+
+
+def test_sync_folders_manifest_forgets_removed_sources(source, replica):
+    for i in range(3):
+        with open(source.path + f"/text{i}", 'w+') as file:
+            file.write(f"text line {i}")
+    m = Manifest("test.manifest")
+    s = Synchronizer(source, replica, m)
+    s.sync_folders()
+    s.sync_folders()
+    recorded = [m.get(source.path + f"/text{i}") is not None for i in range(3)]
+    os.remove(source.path + "/text0")
+    os.rename(source.path + "/text1", source.path + "/renamed")
+    s.sync_folders()
+    left = [m.get(source.path + f"/text{i}") is not None for i in range(3)]
+    m.close()
+    os.remove("test.manifest")
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert recorded == [True, True, True] and left == [False, False, True]
+
+
+def test_sync_folders_renames_hash_files_once(source, replica, monkeypatch):
+    for i in range(4):
+        with open(source.path + f"/text{i}", 'w+') as file:
+            file.write(f"text line {i}")
+    s = Synchronizer(source, replica)
+    s.sync_folders()
+    for i in range(4):
+        os.rename(source.path + f"/text{i}", source.path + f"/renamed{i}")
+    hashed = list()
+    digest = Comparator.digest
+    monkeypatch.setattr(Comparator, "digest", lambda self, path, *args: hashed.append(path) or digest(self, path, *args))
+    s.sync_folders()
+    names = sorted(os.listdir(replica.path))
+    shutil.rmtree(source.path)
+    shutil.rmtree(replica.path)
+    assert names == [f"renamed{i}" for i in range(4)] and s.stats.renames == 4
+    assert len(hashed) == len(set(hashed)) == 8
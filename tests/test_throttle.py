@@ -0,0 +1,76 @@
+import os
+import pytest
+from datetime import datetime
+
+from folder import Folder
+from throttle import TokenBucket, Throttle, Profile, parse_rate
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_parse_rate():
+    assert parse_rate("512K") == 512 * 1024 and parse_rate("2m") == 2 * 1024 * 1024
+    assert parse_rate("100") == 100 and parse_rate("-") is None
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(100, clock=clock, sleep=clock.sleep)
+    # a full bucket lets a burst through
+    assert bucket.consume(100) == 0
+    assert bucket.consume(50) == pytest.approx(0.5)
+    # waiting paid the debt, the next second refills the bucket
+    clock.now += 1
+    assert bucket.consume(150) == pytest.approx(0.5)
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_profile():
+    profile = Profile.parse("22:00-06:00=10M/-")
+    assert profile.bytes_per_second == 10 * 1024 * 1024 and profile.ops_per_second is None
+    assert profile.active(23 * 60) and profile.active(60) and not profile.active(12 * 60)
+    with pytest.raises(ValueError):
+        Profile.parse("22:00=10M")
+
+
+def test_throttle_profiles():
+    clock = FakeClock()
+    now = datetime(2024, 1, 1, 12, 0)
+    throttle = Throttle(100, None, [Profile.parse("09:00-18:00=10/5")], now=lambda: now, clock=clock,
+                        sleep=clock.sleep)
+    assert throttle.limits() == (10, 5)
+    throttle.transfer(20)
+    assert throttle.throttled_time == pytest.approx(1.0)
+    now = datetime(2024, 1, 1, 20, 0)
+    clock.now += 1
+    assert throttle.limits() == (100, None)
+    throttle.operation()
+    throttle.transfer(10)
+    assert throttle.throttled_time == pytest.approx(1.0)
+
+
+def test_folder_copy_throttled():
+    clock = FakeClock()
+    try:
+        os.mkdir("test_folder")
+    except FileExistsError:
+        pass
+    with open("test_file", 'wb') as file:
+        file.write(b"x" * 300)
+    throttle = Throttle(100, 10, clock=clock, sleep=clock.sleep)
+    f = Folder("test_folder", throttle=throttle)
+    f.copy_into("test_file", "test_folder/test_file")
+    f.remove("test_folder/test_file")
+    os.remove("test_file")
+    os.rmdir("test_folder")
+    # reflinks do not transfer data
+    assert throttle.throttled_time == pytest.approx(2.0) or throttle.throttled_time == 0
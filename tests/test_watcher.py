@@ -0,0 +1,58 @@
+import os
+import shutil
+import pytest
+
+from watcher import coalesce, Watcher, PollingWatcher, InotifyWatcher
+
+
+@pytest.fixture()
+def folder():
+    try:
+        shutil.rmtree("test_watched")
+    except:
+        pass
+    os.mkdir("test_watched")
+    yield "test_watched"
+    shutil.rmtree("test_watched")
+
+
+def test_coalesce_nested():
+    paths = {"inner", os.path.join("inner", "text"), "inner1", os.path.join("other", "text")}
+    assert coalesce(paths) == {"inner", "inner1", os.path.join("other", "text")}
+
+
+def test_coalesce_root():
+    assert coalesce({"inner", os.curdir}) == {os.curdir}
+
+
+def test_watcher_abstract(folder):
+    with pytest.raises(TypeError):
+        Watcher(folder)
+
+
+def test_polling_watcher_changes(folder):
+    with open(folder + "/text", 'w+') as file:
+        file.write("text line")
+    watcher = PollingWatcher(folder, interval=0.01)
+    os.remove(folder + "/text")
+    os.mkdir(folder + "/inner")
+    with open(folder + "/inner/new", 'w+') as file:
+        file.write("new line")
+    assert watcher.collect(1, debounce=0.05) == {"text", "inner"}
+
+
+def test_polling_watcher_no_changes(folder):
+    watcher = PollingWatcher(folder, interval=0.01)
+    assert watcher.collect(0.05) == set()
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self"), reason="inotify is available on Linux only")
+def test_inotify_watcher_changes(folder):
+    os.mkdir(folder + "/inner")
+    watcher = InotifyWatcher(folder)
+    with open(folder + "/inner/text", 'w+') as file:
+        file.write("text line")
+    os.rename(folder + "/inner", folder + "/moved")
+    changes = watcher.collect(1, debounce=0.05)
+    watcher.close()
+    assert changes == {"inner", "moved"}
@@ -0,0 +1,222 @@
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import logging
+import platform
+import threading
+from typing import Callable, NamedTuple, Iterable
+from datetime import datetime
+
+
+# number of ioprio_set system call on different architectures
+IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'riscv64': 30, 'armv7l': 314,
+              'ppc64le': 273, 's390x': 282}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+SUFFIXES = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_rate(spec: str) -> float | None:
+    """
+    :param spec: rate with optional binary suffix (e.g. '512K', '20M' or '100'), empty or '-' for no limit
+    :returns: rate per second or None if it's not limited
+    """
+    spec = spec.strip().upper()
+    if spec in ('', '-'):
+        return None
+    suffix = spec[-1] if spec[-1] in SUFFIXES else ''
+    return float(spec[:len(spec) - len(suffix)]) * SUFFIXES[suffix]
+
+
+class TokenBucket:
+    """Token bucket limiting average rate of consumed amounts and allowing bursts up to its capacity"""
+    rate: float
+    capacity: float
+
+    def __init__(self, rate: float, capacity: float | None = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        :param rate: number of tokens added per second
+        :param capacity: maximal number of saved tokens (one second of rate if None)
+        :param clock: monotonic clock in seconds
+        :param sleep: function waiting given number of seconds
+        """
+        if rate <= 0:
+            raise ValueError("Rate should be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        """
+        :param rate: new number of tokens added per second (capacity is scaled as well)
+        """
+        with self._lock:
+            self._refill()
+            self.capacity = self.capacity * rate / self.rate
+            self.rate = rate
+            self._tokens = min(self._tokens, self.capacity)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount: float = 1) -> float:
+        """
+        Takes tokens waiting until they are available. Amounts bigger than capacity are taken
+        on credit which is paid by the following calls
+
+        :param amount: number of tokens
+        :returns: waited time in seconds
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            self._sleep(delay)
+        return delay
+
+
+class Profile(NamedTuple):
+    """Limits applied during a period of a day"""
+    start: int
+    end: int
+    bytes_per_second: float | None
+    ops_per_second: float | None
+
+    @classmethod
+    def parse(cls, spec: str) -> "Profile":
+        """
+        :param spec: 'HH:MM-HH:MM=BYTES[/OPS]' (e.g. '09:00-18:00=10M/200', '-' means no limit)
+        """
+        try:
+            period, limits = spec.split('=')
+            start, end = (cls._minutes(point) for point in period.split('-'))
+            rates = limits.split('/')
+            ops = parse_rate(rates[1]) if len(rates) > 1 else None
+            return cls(start, end, parse_rate(rates[0]), ops)
+        except ValueError:
+            raise ValueError(f"Wrong throttling profile {spec!r}, expected 'HH:MM-HH:MM=BYTES[/OPS]'")
+
+    @staticmethod
+    def _minutes(point: str) -> int:
+        hours, minutes = point.split(':')
+        return int(hours) * 60 + int(minutes)
+
+    def active(self, minute: int) -> bool:
+        """
+        :param minute: minute of a day
+        :returns: True if the profile is applied at the minute (periods may pass midnight)
+        """
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+
+class Throttle:
+    """Limits bytes and operations per second of copies, comparisons and removals"""
+    bytes_per_second: float | None
+    ops_per_second: float | None
+    profiles: list[Profile]
+
+    def __init__(self, bytes_per_second: float | None = None, ops_per_second: float | None = None,
+                 profiles: Iterable[Profile] = (), now: Callable[[], datetime] = datetime.now,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        :param bytes_per_second: default limit of read and written bytes (not limited if None)
+        :param ops_per_second: default limit of file operations (not limited if None)
+        :param profiles: limits replacing default ones during periods of a day (the first matching is applied)
+        :param now: function returning local time
+        :param clock: monotonic clock in seconds
+        :param sleep: function waiting given number of seconds
+        """
+        self.bytes_per_second = bytes_per_second
+        self.ops_per_second = ops_per_second
+        self.profiles = list(profiles)
+        self.throttled_time = 0.0
+        self._now = now
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: dict[str, TokenBucket | None] = {'bytes': None, 'ops': None}
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def limits(self) -> tuple[float | None, float | None]:
+        """
+        :returns: limits of bytes and operations per second applied now
+        """
+        now = self._now()
+        minute = now.hour * 60 + now.minute
+        for profile in self.profiles:
+            if profile.active(minute):
+                return profile.bytes_per_second, profile.ops_per_second
+        return self.bytes_per_second, self.ops_per_second
+
+    def _bucket(self, kind: str) -> TokenBucket | None:
+        now = self._clock()
+        with self._lock:
+            # profiles are checked once a second
+            if self._checked is None or now - self._checked >= 1:
+                self._checked = now
+                for name, rate in zip(('bytes', 'ops'), self.limits()):
+                    bucket = self._buckets[name]
+                    if rate is None:
+                        self._buckets[name] = None
+                    elif bucket is None:
+                        self._buckets[name] = TokenBucket(rate, clock=self._clock, sleep=self._sleep)
+                    elif bucket.rate != rate:
+                        bucket.set_rate(rate)
+            return self._buckets[kind]
+
+    def _consume(self, kind: str, amount: float) -> None:
+        bucket = self._bucket(kind)
+        if bucket is not None:
+            delay = bucket.consume(amount)
+            if delay > 0:
+                with self._lock:
+                    self.throttled_time += delay
+
+    def transfer(self, size: int) -> None:
+        """
+        Waits until given number of bytes may be read or written
+
+        :param size: number of bytes
+        """
+        if size > 0:
+            self._consume('bytes', size)
+
+    def operation(self) -> None:
+        """
+        Waits until a file operation may be started
+        """
+        self._consume('ops', 1)
+
+
+def set_idle_io_priority() -> bool:
+    """
+    Puts current process to the idle I/O scheduling class so that it uses disks only when nobody else does.
+    Threads started afterwards inherit the priority
+
+    :returns: True if priority was changed
+    """
+    number = IOPRIO_SET.get(platform.machine())
+    if number is None:
+        logging.warning(f"ioprio_set is not supported on {platform.machine()!r}")
+        return False
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, os.getpid(), IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        err = ctypes.get_errno()
+        logging.warning(f"Could not set idle I/O priority: {os.strerror(err or errno.EPERM)}")
+        return False
+    logging.info("Running with idle I/O priority")
+    return True
@@ -0,0 +1,239 @@
+import os
+import sys
+import abc
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def coalesce(paths: set[str]) -> set[str]:
+    """
+    Drops paths which are inside of other changed paths (the outer folder is synchronized entirely)
+
+    :param paths: relative paths of changed files
+    :returns: minimal set of paths covering all changes
+    """
+    if os.curdir in paths:
+        return {os.curdir}
+    result = set()
+    for path in sorted(paths, key=len):
+        if not any(path.startswith(parent + os.sep) for parent in result):
+            result.add(path)
+    return result
+
+
+class Watcher(abc.ABC):
+    """Collects changes made in a folder"""
+    path: str
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: path to a watched folder
+        """
+        self.path = path
+
+    @abc.abstractmethod
+    def _read(self, timeout: float) -> set[str] | None:
+        """
+        Waits for changes at most 'timeout' seconds
+
+        :param timeout: waiting time in seconds
+        :returns: relative paths of changed files or None if changes were lost and full resync is needed
+        """
+
+    def collect(self, timeout: float, debounce: float = 1.0) -> set[str] | None:
+        """
+        Waits for the first change and keeps collecting changes until there are none for 'debounce' seconds
+
+        :param timeout: maximum time of waiting for the first change in seconds
+        :param debounce: quiet period in seconds after which changes are returned
+        :returns: coalesced relative paths of changed files (empty if nothing happened)
+            or None if changes were lost and full resync is needed
+        """
+        changes = self._read(timeout)
+        if not changes:
+            return changes
+        while True:
+            more = self._read(debounce)
+            if more is None:
+                return None
+            if not more:
+                return coalesce(changes)
+            changes |= more
+
+    def close(self) -> None:
+        """
+        Stops watching the folder
+        """
+
+
+class PollingWatcher(Watcher):
+    """Detects changes by comparing snapshots of folder tree (works on any platform)"""
+    interval: float
+
+    def __init__(self, path: str, interval: float = 2.0) -> None:
+        """
+        :param path: path to a watched folder
+        :param interval: time between snapshots in seconds
+        """
+        super().__init__(path)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> dict[str, tuple]:
+        snapshot = dict()
+        for root, dirs, files in os.walk(self.path):
+            for name in dirs + files:
+                full_path = os.path.join(root, name)
+                try:
+                    st = os.lstat(full_path)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(full_path, self.path)] = (st.st_mode, st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def _read(self, timeout: float) -> set[str] | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(0.0, min(self.interval, deadline - time.monotonic())))
+            snapshot = self._take_snapshot()
+            changes = {path for path in snapshot.keys() | self._snapshot.keys()
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changes or time.monotonic() >= deadline:
+                return changes
+
+
+class InotifyWatcher(Watcher):
+    """Receives changes from Linux kernel via inotify"""
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: path to a watched folder
+        """
+        super().__init__(path)
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is available on Linux only")
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._watches: dict[int, str] = dict()
+        self._overflow = False
+        try:
+            self._watch_tree(path)
+        except:
+            os.close(self._fd)
+            raise
+
+    def _watch_tree(self, path: str) -> None:
+        """
+        Adds watches for a folder and all its subfolders
+
+        :param path: path to a folder
+        """
+        for root, _, _ in os.walk(path):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                # folder could be removed while walking
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(err, os.strerror(err), root)
+            self._watches[wd] = root
+
+    def _unwatch_tree(self, path: str) -> None:
+        """
+        Removes watches of a folder and all its subfolders
+
+        :param path: path to a folder
+        """
+        for wd, folder in list(self._watches.items()):
+            if folder == path or folder.startswith(path + os.sep):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _parse(self, data: bytes) -> set[str]:
+        changes = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self._overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            folder = self._watches.get(wd)
+            if folder is None:
+                continue
+            full_path = os.path.join(folder, name) if name else folder
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(full_path)
+            elif mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                # moved folder is watched again at its new place
+                self._unwatch_tree(full_path)
+            changes.add(os.path.relpath(full_path, self.path))
+        return changes
+
+    def _read(self, timeout: float) -> set[str] | None:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        changes = set()
+        while ready:
+            try:
+                changes |= self._parse(os.read(self._fd, 1 << 16))
+            except BlockingIOError:
+                break
+        if self._overflow:
+            logging.warning("Too many changes at once, some events were lost")
+            self._overflow = False
+            return None
+        # changes of the watched folder itself are covered by full resync
+        return None if os.curdir in changes else changes
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def create_watcher(path: str, poll_interval: float = 2.0) -> Watcher:
+    """
+    Creates inotify watcher if it's supported and polling one otherwise
+
+    :param path: path to a watched folder
+    :param poll_interval: time between snapshots of polling watcher in seconds
+    :returns: watcher of a folder
+    """
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError) as e:
+        logging.warning(f"inotify is not available ({e}), falling back to polling")
+        return PollingWatcher(path, poll_interval)